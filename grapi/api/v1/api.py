@@ -56,7 +56,11 @@ class API(BaseAPI):
                     default_backend[component] = name_backend[name]  # TODO type occurs twice
 
         # Middlewares which need be loaded.
+        # NOTE: Response middlewares are processed in reverse order, compression
+        # must see the final response and coalescing the compressed stream.
         generic_middlewares = [
+            grapi_middleware.ResponseCoalescer(options),
+            grapi_middleware.ResponseCompression(),
             grapi_middleware.RequestId(),
             grapi_middleware.RequestBodyExtractor(),
             grapi_middleware.ResponseHeaders(),
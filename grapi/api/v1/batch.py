@@ -1,15 +1,26 @@
 """Batch request handler."""
 # SPDX-License-Identifier: AGPL-3.0-or-later
-from urllib.parse import urlparse
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
 
-from falcon.testing import TestClient
+import falcon
+from falcon.testing import create_environ
 
+from grapi.api.common.api import FALCON_VERSION
+from grapi.api.v1.config import BATCH_COALESCE_MIN_SIZE, BATCH_MAX_WORKERS
 from grapi.api.v1.decorators import experimental
-from grapi.api.v1.graph import AdjacencyMatrix as Graph
-from grapi.api.v1.resource import HTTPBadRequest, Resource
+from grapi.api.v1.graph import AdjacencyList as Graph
+from grapi.api.v1.graph import CycleError
+from grapi.api.v1.resource import HTTPBadRequest, Resource, _dumpb_json
 from grapi.api.v1.schema.batch import schema_validator
 
-GOOD_STATUS_CODES = (200, 201, 204)
+GOOD_STATUS_CODES = (200, 201, 204, 304)
+# Successful responses without body.
+EMPTY_STATUS_CODES = (204, 304)
+WRITE_METHODS = ("POST", "PUT", "PATCH")
 
 
 def process_request(data):
@@ -19,7 +30,7 @@ def process_request(data):
         data (dict): request payload.
 
     Returns:
-        Tuple[AdjacencyMatrix,Dict]: generated graph and requests data map based on data.
+        Tuple[AdjacencyList,Dict]: generated graph and requests data map based on data.
     """
     requests = {}
     graph = Graph(len(data['requests']))
@@ -33,7 +44,9 @@ def process_request(data):
         if request_id in requests:
             raise ValueError("duplicate request ID")
 
-        if request_id > graph.num_vertices:
+        # IDs are validated before the response is started, unique IDs
+        # within the range leave no gaps, so every dependency exists.
+        if request_id >= graph.num_vertices:
             raise ValueError("request ID is outbound")
 
         # Prepare request data map to speed up our access to O(1)
@@ -54,14 +67,16 @@ def process_request(data):
     return graph, requests
 
 
-def generate_response(status_code, request_id, response=None, message=None):
+def generate_response(status_code, request_id, message=None):
     """Generate response body.
 
+    Successful responses are generated without body, their already
+    serialized body is spliced in by dump_response.
+
     Args:
         status_code (int): HTTP status code of the received response.
         request_id (str): request ID.
-        response (Result): Falcon processed response object. Defaults to None.
-        message (str): customized message. Defaults to None.
+        message (str): error message. Defaults to None.
 
     Returns:
         Dict: generated response data.
@@ -70,11 +85,11 @@ def generate_response(status_code, request_id, response=None, message=None):
         body = {
             "error": {
                 "code": status_code,
-                "message": message or response.status,
+                "message": message,
             },
         }
     else:
-        body = response.json if status_code != 204 else None
+        body = None
 
     return {
         "id": request_id,
@@ -86,11 +101,34 @@ def generate_response(status_code, request_id, response=None, message=None):
     }
 
 
+def dump_response(response, body=None):
+    """Serialize a generated response.
+
+    Args:
+        response (Dict): generated response data.
+        body (Union[bytes,Iterable[bytes]]): serialized JSON body to use instead
+            of the body of the response data. Defaults to None.
+
+    Returns:
+        Iterable[bytes]: serialized response chunks.
+    """
+    if body is None:
+        return [_dumpb_json(response)]
+    header = b'{"id": %s, "status": %d, "headers": %s, "body": ' % (
+        _dumpb_json(response["id"]),
+        response["status"],
+        _dumpb_json(response["headers"], indent=0),
+    )
+    if isinstance(body, bytes):
+        return [header + body + b'}']
+    return itertools.chain((header,), body, (b'}',))
+
+
 def fail_dependent_requests(graph, request_id, requests):
     """Mark all dependent requests as failed.
 
     Args:
-        graph (AdjacencyMatrix): graph instance.
+        graph (AdjacencyList): graph instance.
         request_id (int): request ID.
         requests (dict): requests data map (result of process_request).
 
@@ -105,7 +143,10 @@ def fail_dependent_requests(graph, request_id, requests):
         # compatible with request IDs.
         depend_request_id += 1
 
-        for chained_request_id in chained_request_ids:
+        for chained_request_id in sorted(chained_request_ids):
+            # Already failed through another dependency.
+            if requests[chained_request_id]["processed"]:
+                continue
             requests[chained_request_id]["processed"] = True
 
             # Increasing by 1 is necessary to make Graph indices
@@ -124,6 +165,186 @@ def fail_dependent_requests(graph, request_id, requests):
     return responses
 
 
+class Dispatcher:
+    """In-process dispatcher for batch sub-requests.
+
+    Sub-requests are routed directly through the router of the API and only
+    the resource middleware is run. The parsed sub-request body is passed on
+    as is and response bodies are returned serialized, so they can be spliced
+    into the batch response without being decoded again.
+    """
+
+    def __init__(self, api):
+        self.api = api
+
+    def route(self, request):
+        """Route a sub-request without executing it.
+
+        Args:
+            request (Dict): sub-request data.
+
+        Returns:
+            Tuple[object,Dict,str]: resource, params and URI template.
+            None: when the sub-request could not be routed.
+        """
+        route = self.api._router.find(unquote(urlparse(request.get("url", "")).path))
+        if route is None:
+            return None
+        resource, _, params, uri_template = route
+        return resource, params, uri_template
+
+    def _prepare(self, req, request, store_cache, session_slot):
+        api = self.api
+
+        # Headers, dict merging has right-to-left priority.
+        headers = {**request.get("headers", {}), **req.headers}
+        # Sub-responses are embedded into the batch response, they must
+        # not be compressed.
+        headers = {k: v for k, v in headers.items() if k.lower() != 'accept-encoding'}
+
+        # URL and query string.
+        parsed_url = urlparse(request.get("url", ""))
+
+        env = create_environ(
+            path=parsed_url.path,
+            query_string=parsed_url.query,
+            method=request["method"],
+            headers=headers,
+        )
+        sub_req = api._request_type(env, options=api.req_options)
+
+        sub_req.context.request_id = req.context.get('request_id')
+        sub_req.context.server_store_cache = store_cache
+        sub_req.context.session_slot = session_slot
+        sub_req.context.json_data = request.get("body", {}) if sub_req.method in WRITE_METHODS else {}
+
+        return sub_req
+
+    def _handle_exception(self, ex, sub_req, sub_resp, params):
+        if FALCON_VERSION == 2:
+            handled = self.api._handle_exception(sub_req, sub_resp, ex, params)
+        else:
+            handled = self.api._handle_exception(ex, sub_req, sub_resp, params)
+        if not handled:
+            raise ex
+
+    def dispatch(self, req, request, store_cache, materialize=True, session_slot=0):
+        """Dispatch a sub-request.
+
+        Args:
+            req (Request): Falcon request object of the batch request.
+            request (Dict): sub-request data.
+            store_cache (Dict): resolved stores shared by the sub-requests of
+                the calling thread.
+            materialize (bool): read streamed response bodies completely,
+                otherwise the stream is returned as body. Defaults to True.
+            session_slot (int): server session of the calling thread, 0 is
+                the session of the batch request. Defaults to 0.
+
+        Returns:
+            Tuple[str,str,Union[bytes,Iterable[bytes]]]: status, content type
+                and body of the response.
+            None: when the sub-request could not be routed.
+        """
+        api = self.api
+        sub_req = self._prepare(req, request, store_cache, session_slot)
+        sub_resp = api._response_type(options=api.resp_options)
+
+        params = {}
+        try:
+            responder, params, resource, sub_req.uri_template = api._get_responder(sub_req)
+            if resource is None:
+                return None
+            for process_resource in api._middleware[1]:
+                process_resource(sub_req, sub_resp, resource, params)
+            responder(sub_req, sub_resp, **params)
+        except Exception as ex:
+            self._handle_exception(ex, sub_req, sub_resp, params)
+
+        return self._result(sub_resp, materialize)
+
+    def dispatch_items(self, req, requests, store_cache, session_slot=0):
+        """Dispatch sibling GET sub-requests for items of the same collection.
+
+        The sub-requests must route to the same resource and URI template and
+        only differ in their itemid. Routing, resource middleware (store
+        resolution, Prefer handling) and field selection are done once for
+        all of them. Backend resources with batch_prefetch fetch all items in
+        one go with prefetch_items, then each item is served in turn.
+
+        Args:
+            req (Request): Falcon request object of the batch request.
+            requests (List[Dict]): sub-requests data.
+            store_cache (Dict): resolved stores shared by the sub-requests of
+                the calling thread.
+            session_slot (int): server session of the calling thread, 0 is
+                the session of the batch request. Defaults to 0.
+
+        Returns:
+            List[Tuple[str,str,bytes]]: results in order of requests.
+        """
+        api = self.api
+        sub_req = self._prepare(req, requests[0], store_cache, session_slot)
+        sub_resp = api._response_type(options=api.resp_options)
+
+        params = {}
+        try:
+            responder, params, resource, sub_req.uri_template = api._get_responder(sub_req)
+            for process_resource in api._middleware[1]:
+                process_resource(sub_req, sub_resp, resource, params)
+        except Exception as ex:
+            self._handle_exception(ex, sub_req, sub_resp, params)
+            return [self._result(sub_resp)] * len(requests)
+
+        itemids = [self.route(request)[1]["itemid"] for request in requests]
+        resource = sub_req.context.get('resource')
+        if getattr(resource, 'batch_prefetch', False):
+            resource.prefetch_items(sub_req, params, itemids)
+
+        results = []
+        for request, itemid in zip(requests, itemids):
+            path = urlparse(request["url"]).path
+            item_params = dict(params, itemid=itemid)
+            sub_req.path = unquote(path)
+            sub_resp = api._response_type(options=api.resp_options)
+            try:
+                responder(sub_req, sub_resp, **item_params)
+            except Exception as ex:
+                self._handle_exception(ex, sub_req, sub_resp, item_params)
+            results.append(self._result(sub_resp))
+        return results
+
+    def _result(self, sub_resp, materialize=True):
+        status_code = int(sub_resp.status[:3])
+        content_type = sub_resp.content_type
+        if not content_type and status_code not in (204, 404):
+            content_type = "application/json"
+
+        return sub_resp.status, content_type, self._get_body(sub_resp, materialize)
+
+    @staticmethod
+    def _get_body(resp, materialize=True):
+        """Return the serialized body of a response.
+
+        Args:
+            resp (Response): Falcon response object.
+            materialize (bool): read streams completely. Defaults to True.
+
+        Returns:
+            Union[bytes,Iterable[bytes]]: body of the response or None.
+        """
+        if resp.body is not None:
+            body = resp.body
+            return body.encode('utf-8') if isinstance(body, str) else body
+        if resp.data is not None:
+            return resp.data
+        if resp.stream is not None:
+            if hasattr(resp.stream, 'read'):
+                return resp.stream.read()
+            return b''.join(resp.stream) if materialize else resp.stream
+        return None
+
+
 @experimental
 class BatchResource(Resource):
     """Batch resource implementation."""
@@ -131,6 +352,7 @@ class BatchResource(Resource):
     def __init__(self, options, api):
         super().__init__(options)
         self.api = api
+        self.dispatcher = Dispatcher(api)
 
     def on_post(self, req, resp):
         """Handle POST request.
@@ -145,67 +367,190 @@ class BatchResource(Resource):
         # Processing on requests to generate graph and data map.
         try:
             graph, requests = process_request(data)
-            requests_order = graph.get_sorted_vertices()
+            requests_levels = graph.get_sorted_levels()
+        except CycleError as e:
+            # Graph indices start from 0, request IDs from 1.
+            raise HTTPBadRequest("request has cycle: %s" % ", ".join(str(v_id + 1) for v_id in e.cycle))
         except ValueError as e:
             # Change context by replacing graph-related words to request-related words.
             msg = str(e).replace("graph", "request").replace("vertex", "request")
             raise HTTPBadRequest(msg)
 
-        responses = []
-        client = TestClient(self.api)
-
-        for request_id in requests_order:
-            request = requests[request_id]["request"]
-            # Ignore a request which is already processed.
-            # It is used for dependency failure.
-            if requests[request_id]["processed"]:
-                continue
-            requests[request_id]["processed"] = True
+        # Sub-responses are written as soon as they are available.
+        resp.content_type = 'application/json'
+        resp.status = falcon.HTTP_200
+        resp.stream = self._stream(req, graph, requests, requests_levels)
 
-            # Headers.
-            custom_headers = request.get("headers", {})
-            # dict merging has right-to-left priority
-            headers = {**custom_headers, **req.headers}
+    def _stream(self, req, graph, requests, requests_levels):
+        """Execute sub-requests and generate the batch response.
 
-            # URL and query string.
-            parsed_url = urlparse(request.get("url", ""))
+        Args:
+            req (Request): Falcon request object.
+            graph (AdjacencyList): graph instance.
+            requests (dict): requests data map (result of process_request).
+            requests_levels (List[List]): dependency levels of the requests.
 
+        Yields:
+            bytes: chunks of the batch response.
+        """
+        workers = max(BATCH_MAX_WORKERS, 1)
+
+        # Sessions and the pyko objects opened with them are not shared
+        # between threads. Every worker uses a server session of its own
+        # (see _server) and resolves stores into its own cache, the calling
+        # thread uses the session of the batch request.
+        local = threading.local()
+        local.store_cache = {}
+        local.session_slot = 0
+        slots = itertools.count(1)
+
+        def init_worker():
+            local.store_cache = {}
+            local.session_slot = next(slots)
+
+        def dispatch(task, materialize=True):
+            task_requests = [requests[request_id]["request"] for request_id in task]
+            store_cache, session_slot = local.store_cache, local.session_slot
             try:
-                response = client.simulate_request(
-                    method=request["method"],
-                    path=parsed_url.path,
-                    headers=headers,
-                    query_string=parsed_url.query,
-                    json=request.get("body", {})
-                )
-            except AssertionError:
-                responses.append(generate_response(404, request["id"], message="Not found."))
+                if len(task) > 1:
+                    return self.dispatcher.dispatch_items(req, task_requests, store_cache, session_slot)
+                return [self.dispatcher.dispatch(req, task_requests[0], store_cache, materialize, session_slot)]
+            except Exception:
+                logging.exception("failed to process batch request %s %s",
+                                  task_requests[0]["method"], task_requests[0].get("url"))
+                return [(falcon.HTTP_500, "application/json", None)] * len(task)
+
+        yield b'[\n'
+        separator = b''
+        with ThreadPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            for level in requests_levels:
+                # Ignore requests which are already processed.
+                # It is used for dependency failure.
+                level = [request_id for request_id in level if not requests[request_id]["processed"]]
+                for request_id in level:
+                    requests[request_id]["processed"] = True
+
+                tasks = self._coalesce(level, requests, workers)
+
+                # Tasks of a level do not depend on each other, execute them
+                # concurrently but collect their results in order. Bodies of
+                # sequentially executed requests are streamed through.
+                if len(tasks) > 1 and workers > 1:
+                    results = executor.map(dispatch, tasks)
+                else:
+                    results = (dispatch(task, materialize=False) for task in tasks)
+
+                for task, task_results in zip(tasks, results):
+                    for request_id, result in zip(task, task_results):
+                        for response in self._handle_result(graph, requests, request_id, result):
+                            yield separator
+                            yield from response
+                            separator = b',\n'
+                        # Flush point, write the entries without waiting for
+                        # the next sub-request (see ResponseCoalescer).
+                        yield b''
+        yield b'\n]'
+
+    def _coalesce(self, level, requests, workers):
+        """Group sibling item GET sub-requests into tasks.
+
+        GET sub-requests which route to the same item resource and only differ
+        in their itemid are grouped, so they can be dispatched together. Large
+        groups are split to keep all workers busy.
 
-                # Mark all dependent (chained) requests as failed.
-                responses.extend(
-                    fail_dependent_requests(graph, request_id, requests)
-                )
+        Args:
+            level (List[int]): request IDs of a dependency level.
+            requests (dict): requests data map (result of process_request).
+            workers (int): number of workers.
 
+        Returns:
+            List[List[int]]: tasks, each a list of request IDs.
+        """
+        if BATCH_COALESCE_MIN_SIZE <= 0:
+            return [[request_id] for request_id in level]
+
+        tasks = []
+        groups = {}
+        for request_id in level:
+            key = self._coalesce_key(requests[request_id]["request"])
+            if key is None:
+                tasks.append([request_id])
+            elif key in groups:
+                groups[key].append(request_id)
             else:
-                if response.status_code in GOOD_STATUS_CODES:
-                    responses.append(
-                        generate_response(response.status_code, request["id"], response)
-                    )
-                else:
-                    if "application/json" in response.headers.get("content-type", ""):
-                        responses.append(
-                            generate_response(response.status_code, request["id"], response)
-                        )
-                    else:
-                        responses.append(
-                            generate_response(
-                                400, request["id"], response, "Unsupported content-type."
-                            )
-                        )
-
-                    # Mark all dependent requests as failed.
-                    responses.extend(
-                        fail_dependent_requests(graph, request_id, requests)
-                    )
-
-        self.respond_json(resp, responses)
+                groups[key] = [request_id]
+                tasks.append(groups[key])
+
+        result = []
+        for task in tasks:
+            size = max(-(-len(task) // workers), BATCH_COALESCE_MIN_SIZE)
+            result.extend(task[i:i + size] for i in range(0, len(task), size))
+        return result
+
+    def _coalesce_key(self, request):
+        """Return the key for grouping a sub-request or None.
+
+        Args:
+            request (Dict): sub-request data.
+
+        Returns:
+            Tuple: grouping key.
+            None: when the sub-request can not be grouped.
+        """
+        if request["method"] != "GET":
+            return None
+        route = self.dispatcher.route(request)
+        if route is None:
+            return None
+        resource, params, uri_template = route
+        if "itemid" not in params or not uri_template.endswith("{itemid}"):
+            return None
+
+        return (
+            id(resource),
+            uri_template,
+            tuple(sorted((k, v) for k, v in params.items() if k != "itemid")),
+            urlparse(request["url"]).query,
+            tuple(sorted(request.get("headers", {}).items())),
+        )
+
+    @staticmethod
+    def _handle_result(graph, requests, request_id, result):
+        """Generate the serialized responses for a dispatched sub-request.
+
+        Args:
+            graph (AdjacencyList): graph instance.
+            requests (dict): requests data map (result of process_request).
+            request_id (int): request ID.
+            result (Tuple[str,str,Union[bytes,Iterable[bytes]]]): result of the
+                dispatcher or None.
+
+        Returns:
+            list: list of serialized responses (chunks) for user.
+        """
+        request = requests[request_id]["request"]
+
+        status, content_type, body = result or ("404 Not Found", None, None)
+        status_code = int(status[:3])
+        json_content = "application/json" in (content_type or "")
+
+        if status_code in EMPTY_STATUS_CODES:
+            return [dump_response(generate_response(status_code, request["id"]))]
+
+        if status_code in GOOD_STATUS_CODES and json_content and body:
+            return [dump_response(generate_response(status_code, request["id"]), body)]
+
+        if status_code == 404 and not content_type:
+            # Unrouted or body-less not found.
+            response = generate_response(404, request["id"], "Not found.")
+        elif json_content and status_code not in GOOD_STATUS_CODES:
+            response = generate_response(status_code, request["id"], status)
+        else:
+            response = generate_response(400, request["id"], "Unsupported content-type.")
+        responses = [dump_response(response)]
+
+        # Mark all dependent (chained) requests as failed.
+        responses.extend(
+            dump_response(response) for response in fail_dependent_requests(graph, request_id, requests)
+        )
+        return responses
@@ -22,9 +22,6 @@ SUBSCRIPTION_INTERNAL_RETRY = int(
 SUBSCRIPTION_OBJECT_TYPES = os.getenv(
     "GRAPI_SUBSCRIPTION_OBJECT_TYPES", "item"
 ).split(",")
-SUBSCRIPTION_SINK_UPDATE_TIMEOUT = int(
-    os.getenv("GRAPI_SUBSCRIPTION_SINK_UPDATE_TIMEOUT", "5")
-)
 SUBSCRIPTION_EXIT_WAIT_TIMEOUT = int(
     os.getenv("GRAPI_SUBSCRIPTION_EXIT_WAIT_TIMEOUT", "60")
 )
@@ -34,3 +31,173 @@ SUBSCRIPTION_REQUEST_MAX_REDIRECT = int(
 SUBSCRIPTION_REQUEST_SESSION_PREFIX = os.getenv(
     "GRAPI_SUBSCRIPTION_REQUEST_SESSION_PREFIX", "https://"
 )
+# Response compression, encodings in order of preference (separated by comma).
+# An empty value disables compression. Encodings which are not available
+# (zstd requires zstandard, br requires brotli) are ignored.
+COMPRESSION_ENCODINGS = [
+    encoding.strip() for encoding in os.getenv(
+        "GRAPI_COMPRESSION_ENCODINGS", "zstd,br,gzip"
+    ).split(",") if encoding.strip()
+]
+COMPRESSION_MIN_SIZE = int(
+    os.getenv("GRAPI_COMPRESSION_MIN_SIZE", "1024")
+)
+COMPRESSION_GZIP_LEVEL = int(
+    os.getenv("GRAPI_COMPRESSION_GZIP_LEVEL", "6")
+)
+COMPRESSION_BROTLI_LEVEL = int(
+    os.getenv("GRAPI_COMPRESSION_BROTLI_LEVEL", "4")
+)
+COMPRESSION_ZSTD_LEVEL = int(
+    os.getenv("GRAPI_COMPRESSION_ZSTD_LEVEL", "3")
+)
+# Maximum size in bytes of serialized item JSON cached per worker. 0 disables
+# the cache.
+JSON_CACHE_SIZE = int(
+    os.getenv("GRAPI_JSON_CACHE_SIZE", str(32 * 1024 * 1024))
+)
+# Streamed responses are coalesced into writes of at least this many bytes.
+# 0 hands every chunk (one per item) to the server as is.
+STREAM_COALESCE_SIZE = int(
+    os.getenv("GRAPI_STREAM_COALESCE_SIZE", "65536")
+)
+# Maximum number of $batch sub-requests of one dependency level which are
+# executed concurrently. 1 executes all sub-requests sequentially.
+BATCH_MAX_WORKERS = int(
+    os.getenv("GRAPI_BATCH_MAX_WORKERS", "4")
+)
+# Sibling $batch item GET sub-requests are fetched together by one worker in
+# chunks of at least this many requests. 0 disables coalescing.
+BATCH_COALESCE_MIN_SIZE = int(
+    os.getenv("GRAPI_BATCH_COALESCE_MIN_SIZE", "4")
+)
+# Maximum number of sub-requests in a $batch request.
+BATCH_MAX_REQUESTS = int(
+    os.getenv("GRAPI_BATCH_MAX_REQUESTS", "1000")
+)
+# Webhook delivery. Notifications are posted by a pool of worker threads,
+# with at most SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY concurrent posts (and
+# keep-alive connections) per notification url host. Further notifications
+# for a busy host wait in a per host queue of at most
+# SUBSCRIPTION_NOTIFY_HOST_QUEUE_MAXSIZE entries, the oldest go to the spool.
+SUBSCRIPTION_NOTIFY_MAX_WORKERS = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_MAX_WORKERS", "32")
+)
+SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY", "4")
+)
+SUBSCRIPTION_NOTIFY_HOST_QUEUE_MAXSIZE = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_HOST_QUEUE_MAXSIZE", "1024")
+)
+SUBSCRIPTION_NOTIFY_CONNECT_TIMEOUT = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_CONNECT_TIMEOUT", "5")
+)
+# Connections of hosts without notifications for this many seconds are closed.
+SUBSCRIPTION_NOTIFY_HOST_IDLE_TIMEOUT = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_HOST_IDLE_TIMEOUT", "300")
+)
+# Failed webhook posts (network errors, 408, 429 and 5xx responses) are
+# retried with jittered exponential backoff, starting at
+# SUBSCRIPTION_NOTIFY_RETRY_DELAY seconds and capped at
+# SUBSCRIPTION_NOTIFY_RETRY_MAX_DELAY. Notifications which are older than
+# SUBSCRIPTION_NOTIFY_MAX_AGE seconds or failed SUBSCRIPTION_NOTIFY_MAX_ATTEMPTS
+# times are appended to the dead-letter spool in GRAPI_PERSISTENCY_PATH.
+SUBSCRIPTION_NOTIFY_MAX_ATTEMPTS = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_MAX_ATTEMPTS", "6")
+)
+SUBSCRIPTION_NOTIFY_MAX_AGE = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_MAX_AGE", "600")
+)
+SUBSCRIPTION_NOTIFY_RETRY_DELAY = float(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_RETRY_DELAY", "2")
+)
+SUBSCRIPTION_NOTIFY_RETRY_MAX_DELAY = float(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_RETRY_MAX_DELAY", "120")
+)
+SUBSCRIPTION_NOTIFY_RETRY_QUEUE_MAXSIZE = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_RETRY_QUEUE_MAXSIZE", "10000")
+)
+# Maximum number of spooled notifications per worker, further ones are
+# dropped. 0 disables the spool.
+SUBSCRIPTION_NOTIFY_SPOOL_MAXSIZE = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_SPOOL_MAXSIZE", "100000")
+)
+# Spooled notifications which were first submitted more than this many
+# seconds ago are dropped instead of being replayed.
+SUBSCRIPTION_NOTIFY_SPOOL_MAX_AGE = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_SPOOL_MAX_AGE", "86400")
+)
+# Spooled notifications are replayed on startup and then every this many
+# seconds. 0 only replays on startup.
+SUBSCRIPTION_NOTIFY_SPOOL_REPLAY_INTERVAL = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_SPOOL_REPLAY_INTERVAL", "3600")
+)
+# Maximum number of notifications per webhook post. Values above 1 group the
+# debounced notifications of a notification url into posts with a "value"
+# array of up to this many notifications. 1 posts every notification as a
+# single object.
+SUBSCRIPTION_NOTIFY_BATCH_SIZE = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_BATCH_SIZE", "1")
+)
+# Webhook circuit breaker. After this many consecutive failed posts to a host
+# its circuit opens and notifications for it go straight to the spool. After
+# SUBSCRIPTION_NOTIFY_BREAKER_COOLDOWN seconds a single post probes the host
+# again. 0 disables the circuit breaker.
+SUBSCRIPTION_NOTIFY_BREAKER_THRESHOLD = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_BREAKER_THRESHOLD", "5")
+)
+SUBSCRIPTION_NOTIFY_BREAKER_COOLDOWN = int(
+    os.getenv("GRAPI_SUBSCRIPTION_NOTIFY_BREAKER_COOLDOWN", "60")
+)
+# Webhook validation requests run on a pool of this many threads, with at
+# most SUBSCRIPTION_VALIDATION_QUEUE_MAXSIZE validations pending. Further
+# subscription requests are answered with 503.
+SUBSCRIPTION_VALIDATION_MAX_WORKERS = int(
+    os.getenv("GRAPI_SUBSCRIPTION_VALIDATION_MAX_WORKERS", "8")
+)
+SUBSCRIPTION_VALIDATION_QUEUE_MAXSIZE = int(
+    os.getenv("GRAPI_SUBSCRIPTION_VALIDATION_QUEUE_MAXSIZE", "64")
+)
+# Subscription requests are answered without waiting for the webhook
+# validation. No notifications are sent and nothing is persisted until the
+# validation succeeded, subscriptions which fail the validation are removed
+# again. 0 blocks subscription requests until their webhook is validated.
+SUBSCRIPTION_VALIDATION_ASYNC = bool(int(
+    os.getenv("GRAPI_SUBSCRIPTION_VALIDATION_ASYNC", "1")
+))
+# Subscriptions are persisted in GRAPI_PERSISTENCY_PATH and restored after a
+# restart, with a "missed" lifecycle notification to every subscriber.
+# Subscriptions of users without a bearer token are restored in the
+# background at most SUBSCRIPTION_RESTORE_RATE users per second, the others
+# on the next request of the user. Restores which failed for other reasons
+# than a missing user or folder are retried every
+# SUBSCRIPTION_RESTORE_RETRY_INTERVAL seconds and on the next request.
+SUBSCRIPTION_REGISTRY = bool(int(
+    os.getenv("GRAPI_SUBSCRIPTION_REGISTRY", "1")
+))
+SUBSCRIPTION_RESTORE_RATE = float(
+    os.getenv("GRAPI_SUBSCRIPTION_RESTORE_RATE", "20")
+)
+SUBSCRIPTION_RESTORE_RETRY_INTERVAL = float(
+    os.getenv("GRAPI_SUBSCRIPTION_RESTORE_RETRY_INTERVAL", "60")
+)
+# Number of subscriptions per page when listing subscriptions without $top.
+SUBSCRIPTION_LIST_PAGE_SIZE = int(
+    os.getenv("GRAPI_SUBSCRIPTION_LIST_PAGE_SIZE", "100")
+)
+# Requests of a user are always handled by the same notify worker, so that
+# all subscriptions of the user share one server session. Other workers
+# forward the user's requests, waiting at most SUBSCRIPTION_AFFINITY_TIMEOUT
+# seconds for the response. It defaults to 5 seconds more than a synchronous
+# webhook validation may take.
+SUBSCRIPTION_AFFINITY = bool(int(
+    os.getenv("GRAPI_SUBSCRIPTION_AFFINITY", "1")
+))
+SUBSCRIPTION_AFFINITY_TIMEOUT = int(
+    os.getenv("GRAPI_SUBSCRIPTION_AFFINITY_TIMEOUT", str(SUBSCRIPTION_VALIDATION_TIMEOUT + 5))
+)
+# Maximum number of notification url hosts with their own label in the
+# webhook latency metrics, further hosts are counted as "other".
+SUBSCRIPTION_METRICS_MAX_HOSTS = int(
+    os.getenv("GRAPI_SUBSCRIPTION_METRICS_MAX_HOSTS", "20")
+)
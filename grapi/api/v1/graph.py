@@ -1,48 +1,78 @@
 """Graph and topological sort module.
 
-In this library we have Adjacency Matrix for graph representation and also
-We're using topological sort to get list of vertices which should be executed.
+In this library we have an adjacency list based directed acyclic graph and
+we're using topological sort to get list of vertices which should be executed.
 It's useful for batch processing which has "dependsOn" key in the request.
 """
-from collections import defaultdict
-from queue import Queue
+from collections import defaultdict, deque
+
+
+class CycleError(ValueError):
+    """Graph has a cycle.
+
+    Attributes:
+        cycle (List[int]): vertices of the cycle, the first vertex is repeated
+            at the end (e.g. [0, 1, 0]).
+    """
+
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super().__init__("graph has cycle: %s" % " -> ".join(str(v_id) for v_id in cycle))
+
+
+def find_cycle(graph, vertices):
+    """Find a cycle among vertices.
+
+    Every vertex of vertices must have a predecessor in vertices, which is
+    the case for vertices left over by a topological sort. Walking backwards
+    from any of them must therefore eventually revisit a vertex.
+
+    Args:
+        graph (AdjacencyList): instance of a graph.
+        vertices (Set[int]): vertices which are part of or depend on a cycle.
+
+    Returns:
+        List[int]: vertices of the cycle in edge direction, the first vertex
+            is repeated at the end.
+    """
+    v_id = min(vertices)
+    path = []
+    position = {}
+    while v_id not in position:
+        position[v_id] = len(path)
+        path.append(v_id)
+        v_id = next(p_id for p_id in graph.get_predecessor_vertices(v_id) if p_id in vertices)
+
+    cycle = path[position[v_id]:]
+    cycle.reverse()
+    cycle.append(cycle[0])
+    return cycle
 
 
 def topological_sort(graph):
     """Topological sort implementation.
 
-    This implementation, iterate over all vertices, if a vertex has "0" in-degree,
-    then we put them in the queue and we'll count it as an item in the result, then
-    we start getting its adjacent vertices and deducting them by 1 in the in-degree
-    table. Then, if any of the adjacent vertices has "0" in-degree (after the deduction),
-    then we put it in the queue and then we'll count it as an item in the result.
+    This implementation (Kahn's algorithm) puts all vertices with "0" in-degree
+    in the queue and counts them as items in the result, then takes their
+    adjacent vertices and deducts them by 1 in the in-degree table. Then, if any
+    of the adjacent vertices has "0" in-degree (after the deduction), it is put
+    in the queue and counted as an item in the result. This is O(V+E).
 
     Args:
-        graph (AdjacencyMatrix): instance of a graph.
+        graph (AdjacencyList): instance of a graph.
 
     Returns:
         List: list of sorted vertices.
 
     Raises:
-        ValueError: when graph has a cycle.
+        CycleError: when graph has a cycle.
     """
-    zero_indegree_vertices = Queue()
-    indegree_table = {}
-
-    # Store in-degrees in a table.
-    for i in range(graph.num_vertices):
-        indegree_table[i] = graph.get_indegree(i)
-
-        if indegree_table[i] == 0:
-            zero_indegree_vertices.put(i)
-
-    # We expect to have at least one "0" in-degree.
-    if zero_indegree_vertices.qsize() == 0:
-        raise ValueError("graph has cycle")
+    indegree_table = [graph.get_indegree(v_id) for v_id in range(graph.num_vertices)]
+    zero_indegree_vertices = deque(v_id for v_id, indegree in enumerate(indegree_table) if indegree == 0)
 
     result = []
-    while not zero_indegree_vertices.empty():
-        vertex_id = zero_indegree_vertices.get()
+    while zero_indegree_vertices:
+        vertex_id = zero_indegree_vertices.popleft()
         result.append(vertex_id)
 
         for adjacent_vertex_id in graph.get_adjacent_vertices(vertex_id):
@@ -50,16 +80,51 @@ def topological_sort(graph):
             indegree_table[adjacent_vertex_id] -= 1
 
             if indegree_table[adjacent_vertex_id] == 0:
-                zero_indegree_vertices.put(adjacent_vertex_id)
+                zero_indegree_vertices.append(adjacent_vertex_id)
 
     if len(result) != graph.num_vertices:
-        raise ValueError("graph has cycle")
+        remaining = {v_id for v_id, indegree in enumerate(indegree_table) if indegree > 0}
+        raise CycleError(find_cycle(graph, remaining))
 
     return result
 
 
-class AdjacencyMatrix:
-    """Adjacency Matrix implementation."""
+def topological_levels(graph):
+    """Group topologically sorted vertices into dependency levels.
+
+    Vertices of a level only depend on vertices of previous levels, so all
+    vertices of one level can be executed independently of each other. Within
+    a level, vertices keep the order of the topological sort.
+
+    Args:
+        graph (AdjacencyList): instance of a graph.
+
+    Returns:
+        List[List]: list of levels, each a list of vertices.
+
+    Raises:
+        CycleError: when graph has a cycle.
+    """
+    levels = []
+    vertex_level = [0] * graph.num_vertices
+    for vertex_id in topological_sort(graph):
+        level = vertex_level[vertex_id]
+        if level == len(levels):
+            levels.append([])
+        levels[level].append(vertex_id)
+
+        for adjacent_vertex_id in graph.get_adjacent_vertices(vertex_id):
+            vertex_level[adjacent_vertex_id] = max(vertex_level[adjacent_vertex_id], level + 1)
+
+    return levels
+
+
+class AdjacencyList:
+    """Adjacency List implementation.
+
+    Successors and predecessors are kept per vertex, so memory is O(V+E) and
+    in-degrees are available in O(1).
+    """
 
     def __init__(self, num_vertices):
         """Initialize the class.
@@ -75,10 +140,13 @@ class AdjacencyMatrix:
 
         self.num_vertices = num_vertices
 
-        # creating an empty matrix [x,x]
-        self.matrix = [
-            [False for _ in range(self.num_vertices)] for _ in range(self.num_vertices)
-        ]
+        # Dicts (with None values) keep insertion order and have O(1) lookups.
+        self.successors = [{} for _ in range(self.num_vertices)]
+        self.predecessors = [{} for _ in range(self.num_vertices)]
+
+    def _check_vertex(self, v_id):
+        if v_id >= self.num_vertices or v_id < 0:
+            raise ValueError("vertex ID is outbound")
 
     def add_edge(self, v1_id, v2_id):
         """Add edge between 2 vertices.
@@ -90,26 +158,18 @@ class AdjacencyMatrix:
         Raises:
             ValueError: when find indirect connection or vertex ID is outbound.
         """
-        if v1_id >= self.num_vertices or v2_id >= self.num_vertices or v1_id < 0 or v2_id < 0:
-            raise ValueError("vertex ID is outbound")
+        self._check_vertex(v1_id)
+        self._check_vertex(v2_id)
 
-        if self.matrix[v1_id][v2_id]:
+        if v2_id in self.successors[v1_id]:
             raise ValueError("find indirect connection")
 
-        self.matrix[v1_id][v2_id] = True
+        self.successors[v1_id][v2_id] = None
+        self.predecessors[v2_id][v1_id] = None
 
     def get_indegree(self, v_id):
         """Return in-degree of a vertex.
 
-        For example, in-degree of vertex "1", by counting vertically, will be 2.
-        +---+---+---+---+
-        | * | 0 | 1 | 2 |
-        | 0 | F | T | F |
-        | 1 | F | F | T |
-        | 2 | F | T | F |
-        +---+---+---+---+
-                  ^
-
         Args:
             v_id (int): vertex ID.
 
@@ -119,63 +179,44 @@ class AdjacencyMatrix:
         Raises:
             ValueError: vertex ID is outbound.
         """
-        if v_id >= self.num_vertices or v_id < 0:
-            raise ValueError("vertex ID is outbound")
-
-        in_degree = 0
-        for i in range(self.num_vertices):
-            if self.matrix[i][v_id]:
-                in_degree += 1
-
-        return in_degree
+        self._check_vertex(v_id)
+        return len(self.predecessors[v_id])
 
     def get_adjacent_vertices(self, v_id):
-        """Return list of adjacent vertices of a specific vertex.
-
-        For example, vertices of vertex "1", by getting horizontally, will be "0" and "2".
-          +---+---+---+---+
-          | * | 0 | 1 | 2 |
-          | 0 | F | F | F |
-        > | 1 | T | F | T |
-          | 2 | F | T | F |
-          +---+---+---+---+
+        """Return adjacent (successor) vertices of a specific vertex.
 
         Args:
             v_id (int): vertex ID.
 
         Returns:
-            Iterable[int]: adjacent vertex ID.
+            Iterable[int]: adjacent vertex IDs in order of insertion.
 
         Raises:
             ValueError: vertex ID is outbound.
         """
-        if v_id >= self.num_vertices or v_id < 0:
-            raise ValueError("vertex ID is outbound")
-
-        for i in range(self.num_vertices):
-            if self.matrix[v_id][i]:
-                yield i
+        self._check_vertex(v_id)
+        return iter(self.successors[v_id])
 
-    def _get_vertices_connections(self, v_id, result):
-        """Get vertices connections and add them to the list.
+    def get_predecessor_vertices(self, v_id):
+        """Return predecessor vertices of a specific vertex.
 
         Args:
             v_id (int): vertex ID.
-            result (Dict[int,Set]): set of vertices connections with associated vertex ID.
+
+        Returns:
+            Iterable[int]: predecessor vertex IDs in order of insertion.
 
         Raises:
             ValueError: vertex ID is outbound.
         """
-        if v_id >= self.num_vertices or v_id < 0:
-            raise ValueError("vertex ID is outbound")
-
-        for adjacent_v_id in self.get_adjacent_vertices(v_id):
-            if adjacent_v_id:
-                result[v_id].add(adjacent_v_id)
-                self._get_vertices_connections(adjacent_v_id, result)
+        self._check_vertex(v_id)
+        return iter(self.predecessors[v_id])
 
     def get_vertices_chain(self, v_id):
-        """Return list of vertices chain.
+        """Return the chain of vertices depending on a vertex.
+
+        Every descendant is reported exactly once, associated with the vertex
+        it was first reached from (breadth first).
 
         Args:
             v_id (int): vertex ID.
@@ -186,11 +227,18 @@ class AdjacencyMatrix:
         Raises:
             ValueError: vertex ID is outbound.
         """
-        if v_id >= self.num_vertices or v_id < 0:
-            raise ValueError("vertex ID is outbound")
+        self._check_vertex(v_id)
 
         result = defaultdict(set)
-        self._get_vertices_connections(v_id, result)
+        visited = {v_id}
+        queue = deque([v_id])
+        while queue:
+            current_v_id = queue.popleft()
+            for adjacent_v_id in self.successors[current_v_id]:
+                if adjacent_v_id not in visited:
+                    visited.add(adjacent_v_id)
+                    result[current_v_id].add(adjacent_v_id)
+                    queue.append(adjacent_v_id)
         return result
 
     def get_sorted_vertices(self):
@@ -200,3 +248,11 @@ class AdjacencyMatrix:
             List: sorted vertices.
         """
         return topological_sort(self)
+
+    def get_sorted_levels(self):
+        """Return sorted vertices grouped into dependency levels.
+
+        Returns:
+            List[List]: list of levels, each a list of vertices.
+        """
+        return topological_levels(self)
@@ -2,11 +2,15 @@
 from .request_body_extractor import RequestBodyExtractor
 from .request_id import RequestId
 from .resource_patcher import ResourcePatcher
+from .response_coalescer import ResponseCoalescer
+from .response_compression import ResponseCompression
 from .response_headers import ResponseHeaders
 
 __all__ = (
     "RequestId",
     "RequestBodyExtractor",
     "ResourcePatcher",
+    "ResponseCoalescer",
+    "ResponseCompression",
     "ResponseHeaders"
 )
@@ -61,10 +61,20 @@ class ResourcePatcher:
             backend_name = next(iter(self.name_backend))
             utils = API.import_backend("{}.utils".format(backend_name))
             userid = params.pop('userid') if 'userid' in params else None
-            try:
-                server, store, userid, userstore = utils._server_store(req, userid, self.options)
-            except MAPIErrorInvalidEntryid:
-                raise falcon.HTTPBadRequest("Invalid entryid provided")
+
+            # Sub-requests of a $batch request share resolved stores.
+            store_cache = req.context.get('server_store_cache')
+            cached = store_cache.get((backend_name, userid)) if store_cache is not None else None
+            if cached is not None:
+                (server, store, userid, userstore), req.context.userid = cached
+            else:
+                try:
+                    server_store = utils._server_store(req, userid, self.options)
+                except MAPIErrorInvalidEntryid:
+                    raise falcon.HTTPBadRequest("Invalid entryid provided")
+                if store_cache is not None:
+                    store_cache[(backend_name, userid)] = server_store, req.context.get('userid')
+                server, store, userid, userstore = server_store
             # User should have store.
             if not store:
                 raise falcon.HTTPForbidden("No store found for the user")
@@ -0,0 +1,74 @@
+"""Streamed response coalescing middleware."""
+from grapi.api.v1 import config
+
+try:
+    from prometheus_client import Histogram
+    PROMETHEUS = True
+except ImportError:  # pragma: no cover
+    PROMETHEUS = False
+
+if PROMETHEUS:
+    STREAM_WRITE_HIST = Histogram(
+        'kopano_mfr_stream_write_bytes', 'Number of bytes per write of streamed responses',
+        buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, float('inf'))
+    )
+
+
+class ResponseCoalescer:
+    """Coalesce small chunks of streamed responses into larger writes.
+
+    The WSGI server writes every chunk yielded by a stream separately, so
+    streams which yield many tiny chunks cost a syscall and a small packet
+    each.
+
+    An empty chunk marks a flush point, the chunks buffered so far are
+    written right away. Streams which produce their chunks slowly, like the
+    $batch response, yield it after every complete entry so clients see
+    entries as soon as they are available.
+    """
+
+    def __init__(self, options=None, size=None):
+        """Built-in Python method.
+
+        Args:
+            options (Option): deployment options. Defaults to None.
+            size (int): number of bytes to accumulate before writing. Defaults
+                to config.STREAM_COALESCE_SIZE.
+        """
+        self.size = config.STREAM_COALESCE_SIZE if size is None else size
+        self.with_metrics = PROMETHEUS and options is not None and options.with_metrics
+
+    def _coalesce(self, stream):
+        """Yield chunks of stream joined up to the configured size."""
+        buffer = []
+        buffered = 0
+        for chunk in stream:
+            if chunk:
+                buffer.append(chunk)
+                buffered += len(chunk)
+            elif not buffer:
+                continue
+            if buffered >= self.size or not chunk:
+                if self.with_metrics:
+                    STREAM_WRITE_HIST.observe(buffered)
+                yield b''.join(buffer)
+                buffer.clear()
+                buffered = 0
+
+        if buffer:
+            if self.with_metrics:
+                STREAM_WRITE_HIST.observe(buffered)
+            yield b''.join(buffer)
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        """Built-in Falcon middleware method."""
+        if self.size <= 0 and not self.with_metrics:
+            return
+
+        if resp.body is not None or resp.data is not None:
+            return
+
+        if resp.stream is None or hasattr(resp.stream, 'read'):
+            return
+
+        resp.stream = self._coalesce(resp.stream)
@@ -0,0 +1,222 @@
+"""Response compression middleware."""
+import itertools
+import zlib
+
+import falcon
+
+from grapi.api.v1 import config
+
+try:
+    import brotli
+    BROTLI = True
+except ImportError:  # pragma: no cover
+    BROTLI = False
+
+try:
+    import zstandard
+    ZSTD = True
+except ImportError:  # pragma: no cover
+    ZSTD = False
+
+# Content types which are worth to be compressed.
+COMPRESSIBLE_CONTENT_TYPES = ('application/json', 'text/')
+
+
+def _gzip_compressor():
+    return zlib.compressobj(config.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class _BrotliCompressor:
+    """Brotli compressor with the zlib compressobj interface."""
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=config.COMPRESSION_BROTLI_LEVEL)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def sync(self):
+        return self._compressor.flush()
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def _zstd_compressor():
+    return zstandard.ZstdCompressor(level=config.COMPRESSION_ZSTD_LEVEL).compressobj()
+
+
+# COMPRESSORS maps content codings to compressor factories.
+COMPRESSORS = {
+    'gzip': _gzip_compressor,
+}
+if BROTLI:
+    COMPRESSORS['br'] = _BrotliCompressor
+if ZSTD:
+    COMPRESSORS['zstd'] = _zstd_compressor
+
+# SYNC_FLUSHES maps content codings to functions which return the pending
+# output of a compressor without ending the stream.
+SYNC_FLUSHES = {
+    'gzip': lambda compressor: compressor.flush(zlib.Z_SYNC_FLUSH),
+}
+if BROTLI:
+    SYNC_FLUSHES['br'] = lambda compressor: compressor.sync()
+if ZSTD:
+    SYNC_FLUSHES['zstd'] = lambda compressor: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+def parse_accept_encoding(accept_encoding):
+    """Parse HTTP Accept-Encoding header.
+
+    https://tools.ietf.org/html/rfc7231#section-5.3.4
+
+    Args:
+        accept_encoding (str): header value.
+
+    Returns:
+        Dict[str,float]: content codings with their quality.
+    """
+    encodings = {}
+    for entry in accept_encoding.split(','):
+        values = entry.strip().lower().split(';')
+        encoding = values[0].strip()
+        if not encoding:
+            continue
+
+        quality = 1.0
+        for param in values[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[encoding] = quality
+
+    return encodings
+
+
+def select_encoding(accept_encoding, available):
+    """Select the content coding to be used for a response.
+
+    Args:
+        accept_encoding (str): Accept-Encoding header value of the request.
+        available (list): supported content codings in order of preference.
+
+    Returns:
+        Union[str,None]: selected content coding or None when the response
+            should not be compressed.
+    """
+    encodings = parse_accept_encoding(accept_encoding)
+    wildcard = encodings.get('*', 0.0)
+
+    selected = None
+    selected_quality = 0.0
+    for encoding in available:
+        quality = encodings.get(encoding, wildcard)
+        if quality > selected_quality:
+            selected = encoding
+            selected_quality = quality
+
+    return selected
+
+
+class ResponseCompression:
+    """Compress response bodies and streams as negotiated by Accept-Encoding."""
+
+    def __init__(self, encodings=None, min_size=None):
+        """Built-in Python method.
+
+        Args:
+            encodings (list): content codings in order of preference. Defaults
+                to config.COMPRESSION_ENCODINGS.
+            min_size (int): minimal size in bytes of a response to be
+                compressed. Defaults to config.COMPRESSION_MIN_SIZE.
+        """
+        if encodings is None:
+            encodings = config.COMPRESSION_ENCODINGS
+        if min_size is None:
+            min_size = config.COMPRESSION_MIN_SIZE
+
+        self.encodings = [encoding for encoding in encodings if encoding in COMPRESSORS]
+        self.min_size = min_size
+
+    @staticmethod
+    def _compress_stream(encoding, head, stream):
+        """Compress chunks of a stream incrementally.
+
+        Empty chunks mark flush points (see ResponseCoalescer), the pending
+        compressed output is passed on together with the flush point.
+        """
+        compressor = COMPRESSORS[encoding]()
+        for chunk in itertools.chain(head, stream):
+            if chunk:
+                data = compressor.compress(chunk)
+            else:
+                data = SYNC_FLUSHES[encoding](compressor)
+            if data:
+                yield data
+            if not chunk:
+                yield b''
+        yield compressor.flush()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        """Built-in Falcon middleware method."""
+        if not self.encodings or req.method == 'HEAD':
+            return
+
+        if resp.status == falcon.HTTP_204 or resp.status == falcon.HTTP_304:
+            return
+
+        if resp.get_header('Content-Encoding'):
+            return
+
+        content_type = resp.content_type or ''
+        if not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES):
+            return
+
+        resp.append_header('Vary', 'Accept-Encoding')
+
+        accept_encoding = req.get_header('Accept-Encoding')
+        if not accept_encoding:
+            return
+
+        encoding = select_encoding(accept_encoding, self.encodings)
+        if encoding is None:
+            return
+
+        body = resp.body if resp.body is not None else resp.data
+        if body is not None:
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            if len(body) < self.min_size:
+                return
+
+            compressor = COMPRESSORS[encoding]()
+            resp.body = None
+            resp.data = compressor.compress(body) + compressor.flush()
+
+        elif resp.stream is not None and not hasattr(resp.stream, 'read'):
+            # Read ahead until the minimal size or a flush point is reached,
+            # so small streams can be sent as is.
+            stream = iter(resp.stream)
+            head = []
+            size = 0
+            for chunk in stream:
+                head.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size or not chunk:
+                    break
+            else:
+                resp.stream = None
+                resp.data = b''.join(head)
+                return
+
+            resp.stream = self._compress_stream(encoding, head, stream)
+            resp.stream_len = None
+
+        else:
+            return
+
+        resp.set_header('Content-Encoding', encoding)
@@ -55,6 +55,30 @@ def _dumpb_json(obj, *args, **kwargs):
     return json.dumps(obj, *args, **kwargs).encode('utf-8')
 
 
+def _match_etag(header, etag):
+    """Return True if an If-Match/If-None-Match header value matches etag.
+
+    Comparison is weak (RFC 7232 section 2.3.2): the W/ prefix is ignored on
+    both sides, as all entity tags emitted by this API are weak.
+    """
+    if header is None:
+        return False
+    header = header.strip()
+    if header == '*':
+        return True
+    if etag is None:
+        return False
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
 class HTTPBadRequest(falcon.HTTPBadRequest):
     def __init__(self, msg):
         msg = html.escape(msg)
@@ -1,7 +1,7 @@
 """Batch request schema."""
 import jsonschema
 
-from grapi.api.v1.config import PREFIX
+from grapi.api.v1.config import BATCH_MAX_REQUESTS, PREFIX
 
 schema = {
     "type": "object",
@@ -9,6 +9,7 @@ schema = {
         "requests": {
             "type": "array",
             "minItems": 1,
+            "maxItems": BATCH_MAX_REQUESTS,
             "items": {
                 "type": "object",
                 "properties": {
@@ -1,4 +1,6 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
+import zlib
+
 from falcon import HTTPNotFound
 
 from .resource import Resource
@@ -35,3 +37,21 @@ def suffix_method_caller(method_name, req, resp, **kwargs):
         if hasattr(req.context.resource, method_name):
             return getattr(req.context.resource, method_name)(req, resp, **kwargs)
     raise HTTPNotFound()
+
+
+def affinity_worker(userid, workers):
+    """Return the worker which handles the subscriptions of a user.
+
+    The worker is derived from a stable hash of the user ID, so it is the
+    same in all worker processes and across restarts.
+
+    Args:
+        userid (str): user ID.
+        workers (int): number of workers.
+
+    Returns:
+        int: worker index.
+    """
+    if workers <= 1:
+        return 0
+    return zlib.crc32(userid.encode('utf-8')) % workers
@@ -74,6 +74,8 @@ class ContactResource(ItemResource):
 
     deleted_resource = DeletedContactResource
 
+    batch_prefetch = True
+
     def handle_get(self, req, resp, store, server, folderid, itemid):
         folder = _folder(store, folderid or 'contacts')  # TODO all folders?
 
@@ -90,9 +92,12 @@ class ContactResource(ItemResource):
         self.delta(req, resp, folder)
 
     def _handle_get_with_itemid(self, req, resp, folder, itemid):
-        data = _item(folder, itemid)
+        data = self.get_item(req, folder, itemid)
         self.respond(req, resp, data)
 
+    def prefetch_folder(self, store, folderid, itemid):
+        return _folder(store, folderid or 'contacts')
+
     @experimental
     def on_get_contacts(self, req, resp):
         _, store, _ = req.context.server_store
@@ -112,6 +117,7 @@ class ContactResource(ItemResource):
 
     def handle_delete(self, req, resp, store, server, folderid, itemid):
         item = _item(store, itemid)
+        self.check_if_match(req, item, self.fields)
 
         store.delete(item)
 
@@ -197,6 +197,9 @@ def is_event_organizer(req, item):
 
 
 class EventResource(ItemResource):
+    # isOrganizer depends on the requesting user.
+    json_cache_per_user = True
+
     fields = ItemResource.fields.copy()
     fields.update({
         'id': lambda item: item.eventid,
@@ -246,6 +249,11 @@ class EventResource(ItemResource):
 
     # TODO delta functionality seems to include expanding recurrences!? check with MSGE
 
+    @staticmethod
+    def json_cache_id(item):
+        # Occurrences share the entryid of their series.
+        return item.eventid
+
     # GET
 
     @staticmethod
@@ -425,6 +433,7 @@ class EventResource(ItemResource):
         store = req.context.server_store[1]
         folder = _folder(store, folderid)
         item = self.get_event(folder, itemid)
+        self.check_if_match(req, item, self.fields)
 
         for field, value in fields.items():
             if field in self.set_fields:
@@ -467,6 +476,7 @@ class EventResource(ItemResource):
         server, store, userid = req.context.server_store
         folder = _folder(store, folderid)
         event = self.get_event(folder, itemid)
+        self.check_if_match(req, event, self.fields)
         userstore = req.context.user_store
 
         try:
@@ -32,8 +32,11 @@ class FolderResource(Resource):
         'id': lambda folder: folder.entryid,
     }
 
+    etag_from_body = True
+
     @experimental
     def handle_delete(self, req, resp, store, folder):
+        self.check_if_match(req, folder)
         store.delete(folder)
         self.respond_204(resp)
 
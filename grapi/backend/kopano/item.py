@@ -2,11 +2,16 @@
 import calendar
 import codecs
 import datetime
+import logging
 
 import dateutil
+import falcon
+import kopano
+from MAPI.Struct import MAPIError
 
 from .resource import DEFAULT_TOP, Resource, _date
-from .utils import db_get, db_put, experimental
+from .utils import (_folder, _item, _items_by_entryid, db_get, db_put,
+                    experimental)
 
 
 def get_body(req, item):
@@ -58,6 +63,62 @@ class ItemResource(Resource):
         'categories': lambda item: item.categories,
     }
 
+    # Set True if single items are opened with get_item, so sibling item GETs
+    # of a $batch request can be fetched together by prefetch_items.
+    batch_prefetch = False
+
+    def prefetch_folder(self, store, folderid, itemid):
+        """Return the folder in which prefetch_items looks up items.
+
+        Args:
+            store (Store): store of the items.
+            folderid (str): folder ID of the route or None.
+            itemid (str): ID of the first item.
+
+        Returns:
+            Folder: the folder of the route, or else the folder of the first item.
+        """
+        if folderid:
+            return _folder(store, folderid)
+        return _item(store, itemid).folder
+
+    def prefetch_items(self, req, params, itemids):
+        """Fetch the items of sibling $batch GETs with one table query.
+
+        Items which are not in the folder (see prefetch_folder) are left to
+        get_item, which opens them one by one as before.
+
+        Args:
+            req (Request): Falcon request object shared by the GETs.
+            params (Dict): route parameters, without itemid.
+            itemids (List[str]): item IDs of the GETs.
+        """
+        store = req.context.server_store[1]
+        try:
+            folder = self.prefetch_folder(store, params.get('folderid'), itemids[0])
+            req.context.prefetched_items = _items_by_entryid(folder, itemids)
+        except (falcon.HTTPError, kopano.Error, MAPIError):
+            # Reported by the GET of the item.
+            logging.debug('failed to prefetch batch items', exc_info=True)
+
+    @staticmethod
+    def get_item(req, parent, itemid):
+        """Return an item fetched by prefetch_items or open it.
+
+        Args:
+            req (Request): Falcon request object.
+            parent (Union[Store,Folder]): store or folder of the item.
+            itemid (str): item ID.
+
+        Returns:
+            Item: the item.
+        """
+        items = req.context.get('prefetched_items')
+        item = items.get(itemid.upper()) if items else None
+        if item is None:
+            item = _item(parent, itemid)
+        return item
+
     @experimental
     def delta(self, req, resp, folder):
         args = self.parse_qs(req)
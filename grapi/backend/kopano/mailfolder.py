@@ -298,6 +298,7 @@ class MailFolderResource(FolderResource):
         folder = _folder(store, folderid)
         if not folder:
             raise falcon.HTTPNotFound(description="folder not found")
+        self.check_if_match(req, folder, self.fields)
         folder.name = fields["displayName"]
 
         self.respond(req, resp, folder, self.fields)
@@ -315,6 +316,7 @@ class MailFolderResource(FolderResource):
         self.validate_json(folder_schema.create_or_update_schema_validator, fields)
 
         child = self._get_child_folder_by_id(req, folderid, childid)[1]
+        self.check_if_match(req, child, self.fields)
         child.name = fields["displayName"]
 
         self.respond(req, resp, child, self.fields)
@@ -348,5 +350,6 @@ class MailFolderResource(FolderResource):
             childid (str): child folder ID which should be removed.
         """
         parent, child = self._get_child_folder_by_id(req, folderid, childid)
+        self.check_if_match(req, child, self.fields)
         parent.delete([child])
         self.respond_204(resp)
@@ -128,6 +128,13 @@ class MessageResource(ItemResource):
         'attachments': lambda message: (message.attachments, attachment.FileAttachmentResource),  # TODO embedded
     }
 
+    batch_prefetch = True
+
+    @staticmethod
+    def json_cache_id(item):
+        # Changing the read flag does not update the changekey.
+        return item.entryid, item.read
+
     # GET
 
     def handle_get(self, req, resp, store, folder, itemid):
@@ -186,7 +193,7 @@ class MessageResource(ItemResource):
             raise HTTPNotFound()
 
         store = req.context.server_store[1]
-        item = _item(store, itemid)
+        item = self.get_item(req, store, itemid)
         self.respond(req, resp, item)
 
     def on_get_messages_by_folderid(self, req, resp, folderid):
@@ -422,6 +429,7 @@ class MessageResource(ItemResource):
 
         store = req.context.server_store[1]
         item = _item(store, itemid)
+        self.check_if_match(req, item, self.fields)
 
         for field, value in json_data.items():
             if field in self.set_fields:
@@ -450,6 +458,7 @@ class MessageResource(ItemResource):
             raise HTTPNotFound()
         store = req.context.server_store[1]
         item = _item(store, itemid)
+        self.check_if_match(req, item, self.fields)
         store.delete(item)
         self.respond_204(resp)
 
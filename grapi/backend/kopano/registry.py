@@ -0,0 +1,173 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+"""Persistent subscription registry."""
+import json
+import logging
+import sqlite3
+from threading import Lock
+
+from grapi.api.v1.utils import affinity_worker
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id TEXT PRIMARY KEY,
+    worker INTEGER NOT NULL,
+    auth_userid TEXT NOT NULL,
+    oidc INTEGER NOT NULL,
+    expiration REAL NOT NULL,
+    data TEXT NOT NULL
+)
+'''
+
+
+class RegistryEntry:
+    """A persisted subscription."""
+
+    __slots__ = ('subscription', 'auth_userid', 'oidc', 'expiration')
+
+    def __init__(self, subscription, auth_userid, oidc, expiration):
+        """Built-in Python method.
+
+        Args:
+            subscription (Dict): exported subscription data.
+            auth_userid (str): user ID of the subscription owner.
+            oidc (bool): the owner authenticated with a bearer token.
+            expiration (float): POSIX timestamp of the expiration.
+        """
+        self.subscription = subscription
+        self.auth_userid = auth_userid
+        self.oidc = oidc
+        self.expiration = expiration
+
+
+class SubscriptionRegistry:
+    """Subscription registry in a SQLite database.
+
+    The database is shared by all notify workers. Every subscription belongs
+    to the worker which created it, so that after a restart every worker
+    takes back its own subscriptions.
+    """
+
+    def __init__(self, path, worker=0, workers=1, affinity=False):
+        """Built-in Python method.
+
+        Args:
+            path (str): database file.
+            worker (int): index of this notify worker.
+            workers (int): number of notify workers.
+            affinity (bool): subscriptions belong to the worker of their
+                owner (see affinity_worker).
+        """
+        self.path = path
+        self.worker = worker
+        self.workers = max(workers, 1)
+        self.affinity = affinity
+
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.create_function('affinity_worker', 1, lambda userid: affinity_worker(userid, self.workers))
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(SCHEMA)
+
+    def put(self, subscription, auth_userid, oidc, expiration):
+        """Add or replace a subscription.
+
+        Args:
+            subscription (Dict): exported subscription data.
+            auth_userid (str): user ID of the subscription owner.
+            oidc (bool): the owner authenticated with a bearer token.
+            expiration (float): POSIX timestamp of the expiration.
+        """
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    subscription['id'], self.worker, auth_userid, int(oidc),
+                    expiration, json.dumps(subscription)
+                )
+            )
+
+    def remove(self, subscription_id):
+        """Remove a subscription.
+
+        Args:
+            subscription_id (str): subscription ID.
+        """
+        with self._lock:
+            self._db.execute('DELETE FROM subscriptions WHERE id = ?', (subscription_id,))
+
+    def exists(self, subscription_id, now):
+        """Return whether an unexpired subscription exists, for any worker.
+
+        Args:
+            subscription_id (str): subscription ID.
+            now (float): current POSIX timestamp.
+
+        Returns:
+            bool: True when the subscription exists.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT 1 FROM subscriptions WHERE id = ? AND expiration > ?',
+                (subscription_id, now)
+            ).fetchone()
+        return row is not None
+
+    def purge(self, now):
+        """Remove all expired subscriptions of this worker.
+
+        Args:
+            now (float): current POSIX timestamp.
+        """
+        with self._lock:
+            self._db.execute(
+                'DELETE FROM subscriptions WHERE worker = ? AND expiration <= ?',
+                (self.worker, now)
+            )
+
+    def load(self, now):
+        """Return the unexpired subscriptions of this worker.
+
+        Subscriptions of workers which no longer exist, because the number
+        of workers was reduced, are taken over as well. With affinity, all
+        subscriptions of the users of this worker are taken over, as the
+        worker of a user changes with the number of workers.
+
+        Args:
+            now (float): current POSIX timestamp.
+
+        Returns:
+            List[RegistryEntry]: persisted subscriptions.
+        """
+        with self._lock:
+            if self.affinity:
+                self._db.execute(
+                    'UPDATE subscriptions SET worker = ? WHERE worker != ? AND affinity_worker(auth_userid) = ?',
+                    (self.worker, self.worker, self.worker)
+                )
+            else:
+                self._db.execute(
+                    'UPDATE subscriptions SET worker = ? WHERE worker >= ? AND worker % ? = ?',
+                    (self.worker, self.workers, self.workers, self.worker)
+                )
+            query = 'SELECT id, auth_userid, oidc, expiration, data FROM subscriptions WHERE worker = ?'
+            params = (self.worker,)
+            if self.affinity:
+                # Subscriptions of users of other workers are left to them.
+                query += ' AND affinity_worker(auth_userid) = ?'
+                params += (self.worker,)
+            rows = self._db.execute(query, params).fetchall()
+
+        self.purge(now)
+        entries = []
+        for subscription_id, auth_userid, oidc, expiration, data in rows:
+            if expiration <= now:
+                continue
+            try:
+                subscription = json.loads(data)
+            except ValueError:
+                logging.warning('ignored invalid persisted subscription, id:%s', subscription_id)
+                self.remove(subscription_id)
+                continue
+            entries.append(RegistryEntry(subscription, auth_userid, bool(oidc), expiration))
+        return entries
@@ -1,15 +1,23 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
+import calendar
 import datetime
+import functools
+import hashlib
 import logging
+import threading
 import time
+from collections import OrderedDict
 
 import dateutil.parser
+import falcon
 import pytz
 import tzlocal
 
+from grapi.api.v1 import config
 from grapi.api.v1.resource import HTTPBadRequest
 from grapi.api.v1.resource import Resource as BaseResource
-from grapi.api.v1.resource import _dumpb_json, _encode_qs, _parse_qs
+from grapi.api.v1.resource import (_dumpb_json, _encode_qs, _match_etag,
+                                   _parse_qs)
 from grapi.api.v1.timezone import to_timezone
 
 UTC = pytz.utc
@@ -17,10 +25,43 @@ LOCAL = tzlocal.get_localzone()
 
 DEFAULT_TOP = 10
 
+# Number of hour buckets for which UTC offsets are cached.
+DATE_CACHE_SIZE = 65536
 
-def _date(d, local=False, show_time=True):
-    if d is None:
-        return '0001-01-01T00:00:00Z'
+# Approximate per entry overhead in bytes accounted against the JSON cache
+# size (config.JSON_CACHE_SIZE).
+JSON_CACHE_ENTRY_OVERHEAD = 512
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _utc_offset(year, month, day, hour):
+    """Return the UTC offset in seconds of a naive localtime hour bucket.
+
+    Returns None for hours close to a transition, in which case the caller
+    must convert the value individually. Such hours can be skipped or
+    ambiguous and mktime resolves them depending on its internal state.
+    """
+    start = (year, month, day, hour, 0, 0, 0, 0, -1)
+    seconds = int(time.mktime(start))
+    offset = calendar.timegm(start) - seconds
+    if time.localtime(seconds - 10800).tm_gmtoff != offset or time.localtime(seconds + 10800).tm_gmtoff != offset:
+        return None
+    return offset
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _tz_delta(tzinfo, year, month, day, hour):
+    """Return the difference between naive localtime and tzinfo wall time
+    for a localtime hour bucket, or None if it changes within the hour."""
+    start = datetime.datetime(year, month, day, hour)
+    end = start.replace(minute=59, second=59)
+    delta = LOCAL.localize(start).astimezone(tzinfo).replace(tzinfo=None) - start
+    if LOCAL.localize(end).astimezone(tzinfo).replace(tzinfo=None) - end != delta:
+        return None
+    return delta
+
+
+def _date_strftime(d, local=False, show_time=True):
     fmt = '%Y-%m-%d'
     if show_time:
         fmt += 'T%H:%M:%S'
@@ -34,32 +75,125 @@ def _date(d, local=False, show_time=True):
     return d.strftime(fmt)
 
 
+def _date(d, local=False, show_time=True):
+    if d is None:
+        return '0001-01-01T00:00:00Z'
+
+    # TODO make pyko not assume naive localtime..
+    try:
+        offset = _utc_offset(d.year, d.month, d.day, d.hour)
+        if offset is None:
+            return _date_strftime(d, local, show_time)
+        u = d - datetime.timedelta(seconds=offset)
+    except (OverflowError, ValueError):
+        return _date_strftime(d, local, show_time)
+
+    if show_time:
+        s = '%04d-%02d-%02dT%02d:%02d:%02d' % (u.year, u.month, u.day, u.hour, u.minute, u.second)
+    else:
+        s = '%04d-%02d-%02d' % (u.year, u.month, u.day)
+    if d.microsecond:
+        # NOTE: mktime drops sub-second precision, keep the established output.
+        s += '.000000'
+    if not local:
+        s += 'Z'
+    return s
+
+
+def _prefer_timezone(req):
+    """Return the (tzinfo, name) tuple to be used for dates of the request.
+
+    The Prefer outlook.timezone header is resolved once per request and
+    stored in the request context. Defaults to UTC.
+    """
+    prefer_tz = req.context.get('prefer_timezone')
+    if prefer_tz is None:
+        prefer_tz = req.context.prefer.get('outlook.timezone')
+        if not prefer_tz or not prefer_tz[0]:
+            prefer_tz = (UTC, 'UTC')
+        req.context.prefer_timezone = prefer_tz
+    return prefer_tz
+
+
 # TODO: re-order args? req, d, tzinfo=None?
 def _tzdate(d, tzinfo, req):
     if d is None:
         return None
 
-    fmt = '%Y-%m-%dT%H:%M:%S'
+    # Apply timezone preference when set in request context.
+    prefer_tzinfo, prefer_timeZone = _prefer_timezone(req)
 
     if d.tzinfo is None:
         # NOTE(longsleep): pyko uses naive localtime..
-        d = LOCAL.localize(d)
-
-    # Apply timezone preference when set in request context.
-    prefer_tz = req.context.prefer.get('outlook.timezone')
-    if prefer_tz and prefer_tz[0]:
-        d = d.astimezone(prefer_tz[0]).replace(tzinfo=None)
-        prefer_timeZone = prefer_tz[1]
+        try:
+            delta = _tz_delta(prefer_tzinfo, d.year, d.month, d.day, d.hour)
+        except (OverflowError, ValueError):
+            delta = None
+        if delta is not None:
+            d = d + delta
+        else:
+            d = LOCAL.localize(d).astimezone(prefer_tzinfo).replace(tzinfo=None)
     else:
-        prefer_timeZone = 'UTC'
-        d = d.astimezone(UTC).replace(tzinfo=None)
+        d = d.astimezone(prefer_tzinfo).replace(tzinfo=None)
 
     return {
-        'dateTime': d.strftime(fmt),
+        'dateTime': '%04d-%02d-%02dT%02d:%02d:%02d' % (d.year, d.month, d.day, d.hour, d.minute, d.second),
         'timeZone': prefer_timeZone,  # TODO error
     }
 
 
+def _body_etag(body):
+    return 'W/"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class JSONCache:
+    """Size bounded LRU cache of serialized JSON.
+
+    Keys are expected to include the changekey of the serialized object, so
+    modified objects are never served stale; their old entries age out.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = len(value) + JSON_CACHE_ENTRY_OVERHEAD
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= len(old) + JSON_CACHE_ENTRY_OVERHEAD
+            self._data[key] = value
+            self.size += size
+            while self.size > self.max_size:
+                _, old = self._data.popitem(last=False)
+                self.size -= len(old) + JSON_CACHE_ENTRY_OVERHEAD
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+JSON_CACHE = JSONCache(config.JSON_CACHE_SIZE)
+
+
 def _naive_local(d):  # TODO make pyko not assume naive localtime..
     if d.tzinfo is not None:
         return d.astimezone(LOCAL).replace(tzinfo=None)
@@ -144,6 +278,63 @@ class Resource(BaseResource):
     # and etc which are not exists in the other fields.
     individual_fields = {}
 
+    # Set True if serialized objects depend on the requesting user (beyond the
+    # store they were opened from), to scope JSON cache entries per user.
+    json_cache_per_user = False
+
+    # Derive the ETag from a hash of the full representation when there is
+    # no '@odata.etag' field (e.g. folders, where the changekey does not
+    # reflect item count changes).
+    etag_from_body = False
+
+    def get_etag(self, req, obj, all_fields):
+        """Return the (weak) entity tag of obj or None if it has none.
+
+        Without an '@odata.etag' field, the representation is hashed with all
+        fields and without '@odata.context', so the tag does not depend on
+        $select, $expand or the request path.
+        """
+        accessor = all_fields.get('@odata.etag') if all_fields else None
+        if accessor is not None:
+            if accessor.__code__.co_argcount == 1:
+                return accessor(obj)
+            return accessor(req, obj)
+        if self.etag_from_body:
+            return self._body_etag(req, obj)[0]
+        return None
+
+    def _body_etag(self, req, obj):
+        """Return the entity tag of obj hashed from its representation.
+
+        Returns:
+            Tuple[str,Dict]: entity tag and the representation with all
+                fields, which responses reuse.
+        """
+        fields = self._get_fields(obj)
+        data = self.get_fields(req, obj, fields, fields)
+        return _body_etag(_dumpb_json(data)), data
+
+    def check_if_match(self, req, obj, all_fields=None):
+        """Raise HTTPPreconditionFailed if If-Match does not match obj."""
+        if_match = req.get_header('If-Match')
+        if if_match is None:
+            return
+        if all_fields is None:
+            all_fields = self._get_fields(obj)
+        if not _match_etag(if_match, self.get_etag(req, obj, all_fields)):
+            raise falcon.HTTPPreconditionFailed(description="entity tag does not match")
+
+    @staticmethod
+    def _not_modified(req, resp, etag):
+        """Set the ETag header and return True if a 304 should be sent."""
+        if etag is None:
+            return False
+        resp.etag = etag
+        if req.method in ('GET', 'HEAD') and _match_etag(req.get_header('If-None-Match'), etag):
+            resp.status = falcon.HTTP_304
+            return True
+        return False
+
     def get_fields(self, req, obj, fields, all_fields):
         fields = fields or all_fields or self.fields
         result = {}
@@ -161,13 +352,53 @@ class Resource(BaseResource):
             del result['@odata.type']
         return result
 
+    @staticmethod
+    def json_cache_id(obj):
+        """Return the ID identifying obj in the JSON cache."""
+        return obj.entryid
+
+    def json_cache_key(self, req, obj, fields, all_fields, multi):
+        """Return the JSON cache key for obj or None if it is not cacheable.
+
+        Only objects with a changekey based '@odata.etag' are cached.
+        """
+        if '@odata.etag' not in all_fields:
+            return None
+        try:
+            objid = self.json_cache_id(obj)
+            changekey = obj.changekey
+        except AttributeError:
+            return None
+        return (
+            self.__class__,
+            objid,
+            changekey,
+            frozenset(fields) if fields else tuple(all_fields),
+            req.context.prefer.get('outlook.body-content-type'),
+            _prefer_timezone(req)[1],
+            None if multi else req.path,
+            req.context.get('userid') if self.json_cache_per_user else None,
+        )
+
     def json(self, req, obj, fields, all_fields, multi=False, expand=None):
+        key = None
+        if JSON_CACHE.max_size > 0 and not expand:
+            key = self.json_cache_key(req, obj, fields, all_fields, multi)
+            if key is not None:
+                value = JSON_CACHE.get(key)
+                if value is not None:
+                    return value
+
         data = self.get_fields(req, obj, fields, all_fields)
         if not multi:
             data['@odata.context'] = req.path
         if expand:
             data.update(expand)
-        return _dumpb_json(data)
+        value = _dumpb_json(data)
+
+        if key is not None:
+            JSON_CACHE.put(key, value)
+        return value
 
     def json_multi(self, req, obj, fields, all_fields, top, skip, count, deltalink, add_count=False):
         header = b'{\n'
@@ -195,11 +426,13 @@ class Resource(BaseResource):
                 if isinstance(o, tuple):
                     o, resource = o
                     all_fields = resource.fields
+                wa = self.json(req, o, fields, all_fields, multi=True)
+                chunk = b'\n'.join([b'    ' + line for line in wa.splitlines()])
+                # One chunk per item, including its separator.
                 if not first:
-                    yield b',\n'
+                    chunk = b',\n' + chunk
                 first = False
-                wa = self.json(req, o, fields, all_fields, multi=True)
-                yield b'\n'.join([b'    ' + line for line in wa.splitlines()])
+                yield chunk
         except Exception:
             logging.exception("failed to marshal %s JSON response", req.path)
         yield b'\n  ]\n}'
@@ -235,7 +468,8 @@ class Resource(BaseResource):
             fields = None
             is_select_query = False
 
-        if all_fields is None:
+        default_fields = all_fields is None
+        if default_fields:
             all_fields = self._get_fields(obj, is_select_query)
 
         resp.content_type = "application/json"
@@ -252,6 +486,16 @@ class Resource(BaseResource):
 
         # single object
         else:
+            # skip serialization entirely when the client copy is current,
+            # a representation hashed for the tag is reused for the body
+            body = None
+            if default_fields and self.etag_from_body and '@odata.etag' not in all_fields:
+                etag, body = self._body_etag(req, obj)
+            else:
+                etag = self.get_etag(req, obj, all_fields)
+            if self._not_modified(req, resp, etag):
+                return
+
             # expand sub-objects # TODO stream?
             expand = None
             if '$expand' in args:
@@ -265,7 +509,20 @@ class Resource(BaseResource):
                         obj2, resource = self.expansions[field](obj)
                         # TODO item@odata.context, @odata.type..
                         expand[field.split('/')[1]] = self.get_fields(req, obj2, resource.fields, resource.fields)
-            resp.body = self.json(req, obj, fields, all_fields, expand=expand)
+
+            if body is not None and fields is not None:
+                # $select of fields which are all in the hashed representation
+                if all(f in body or f not in all_fields for f in fields):
+                    body = {f: body[f] for f in fields if f in body}
+                else:
+                    body = None
+            if body is not None:
+                body['@odata.context'] = req.path
+                if expand:
+                    body.update(expand)
+                resp.body = _dumpb_json(body)
+            else:
+                resp.body = self.json(req, obj, fields, all_fields, expand=expand)
 
     def generator(self, req, generator, count=0, args=None):
         """Response generator.
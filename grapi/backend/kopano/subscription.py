@@ -3,13 +3,19 @@
 import codecs
 import collections
 import datetime
+import functools
+import heapq
 import http.cookiejar
+import itertools
 import logging
+import os
+import re
 import time
 import uuid
-from queue import Empty, Full, Queue
-from threading import Event, Lock, Thread
-from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from threading import BoundedSemaphore, Condition, Event, Lock, RLock, Thread
+from urllib.parse import parse_qs, urlparse
 
 import dateutil.parser
 import falcon
@@ -19,11 +25,17 @@ import validators
 from MAPI.Struct import MAPIErrorNoSupport
 
 from grapi.api.v1 import config
-from grapi.api.v1.api import API
-from grapi.api.v1.resource import Resource, _dumpb_json
+from grapi.api.v1.context import Context
+from grapi.api.v1.prefer import Prefer
+from grapi.api.v1.resource import Resource, _dumpb_json, _encode_qs
 from grapi.api.v1.schema import subscription as subscription_schema
 
 from . import utils
+from .contact import ContactResource
+from .event import EventResource
+from .message import MessageResource
+from .registry import SubscriptionRegistry
+from .webhook import OPEN, WebhookDelivery, host_key
 
 try:
     from prometheus_client import Counter, Gauge, Histogram
@@ -31,10 +43,6 @@ try:
 except ImportError:  # pragma: no cover
     PROMETHEUS = False
 
-# TODO don't block on sending updates
-# TODO async subscription validation
-# TODO restarting app/server?
-# TODO list subscription scalability
 # TODO use mulitprocessing
 
 # GRAPI uses Base64, tell kopano module about it.
@@ -57,7 +65,23 @@ RECORDS = {}
 # to allow it to be cleaned up later.
 RECORD_INDEX = 0
 
-# Global request session, to reuse connections.
+# USER_LOCKS hold a lock per user ID, see _user_record.
+USER_LOCKS = {}
+
+# REGISTRY persists subscriptions, when enabled. PENDING_RESTORE holds
+# persisted subscriptions by user ID, which are restored on the next request
+# of the user or by the SubscriptionRestorer.
+REGISTRY = None
+PENDING_RESTORE = {}
+
+# RESTORE_FAILURES are the errors after which persisted subscriptions can
+# never be restored, because their data is invalid or their user or folder
+# does not exist anymore.
+RESTORE_FAILURES = (
+    falcon.HTTPBadRequest, falcon.HTTPNotFound, kopano.errors.NotFoundError, KeyError, ValueError
+)
+
+# Global request session for webhook validation, to reuse connections.
 REQUEST_SESSION = requests.Session()
 REQUEST_SESSION.cookies = requests.cookies.RequestsCookieJar(
     http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
@@ -70,8 +94,70 @@ REQUEST_SESSION.mount(
     config.SUBSCRIPTION_REQUEST_SESSION_PREFIX, REQUEST_HTTPS_ADAPTER
 )
 
-# API to get access to all routes.
-_API = API()
+
+class ResourceMatcher:
+    """Match subscription resources against route templates.
+
+    Templates use the falcon syntax (e.g. "mailFolders/{folderid}/messages")
+    and are compiled to regular expressions once.
+    """
+
+    def __init__(self, user_templates, templates):
+        """Built-in Python method.
+
+        Args:
+            user_templates (List[str]): templates of the user part which
+                every resource starts with.
+            templates (List[Tuple[str,str]]): resource templates, relative to
+                the user part, and their resource names.
+        """
+        self._routes = [
+            (self._compile('{}/{}'.format(user_template, template)), resource_name)
+            for user_template in user_templates
+            for template, resource_name in templates
+        ]
+
+    @staticmethod
+    def _compile(template):
+        parts = re.split(r'{(\w+)}', template)
+        pattern = ''.join(
+            '(?P<{}>[^/]+)'.format(part) if n % 2 else re.escape(part)
+            for n, part in enumerate(parts)
+        )
+        return re.compile('^{}$'.format(pattern))
+
+    def match(self, resource):
+        """Return the resource name and fields of a resource.
+
+        Args:
+            resource (str): resource (e.g. me/mailFolders/inbox/messages).
+
+        Returns:
+            Union[Tuple[str,Dict],None]: resource name and template fields,
+                None when no template matches.
+        """
+        resource = resource.strip('/')
+        for pattern, resource_name in self._routes:
+            match = pattern.match(resource)
+            if match:
+                return resource_name, match.groupdict()
+        return None
+
+
+# Resources which can be subscribed to, the same paths as the API routes.
+SUBSCRIPTION_RESOURCES = ResourceMatcher(
+    ['me', 'users/{userid}'],
+    [
+        ('messages', 'MessageResource'),
+        ('mailFolders/{folderid}/messages', 'MessageResource'),
+        ("mailFolders('{folderid}')/messages", 'MessageResource'),
+        ('events', 'EventResource'),
+        ('calendar/events', 'EventResource'),
+        ('calendars/{folderid}/events', 'EventResource'),
+        ('contacts', 'ContactResource'),
+        ('contactFolders/{folderid}/contacts', 'ContactResource'),
+    ]
+)
 
 NotificationRecord = collections.namedtuple('NotificationRecord', [
     'subscriptionId',
@@ -81,7 +167,16 @@ NotificationRecord = collections.namedtuple('NotificationRecord', [
     'dataType',
     'url',
     'id',
-])
+    'resourceData',
+], defaults=(None,))
+
+# Resources which serialize the resource data of rich notifications, by
+# data type.
+RESOURCE_DATA_RESOURCES = {
+    'message': MessageResource(None),
+    'event': EventResource(None),
+    'contact': ContactResource(None),
+}
 
 
 if PROMETHEUS:
@@ -89,18 +184,18 @@ if PROMETHEUS:
     SUBSCR_EXPIRED = Counter('kopano_mfr_kopano_total_expired_subscriptions', 'Total number of subscriptions which expired')
     SUBSCR_ACTIVE = Gauge('kopano_mfr_kopano_active_subscriptions', 'Number of active subscriptions', multiprocess_mode='liveall')
     PROCESSOR_BATCH_HIST = Histogram('kopano_mfr_kopano_webhook_batch_size', 'Number of webhook posts processed in one batch')
-    POST_COUNT = Counter('kopano_mfr_kopano_total_webhook_posts', 'Total number of webhook posts')
-    POST_ERRORS = Counter('kopano_mfr_kopano_total_webhook_post_errors', 'Total number of webhook post errors')
-    POST_HIST = Histogram('kopano_mfr_kopano_webhook_post_duration_seconds', 'Duration of webhook post requests in seconds')
     DANGLING_COUNT = Counter('kopano_mfr_kopano_total_broken_subscription_conns', 'Total number of broken subscription connections')
+    QUEUE_WAIT_HIST = Histogram('kopano_mfr_kopano_notification_queue_wait_seconds', 'Time notifications waited in the subscription queue in seconds')
+    DEBOUNCE_HIST = Histogram('kopano_mfr_kopano_notification_debounce_seconds', 'Time notifications were held back for debouncing in seconds')
     QUEUE_SIZE_GAUGE = Gauge('kopano_mfr_kopano_subscription_queue_size', 'Current size of subscriptions processor queue', multiprocess_mode='liveall')
-    PROCESSOR_POOL_GAUGE = Gauge('kopano_mfr_kopano_webhook_pools', 'Current number of webhook pools')
+    QUEUE_COALESCED = Counter('kopano_mfr_kopano_total_subscription_queue_coalesced', 'Total number of notifications merged into a queued duplicate')
+    QUEUE_DROPS = Counter('kopano_mfr_kopano_total_subscription_queue_drops', 'Total number of notifications dropped because the subscription queue was full')
 
 
 class Record:
     """Record binds subscription and conection information per user."""
 
-    def __init__(self, server, user, store, subscriptions):
+    def __init__(self, server, user, store, subscriptions, auth_userid=None, oidc=False):
         """Python built-in method.
 
         Args:
@@ -108,11 +203,20 @@ class Record:
             user (User): user object.
             store (Store): user's store object.
             subscriptions (Dict): subscriptions data.
+            auth_userid (Union[str,None]): user ID the record was created
+                for, None when it is not kept in RECORDS.
+            oidc (bool): the user authenticated with a bearer token.
         """
         self.server = server
         self.user = user
         self.store = store
         self.subscriptions = subscriptions
+        self.auth_userid = auth_userid
+        self.oidc = oidc
+        # Shared sinks by folder and types, see SubscriptionSink.
+        self.sinks = {}
+        # Serializes subscribing to the shared sinks.
+        self.lock = RLock()
 
 
 def _server(auth_user, auth_pass, oidc=False):
@@ -186,12 +290,73 @@ def _record(req, options):
     elif auth['method'] == 'basic':  # basic auth for tests
         return _basic_auth(codecs.decode(auth['user'], 'utf8'), auth['password'])
 
+    return _user_record(auth_userid, auth_password, oidc, options)
+
+
+def _user_lock(auth_userid):
+    """Return the lock which serializes record creation for a user.
+
+    Args:
+        auth_userid (str): user ID.
+
+    Returns:
+        RLock: lock of the user.
+    """
+    with thread_lock:
+        lock = USER_LOCKS.get(auth_userid)
+        if lock is None:
+            lock = USER_LOCKS[auth_userid] = RLock()
+        return lock
+
+
+def _user_record(auth_userid, auth_password, oidc, options):
+    """Return the record of a user.
+
+    If no record is found or its connection broke, a new one is created.
+    Persisted subscriptions of the user are restored into a new record.
+
+    Requests forwarded by other notify workers run in threads of their own,
+    so this is serialized per user to create one record and session only.
+
+    Args:
+        auth_userid (str): user ID.
+        auth_password (str): authentication password or token.
+        oidc (bool): is it OIDC or not.
+        options (Options): deployment options.
+
+    Returns:
+        Record: record of the user.
+    """
+    while True:
+        lock = _user_lock(auth_userid)
+        with lock:
+            # The lock may have been purged while waiting for it.
+            with thread_lock:
+                current = USER_LOCKS.get(auth_userid) is lock
+            if current:
+                return _open_user_record(auth_userid, auth_password, oidc, options)
+
+
+def _open_user_record(auth_userid, auth_password, oidc, options):
+    """Return the record of a user, see _user_record.
+
+    Args:
+        auth_userid (str): user ID.
+        auth_password (str): authentication password or token.
+        oidc (bool): is it OIDC or not.
+        options (Options): deployment options.
+
+    Returns:
+        Record: record of the user.
+    """
+    global RECORD_INDEX
+    global RECORDS
+
     with thread_lock:
         record = RECORDS.get(auth_userid)
     if record is not None:
         try:
             user = record.server.user(userid=auth_userid)
-            return record
         except Exception:
             # server restart: try to reconnect TODO check kc_session_restore (incl. notifs!)
             logging.exception(
@@ -209,26 +374,440 @@ def _record(req, options):
 
             if old_subscriptions:
                 # Instantly kill of subscriptions.
-                for subscriptionid, (_, sink, _) in old_subscriptions.items():
-                    sink.unsubscribe()
+                for subscriptionid, (subscription, sink, _) in old_subscriptions.items():
+                    EXPIRY.discard(subscriptionid)
+                    INDEX.discard(subscriptionid)
+                    sink.unsubscribe(subscriptionid)
                     logging.debug(
                         'subscription cleaned up after connection error, id:%s', subscriptionid
                     )
                     if options and options.with_metrics:
                         SUBSCR_ACTIVE.dec(1)
+                    if REGISTRY is not None and not subscription.get('_pending'):
+                        # Restored on the new connection below, tell the
+                        # subscriber that notifications might be missing.
+                        # Subscriptions pending validation are not restored,
+                        # their validation ends with the old record.
+                        _notify_missed(subscription)
+                        with thread_lock:
+                            PENDING_RESTORE.setdefault(auth_userid, []).append(
+                                _export_subscription(subscription)
+                            )
                 old_subscriptions = None
             if old_record and options and options.with_metrics:
                 DANGLING_COUNT.inc()
+        else:
+            # Retry restores which failed before.
+            with thread_lock:
+                pending = PENDING_RESTORE.pop(auth_userid, None)
+            if pending:
+                _restore_subscriptions(record, pending, options)
+            return record
 
     logging.debug('creating subscription session for user %s', auth_userid)
     server = _server(auth_userid, auth_password, oidc=oidc)
     user = server.user(userid=auth_userid)
     store = user.store
 
-    record = Record(server=server, user=user, store=store, subscriptions={})
+    record = Record(
+        server=server, user=user, store=store, subscriptions={},
+        auth_userid=auth_userid, oidc=oidc
+    )
     with thread_lock:
         RECORDS.update({auth_userid: record})
-        return RECORDS.get(auth_userid)
+        record = RECORDS.get(auth_userid)
+        pending = PENDING_RESTORE.pop(auth_userid, None)
+    if pending:
+        _restore_subscriptions(record, pending, options)
+    return record
+
+
+def _persist(record, subscription, expiration):
+    """Store a subscription in the registry, when enabled.
+
+    Subscriptions pending validation are stored once they are validated.
+
+    Args:
+        record (Record): record of the subscription.
+        subscription (Dict): subscription data.
+        expiration (float): POSIX timestamp of the expiration.
+    """
+    if REGISTRY is None or record.auth_userid is None:
+        return
+    if subscription.get('_pending'):
+        return
+    try:
+        REGISTRY.put(_export_subscription(subscription), record.auth_userid, record.oidc, expiration)
+    except Exception:
+        logging.exception('failed to persist subscription, id:%s', subscription['id'])
+
+
+def _unpersist(subscription_id):
+    """Remove a subscription from the registry, when enabled.
+
+    Args:
+        subscription_id (str): subscription ID.
+    """
+    if REGISTRY is None:
+        return
+    try:
+        REGISTRY.remove(subscription_id)
+    except Exception:
+        logging.exception('failed to remove persisted subscription, id:%s', subscription_id)
+
+
+def _subscription_exists(subscription_id):
+    """Return whether a subscription still exists.
+
+    Subscriptions of other workers are known from the registry. Without the
+    registry, or while it is not open yet, every subscription is assumed to
+    exist.
+
+    Args:
+        subscription_id (str): subscription ID.
+
+    Returns:
+        bool: False when the subscription is known to be gone.
+    """
+    if subscription_id in INDEX or REGISTRY is None:
+        return True
+    try:
+        return REGISTRY.exists(subscription_id, time.time())
+    except Exception:
+        logging.exception('failed to look up persisted subscription, id:%s', subscription_id)
+        return True
+
+
+def gen_lifecycle_notification(subscription, lifecycle_event):
+    """Return lifecycle notification data structure for a subscription.
+
+    Args:
+        subscription (Dict): subscription data.
+        lifecycle_event (str): lifecycle event (e.g. missed).
+
+    Returns:
+        Dict: notification data.
+    """
+    return {
+        'value': [{
+            'subscriptionId': subscription['id'],
+            'subscriptionExpirationDateTime': subscription['expirationDateTime'],
+            'clientState': subscription.get('clientState'),
+            'lifecycleEvent': lifecycle_event,
+        }],
+    }
+
+
+def _notify_missed(subscription):
+    """Tell a subscriber that notifications might have been missed.
+
+    The lifecycle notification goes to the lifecycleNotificationUrl of the
+    subscription, or to its notificationUrl when it has none.
+
+    Args:
+        subscription (Dict): subscription data.
+    """
+    delivery = SubscriptionResource._delivery
+    if delivery is None:
+        return
+    url = subscription.get('lifecycleNotificationUrl') or subscription['notificationUrl']
+    delivery.submit(url, gen_lifecycle_notification(subscription, 'missed'), (subscription['id'],))
+
+
+def _restore_subscriptions(record, subscriptions, options):
+    """Subscribe persisted subscriptions again.
+
+    Subscriptions which are expired, invalid or whose folder no longer
+    exists are removed from the registry. Those which failed otherwise are
+    put back into PENDING_RESTORE to be retried.
+
+    Args:
+        record (Record): record of the subscription owner.
+        subscriptions (List[Dict]): exported subscription data.
+        options (Options): deployment options.
+    """
+    now = time.time()
+    retry = []
+    for subscription in subscriptions:
+        subscription_id = subscription['id']
+        try:
+            expiration = _expiration_timestamp(subscription['expirationDateTime'])
+            if expiration <= now:
+                _unpersist(subscription_id)
+                continue
+            _subscribe(record, dict(subscription), options, SubscriptionResource._queue, expiration)
+            logging.debug('subscription restored, id:%s', subscription_id)
+            if options and options.with_metrics:
+                SUBSCR_ACTIVE.inc()
+        except RESTORE_FAILURES:
+            logging.exception('failed to restore subscription, removing it, id:%s', subscription_id)
+            _unpersist(subscription_id)
+        except Exception:
+            logging.exception('failed to restore subscription, retrying later, id:%s', subscription_id)
+            retry.append(subscription)
+    if retry:
+        with thread_lock:
+            PENDING_RESTORE.setdefault(record.auth_userid, []).extend(retry)
+
+
+def _subscribe(record, json_data, options, queue, expiration):
+    """Subscribe a subscription on the server and add it to a record.
+
+    Args:
+        record (Record): record of the subscription owner.
+        json_data (Dict): subscription data, including its ID.
+        options (Options): deployment options.
+        queue (NotificationBuffer): notification records.
+        expiration (float): POSIX timestamp of the expiration.
+
+    Returns:
+        SubscriptionSink: sink of the subscription.
+    """
+    subscription_id = json_data['id']
+    resource, _, query = json_data['resource'].partition('?')
+    folder, folder_types, data_type, object_types = _subscription_object(
+        record.store, resource, subscription_id
+    )
+    json_data['_datatype'] = data_type
+    select = parse_qs(query).get('$select')
+    json_data['_select'] = tuple(select[0].split(',')) if select else None
+
+    event_types = json_data['changeType'].split(',')
+
+    # Share the server subscription with other subscriptions of the same
+    # folder and types.
+    key = (folder.entryid, tuple(sorted(event_types)), tuple(object_types), tuple(folder_types))
+    with record.lock:
+        sink = SubscriptionSink.attach(record.sinks, key, json_data)
+        if sink is None:
+            sink = SubscriptionSink(
+                record.store, options, json_data, queue, record.sinks, key
+            )
+            folder.subscribe(
+                sink,
+                object_types=object_types,
+                event_types=event_types,
+                folder_types=folder_types
+            )
+            sink.register()
+
+    record.subscriptions[subscription_id] = (json_data, sink, record.user.userid)
+    INDEX.add(subscription_id, record, record.user.userid, json_data)
+    EXPIRY.set(subscription_id, record, expiration)
+    logging.debug(
+        "subscription created, auth_user:%s, id:%s, target:%s,"
+        " object_types:%s, event_types:%s, folder_types:%s",
+        record.server.auth_user, subscription_id, folder,
+        object_types, event_types, folder_types
+    )
+    return sink
+
+
+def _expiration_timestamp(value):
+    """Return the timestamp of an expirationDateTime value.
+
+    Args:
+        value (str): date and time, UTC when it has no timezone.
+
+    Returns:
+        float: POSIX timestamp.
+
+    Raises:
+        ValueError: when value is not a valid datetime string.
+    """
+    expiration = dateutil.parser.parse(value)
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=datetime.timezone.utc)
+    return expiration.timestamp()
+
+
+class ExpiryHeap:
+    """Expiration schedule of subscriptions.
+
+    A min-heap of expiration timestamps. Rescheduled and removed
+    subscriptions leave their old entries behind, which are skipped when
+    they come up.
+    """
+
+    def __init__(self):
+        """Built-in Python method."""
+        self._heap = []
+        self._seq = itertools.count()
+        # Current expiration timestamp by subscription ID.
+        self._expirations = {}
+        self._cond = Condition()
+
+    def __len__(self):
+        return len(self._expirations)
+
+    def set(self, subscription_id, record, timestamp):
+        """Schedule or reschedule the expiration of a subscription.
+
+        Args:
+            subscription_id (str): subscription ID.
+            record (Record): record holding the subscription.
+            timestamp (float): POSIX timestamp of the expiration.
+        """
+        with self._cond:
+            self._expirations[subscription_id] = timestamp
+            heapq.heappush(self._heap, (timestamp, next(self._seq), subscription_id, record))
+            if self._heap[0][2] == subscription_id:
+                self._cond.notify()
+
+    def discard(self, subscription_id):
+        """Remove a subscription from the schedule.
+
+        Args:
+            subscription_id (str): subscription ID.
+        """
+        with self._cond:
+            self._expirations.pop(subscription_id, None)
+
+    def _pop_due(self, now):
+        heap = self._heap
+        due = []
+        while heap and heap[0][0] <= now:
+            timestamp, _, subscription_id, record = heapq.heappop(heap)
+            if self._expirations.get(subscription_id) == timestamp:
+                del self._expirations[subscription_id]
+                due.append((subscription_id, record))
+        # Skip stale entries at the top, so the wait is for a current one.
+        while heap and self._expirations.get(heap[0][2]) != heap[0][0]:
+            heapq.heappop(heap)
+        return due
+
+    def wait(self, timeout):
+        """Wait until subscriptions expire and return them.
+
+        Args:
+            timeout (float): maximum number of seconds to wait.
+
+        Returns:
+            List[Tuple[str,Record]]: expired subscription IDs and records,
+                empty when the timeout passed first.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                due = self._pop_due(time.time())
+                if due:
+                    return due
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return due
+                if self._heap:
+                    remaining = min(remaining, self._heap[0][0] - time.time())
+                self._cond.wait(max(remaining, 0))
+
+
+# EXPIRY schedules the expiration of all subscriptions.
+EXPIRY = ExpiryHeap()
+
+
+class SubscriptionIndex:
+    """Index of all subscriptions of the process.
+
+    Subscriptions are indexed by ID and by the user ID of their owner, across
+    all records, so lookups and pages of a user's subscriptions do not scan
+    other subscriptions.
+    """
+
+    def __init__(self):
+        """Built-in Python method."""
+        self._lock = Lock()
+        # Record and user ID by subscription ID.
+        self._by_id = {}
+        # Subscriptions by subscription ID, by user ID, in order of creation.
+        self._by_user = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, subscription_id):
+        return subscription_id in self._by_id
+
+    def add(self, subscription_id, record, userid, subscription):
+        """Add a subscription.
+
+        Args:
+            subscription_id (str): subscription ID.
+            record (Record): record holding the subscription.
+            userid (str): user ID of the subscription owner.
+            subscription (Dict): subscription data.
+        """
+        with self._lock:
+            self._discard(subscription_id)
+            self._by_id[subscription_id] = (record, userid)
+            self._by_user.setdefault(userid, {})[subscription_id] = subscription
+
+    def _discard(self, subscription_id):
+        entry = self._by_id.pop(subscription_id, None)
+        if entry is None:
+            return
+        userid = entry[1]
+        subscriptions = self._by_user[userid]
+        del subscriptions[subscription_id]
+        if not subscriptions:
+            del self._by_user[userid]
+
+    def discard(self, subscription_id):
+        """Remove a subscription.
+
+        Args:
+            subscription_id (str): subscription ID.
+        """
+        with self._lock:
+            self._discard(subscription_id)
+
+    def get(self, subscription_id, userid):
+        """Return the record holding a subscription of a user.
+
+        Args:
+            subscription_id (str): subscription ID.
+            userid (str): user ID of the requesting user.
+
+        Returns:
+            Union[Record,None]: record holding the subscription, None if
+                there is no such subscription of the user.
+        """
+        entry = self._by_id.get(subscription_id)
+        if entry is None or entry[1] != userid:
+            return None
+        return entry[0]
+
+    def count(self, userid):
+        """Return the number of subscriptions of a user.
+
+        Args:
+            userid (str): user ID.
+
+        Returns:
+            int: number of subscriptions.
+        """
+        return len(self._by_user.get(userid, ()))
+
+    def page(self, userid, skip, top):
+        """Return a page of the subscriptions of a user.
+
+        Args:
+            userid (str): user ID.
+            skip (int): number of subscriptions to skip.
+            top (int): maximum number of subscriptions to return.
+
+        Returns:
+            Tuple[List[Dict],bool]: subscription data and whether there
+                are more subscriptions after the page.
+        """
+        with self._lock:
+            subscriptions = self._by_user.get(userid)
+            if not subscriptions:
+                return [], False
+            page = list(itertools.islice(subscriptions.values(), skip, skip + top + 1))
+        return page[:top], len(page) > top
+
+
+# INDEX holds all subscriptions of the process.
+INDEX = SubscriptionIndex()
 
 
 class LastUpdatedOrderedDict(collections.OrderedDict):
@@ -240,20 +819,210 @@ class LastUpdatedOrderedDict(collections.OrderedDict):
         collections.OrderedDict.__setitem__(self, key, value)
 
 
-def new_record(subscription, notification):
+class NotificationBuffer:
+    """Bounded buffer of notification records which never blocks producers.
+
+    A record which is already buffered is merged into the buffered one, which
+    keeps its position. When the buffer is full, new records are dropped and
+    counted instead of waiting for space, so the notification threads of the
+    kopano server connections never stall.
+    """
+
+    def __init__(self, maxsize):
+        """Built-in Python method.
+
+        Args:
+            maxsize (int): maximum number of buffered records.
+        """
+        self.maxsize = maxsize
+        # Number of records which were merged or dropped.
+        self.coalesced = 0
+        self.dropped = 0
+
+        self._records = collections.OrderedDict()
+        self._cond = Condition()
+
+    def put(self, record, created=None):
+        """Add a record, without blocking.
+
+        Args:
+            record (NotificationRecord): notification record.
+            created (Union[float,None]): monotonic time of the change,
+                defaults to now.
+
+        Returns:
+            bool: False when the record was dropped.
+        """
+        with self._cond:
+            if record in self._records:
+                self.coalesced += 1
+                return True
+            if len(self._records) >= self.maxsize:
+                self.dropped += 1
+                return False
+            self._records[record] = time.monotonic() if created is None else created
+            self._cond.notify()
+        return True
+
+    def get(self, timeout=None):
+        """Remove and return the oldest record.
+
+        Args:
+            timeout (Union[float,None]): seconds to wait for a record, None
+                waits forever.
+
+        Returns:
+            Tuple[NotificationRecord,float]: notification record and the
+                monotonic time of its change.
+
+        Raises:
+            Empty: when no record became available within timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._records, timeout):
+                raise Empty
+            return self._records.popitem(last=False)
+
+    def qsize(self):
+        """Return the number of buffered records.
+
+        Returns:
+            int: number of records.
+        """
+        return len(self._records)
+
+
+class ResourceData:
+    """Notification object of a rich notification.
+
+    The notification threads of the server connections must not block, so
+    the object is only serialized by the subscription processor, once, when
+    the first notification record which holds it is sent. It is shared by
+    the records of all subscriptions which select the same fields.
+
+    Resource data compares by the selected fields only, not by the object,
+    so that the NotificationBuffer merges the records of repeated changes of
+    an object.
+    """
+
+    def __init__(self, store, subscription, notification, event_id):
+        """Built-in Python method.
+
+        Args:
+            store (Store): store of the subscription owner.
+            subscription (Dict): subscription info.
+            notification (Notification): an instance of a notification.
+            event_id (str): ID of the notification object.
+        """
+        self.select = subscription.get('_select')
+        self._args = (store, subscription, notification, event_id)
+        self._data = None
+        self._lock = Lock()
+
+    def __eq__(self, other):
+        return isinstance(other, ResourceData) and self.select == other.select
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.select)
+
+    def serialize(self):
+        """Return the serialized object.
+
+        Returns:
+            Union[Dict,None]: resource data, None when the object cannot be
+                serialized (e.g. it was deleted).
+        """
+        with self._lock:
+            if self._args is not None:
+                self._data = gen_resource_data(*self._args)
+                self._args = None
+            return self._data
+
+
+class NotificationRequest:
+    """Stand-in request to serialize resources outside of requests."""
+
+    def __init__(self, store, path):
+        """Built-in Python method.
+
+        Args:
+            store (Store): store of the subscription owner.
+            path (str): request path.
+        """
+        self.path = path
+        self.query_string = ''
+        self.context = Context()
+        self.context.prefer = Prefer(self)
+        self.context.user_store = store
+
+    @staticmethod
+    def get_header(name, default=None):
+        return default
+
+
+def gen_resource_data(store, subscription, notification, event_id):
+    """Serialize the notification object of a rich notification.
+
+    Args:
+        store (Store): store of the subscription owner.
+        subscription (Dict): subscription info.
+        notification (Notification): an instance of a notification.
+        event_id (str): ID of the notification object.
+
+    Returns:
+        Union[Dict,None]: resource data, None when the object cannot be
+            serialized (e.g. it was deleted).
+    """
+    if notification.event_type == 'deleted':
+        return None
+    data_type = subscription['_datatype']
+    resource = RESOURCE_DATA_RESOURCES[data_type]
+    obj = notification.object
+    select = subscription.get('_select')
+    path = subscription['resource'].partition('?')[0]
+    req = NotificationRequest(store, '{}/{}'.format(config.PREFIX, path))
+    if select:
+        fields = set(select + ('@odata.type', '@odata.etag', 'id'))
+        all_fields = resource._get_fields(obj, is_select_query=True)
+    else:
+        fields = all_fields = resource.fields
+    try:
+        data = resource.get_fields(req, obj, fields, all_fields)
+    except Exception:
+        logging.debug(
+            'failed to serialize notification object, id:%s', subscription['id'], exc_info=True
+        )
+        return None
+    data['@data.type'] = '#Microsoft.Graph.%s' % data_type
+    data['id'] = event_id
+    return data
+
+
+def _event_id(subscription, notification):
+    if subscription['_datatype'] == 'event':
+        return notification.object.eventid
+    return notification.object.entryid
+
+
+def new_record(subscription, notification, event_id=None, resource_data=None):
     """Create and return a new notification record.
 
     Args:
         subscription (Dict): subscription info.
         notification (Notification): an instance of a notification.
+        event_id (Union[str,None]): ID of the notification object, when
+            already known.
+        resource_data (Union[ResourceData,None]): notification object of
+            rich notifications.
 
     Returns:
         NotificationRecord: new notification record.
     """
-    if subscription['_datatype'] == 'event':
-        event_id = notification.object.eventid
-    else:
-        event_id = notification.object.entryid
+    if event_id is None:
+        event_id = _event_id(subscription, notification)
 
     return NotificationRecord(
         subscriptionId=subscription['id'],
@@ -263,6 +1032,7 @@ def new_record(subscription, notification):
         dataType=subscription['_datatype'],
         url=subscription['notificationUrl'],
         id=event_id,
+        resourceData=resource_data,
     )
 
 
@@ -275,15 +1045,34 @@ def gen_notification(record):
     Returns:
         Dict: notification data.
     """
+    resource_data = record.resourceData
+    if resource_data is not None:
+        resource_data = resource_data.serialize()
+    if resource_data is None:
+        resource_data = {
+            '@data.type': '#Microsoft.Graph.%s' % record.dataType,
+            'id': record.id,
+        }
     return {
         'subscriptionId': record.subscriptionId,
         'clientState': record.clientState,
         'changeType': record.changeType,
         'resource': record.resource,
-        'resourceData': {
-            '@data.type': '#Microsoft.Graph.%s' % record.dataType,
-            'id': record.id,
-        },
+        'resourceData': resource_data,
+    }
+
+
+def gen_notifications(records):
+    """Return notification data structure for several records.
+
+    Args:
+        records (List[Record]): records of the same notification url.
+
+    Returns:
+        Dict: notification data with the notifications in a value list.
+    """
+    return {
+        'value': [gen_notification(record) for record in records],
     }
 
 
@@ -291,30 +1080,35 @@ class SubscriptionProcessor(Thread):
     """Process tasks in background.
 
     This single worker thread is responsible for gathering all notifications
-    from the subscription queue and debouncing them before posting these
-    notifications to the corresponding notification url.
+    from the subscription queue and debouncing them before handing these
+    notifications to the webhook delivery, which posts them to the
+    corresponding notification url.
 
-    The queue is filled with notifications by the SubscriptionSink.
+    The queue is filled with notification records by the SubscriptionSink.
     """
 
     _queue = None
 
-    def __init__(self, options, queue):
+    def __init__(self, options, queue, delivery):
         """Built-in Python method.
 
         Args:
             options (Namespace): deployment options.
-            queue (Queue): task queue.
+            queue (NotificationBuffer): notification records.
+            delivery (WebhookDelivery): webhook delivery.
         """
         self.options = options
         self._queue = queue
+        self._delivery = delivery
 
         Thread.__init__(self, name='kopano_subscription_processor')
         utils.set_thread_name(self.name)
         self.daemon = True
 
     def run(self):
-        # Store all pending records in their order.
+        with_metrics = self.options and self.options.with_metrics
+        # Store all pending records in their order, with the time of their
+        # change and the time they were taken from the queue.
         pending = LastUpdatedOrderedDict()
         # ts is used to keep track of the last action, allowing debounce.
         ts = 0
@@ -325,15 +1119,19 @@ class SubscriptionProcessor(Thread):
             try:
                 # Get queue entries, either blocking or with timeout. A timeout is used when records
                 # are already pending.
-                _, notification, subscription = self._queue.get(
+                record, changed = self._queue.get(
                     timeout=debounce_delay if waiting_items else None
                 )
-                record = new_record(subscription, notification)
+                now = time.monotonic()
+                if with_metrics:
+                    QUEUE_WAIT_HIST.observe(now - changed)
 
                 # Add record to pending sorted dict.
                 # This also changes the position of existing records to the end.
-                pending[record] = True
-                now = time.monotonic()
+                previous = pending.get(record)
+                if previous is not None:
+                    changed = min(changed, previous[0])
+                pending[record] = (changed, now)
                 if not waiting_items:
                     # Nothing was waiting before, reset ts and wait.
                     ts = now
@@ -348,44 +1146,34 @@ class SubscriptionProcessor(Thread):
                 # If we get here, it means items are pending and no more have been coming,
                 # pending records will be processed.
 
-            verify = not self.options or not self.options.insecure
-            with_metrics = self.options and self.options.with_metrics
-
             if with_metrics:
                 PROCESSOR_BATCH_HIST.observe(len(pending))
-
-            # Process pending records in their order.
-            for record in pending:
-                try:
-                    if with_metrics:
-                        POST_COUNT.inc()
-                    logging.debug(
-                        'subscription notification, id:%s, url:%s',
-                        record.subscriptionId, record.url
-                    )
-                    # TODO(longsleep): This must be asynchronous or a queue per notificationUrl.
-                    if with_metrics:
-                        with POST_HIST.time():
-                            REQUEST_SESSION.post(
-                                record.url,
-                                json=gen_notification(record),
-                                timeout=config.SUBSCRIPTION_NOTIFY_TIMEOUT,
-                                verify=verify
-                            )
-                    else:
-                        REQUEST_SESSION.post(
-                            record.url,
-                            json=gen_notification(record),
-                            timeout=config.SUBSCRIPTION_NOTIFY_TIMEOUT,
-                            verify=verify
+                now = time.monotonic()
+                for _, dequeued in pending.values():
+                    DEBOUNCE_HIST.observe(now - dequeued)
+
+            # Hand pending records over in their order, delivery happens
+            # concurrently per notification url host.
+            batch_size = config.SUBSCRIPTION_NOTIFY_BATCH_SIZE
+            if batch_size > 1:
+                by_url = collections.OrderedDict()
+                for record in pending:
+                    by_url.setdefault(record.url, []).append(record)
+                for url, records in by_url.items():
+                    for i in range(0, len(records), batch_size):
+                        batch = records[i:i + batch_size]
+                        subscription_ids = collections.OrderedDict.fromkeys(
+                            record.subscriptionId for record in batch
                         )
-                except Exception:
-                    # TODO(longsleep): Retry response errors.
-                    if with_metrics:
-                        POST_ERRORS.inc()
-                    logging.exception(
-                        "subscription notification failed, id:%s, url:%s",
-                        record.subscriptionId, record.url
+                        self._delivery.submit(
+                            url, gen_notifications(batch), tuple(subscription_ids),
+                            changed=min(pending[record][0] for record in batch)
+                        )
+            else:
+                for record, (changed, _) in pending.items():
+                    self._delivery.submit(
+                        record.url, gen_notification(record), (record.subscriptionId,),
+                        changed=changed
                     )
 
             # All done, clear for next round.
@@ -402,15 +1190,17 @@ class SubscriptionPurger(Thread):
 
     _queue = None
 
-    def __init__(self, options, queue):
+    def __init__(self, options, queue, delivery):
         """Built-in Python method.
 
         Args:
             options (Namespace): deployment options.
-            queue (Queue): task queue.
+            queue (NotificationBuffer): notification records.
+            delivery (WebhookDelivery): webhook delivery.
         """
         self.options = options
         self._queue = queue
+        self._delivery = delivery
 
         Thread.__init__(self, name='kopano_subscription_purger')
         utils.set_thread_name(self.name)
@@ -419,81 +1209,138 @@ class SubscriptionPurger(Thread):
 
     def run(self):
         """Built-in Thread method."""
-        expired = {}
-        purge = []
-        while not self.exit.wait(timeout=config.SUBSCRIPTION_EXIT_WAIT_TIMEOUT):
+        coalesced = dropped = 0
+        housekeeping = time.monotonic() + config.SUBSCRIPTION_EXIT_WAIT_TIMEOUT
+        while not self.exit.is_set():
+            # Sleep until the next subscription expires, but not longer than
+            # until the next periodic housekeeping.
+            for subscriptionid, record in EXPIRY.wait(housekeeping - time.monotonic()):
+                try:
+                    try:
+                        sink = record.subscriptions.pop(subscriptionid)[1]
+                    except KeyError:
+                        continue
+                    INDEX.discard(subscriptionid)
+                    sink.unsubscribe(subscriptionid)
+                    _unpersist(subscriptionid)
+                    logging.debug('subscription expired and cleaned up, id:%s', subscriptionid)
+                    if self.options and self.options.with_metrics:
+                        SUBSCR_EXPIRED.inc()
+                        SUBSCR_ACTIVE.dec(1)
+                except Exception:
+                    logging.exception(
+                        'failed to clean up subscription, id:%s', subscriptionid
+                    )
+
+            if time.monotonic() < housekeeping:
+                continue
+            housekeeping = time.monotonic() + config.SUBSCRIPTION_EXIT_WAIT_TIMEOUT
+
             # NOTE(longsleep): Periodically update some metrics since callbacks
             # do not get triggerd in multiprocess mode. To get the information
             # we trigger it manually.
+            queue = self._queue
+            if queue.dropped != dropped:
+                logging.warning(
+                    'subscription queue is full, dropped %d notifications', queue.dropped - dropped
+                )
             if self.options and self.options.with_metrics:
-                QUEUE_SIZE_GAUGE.set(self._queue.qsize())
-                PROCESSOR_POOL_GAUGE.set(len(REQUEST_HTTPS_ADAPTER.poolmanager.pools.keys()))
-
-            for auth_username, record in RECORDS.items():
-                subscriptions = record.subscriptions
-                now = datetime.datetime.now(tz=datetime.timezone.utc)
-                for subscriptionid, (subscription, sink, _) in list(subscriptions.items()):
-                    expirationDateTime = dateutil.parser.parse(subscription['expirationDateTime'])
-                    if expirationDateTime <= now:
-                        logging.debug('subscription expired, id:%s', subscriptionid)
-                        expired[subscriptionid] = sink
-                        sink.expired = True
-                for subscriptionid, sink in expired.items():
-                    if sink.expired:
-                        try:
-                            try:
-                                del subscriptions[subscriptionid]
-                            except KeyError:
-                                continue
-                            sink.unsubscribe()
-                            logging.debug('subscription cleaned up, id:%s', subscriptionid)
-                            if self.options and self.options.with_metrics:
-                                SUBSCR_EXPIRED.inc()
-                                SUBSCR_ACTIVE.dec(1)
-                        except Exception:
-                            logging.exception(
-                                'failed to clean up subscription, id:%s', subscriptionid
-                            )
-                if len(subscriptions) == 0:
-                    logging.debug(
-                        'cleaning up user without any subscriptions, auth_user:%s', auth_username
-                    )
-                    purge.append((auth_username, record))
+                QUEUE_SIZE_GAUGE.set(queue.qsize())
+                QUEUE_COALESCED.inc(queue.coalesced - coalesced)
+                QUEUE_DROPS.inc(queue.dropped - dropped)
+            coalesced, dropped = queue.coalesced, queue.dropped
+            self._delivery.housekeeping()
+            if REGISTRY is not None:
+                try:
+                    REGISTRY.purge(time.time())
+                except Exception:
+                    logging.exception('failed to purge persisted subscriptions')
 
-            with thread_lock:
-                for (auth_username, record) in purge:
-                    currentRecord = RECORDS[auth_username]
-                    if currentRecord is record:
-                        del RECORDS[auth_username]
-                    # NOTE(longsleep): Clear record references to ensure that
-                    # the associated objects can be destroyed and the notification
-                    # thread is stopped.
-                    record.user = None
-                    record.store = None
-                    record.server = None
+            self._purge_records()
 
-            expired.clear()
-            purge.clear()
+    @staticmethod
+    def _purge_records():
+        """Clean up records of users without any subscriptions."""
+        with thread_lock:
+            purge = [
+                (auth_username, record) for auth_username, record in RECORDS.items()
+                if not record.subscriptions
+            ]
+            for (auth_username, record) in purge:
+                logging.debug(
+                    'cleaning up user without any subscriptions, auth_user:%s', auth_username
+                )
+                del RECORDS[auth_username]
+                lock = USER_LOCKS.get(auth_username)
+                if lock is not None and lock.acquire(blocking=False):
+                    del USER_LOCKS[auth_username]
+                    lock.release()
+                # NOTE(longsleep): Clear record references to ensure that
+                # the associated objects can be destroyed and the notification
+                # thread is stopped.
+                record.user = None
+                record.store = None
+                record.server = None
 
 
 class SubscriptionSink:
-    """Main observer class which needs to be passed to 'subscribe' method of a folder."""
+    """Main observer class which needs to be passed to 'subscribe' method of a folder.
+
+    A sink is shared by all subscriptions of a record on the same folder with
+    the same types, so there is only one subscription on the server. Every
+    notification is fanned out to all subscriptions of the sink and the
+    server subscription ends with the last of them.
+    """
 
     _queue = None
 
-    def __init__(self, store, options, subscription, queue):
+    def __init__(self, store, options, subscription, queue, sinks=None, key=None):
         """Built-in Python method.
 
         Args:
             store (Store): user store object.
             options (Option): deployment options.
+            subscription (Dict): data of the first subscription.
+            queue (NotificationBuffer): notification records.
+            sinks (Union[Dict,None]): shared sinks of the record.
+            key (Union[Tuple,None]): key of the sink in sinks.
         """
         self.store = store
         self.options = options
-        self.subscription = subscription
         self._queue = queue
+        self._sinks = sinks
+        self._key = key
 
-        self.expired = False
+        # NOTE: Replaced on change (while holding thread_lock) rather than
+        # modified, so update can iterate without locking.
+        self.subscriptions = {subscription['id']: subscription}
+
+    @staticmethod
+    def attach(sinks, key, subscription):
+        """Add a subscription to an existing shared sink.
+
+        Args:
+            sinks (Dict): shared sinks of the record.
+            key (Tuple): key of the sink.
+            subscription (Dict): subscription data.
+
+        Returns:
+            Union[SubscriptionSink,None]: the sink, None when there is none.
+        """
+        with thread_lock:
+            sink = sinks.get(key)
+            if sink is None or sink.store is None:
+                return None
+            subscriptions = dict(sink.subscriptions)
+            subscriptions[subscription['id']] = subscription
+            sink.subscriptions = subscriptions
+            return sink
+
+    def register(self):
+        """Make this sink available for further subscriptions."""
+        with thread_lock:
+            if self._sinks is not None:
+                self._sinks[self._key] = self
 
     def update(self, notification):
         """Update method will be executed in each notifying action.
@@ -501,22 +1348,53 @@ class SubscriptionSink:
         Args:
             notification (Notification): notification action.
         """
-        if self.store is not None:
-            while True:
-                try:
-                    self._queue.put(
-                        (self.store, notification, self.subscription),
-                        timeout=config.SUBSCRIPTION_SINK_UPDATE_TIMEOUT
+        if self.store is None:
+            return
+        # NOTE: This runs on the notification thread of the connection
+        # and must not block.
+        changed = time.monotonic()
+        event_id = None
+        # Resource data by selected fields, shared by all subscriptions and
+        # serialized later by the processor.
+        resource_data = {}
+        for subscription in self.subscriptions.values():
+            if subscription.get('_pending'):
+                continue
+            data = None
+            if subscription.get('includeResourceData') and notification.event_type != 'deleted':
+                select = subscription.get('_select')
+                if select not in resource_data:
+                    if event_id is None:
+                        event_id = _event_id(subscription, notification)
+                    resource_data[select] = ResourceData(
+                        self.store, subscription, notification, event_id
                     )
-                    break
-                except Full:
-                    logging.warning('subscription sink queue is full: %d', self._queue.qsize())
-                    time.sleep(1)
+                data = resource_data[select]
+            record = new_record(subscription, notification, event_id, data)
+            event_id = record.id
+            if not self._queue.put(record, changed):
+                logging.debug(
+                    'subscription notification dropped, queue is full, id:%s',
+                    subscription['id']
+                )
 
-    def unsubscribe(self):
-        """Drop out an item from subscriptions list."""
-        self.store.unsubscribe(self)
-        self.store = None
+    def unsubscribe(self, subscription_id):
+        """Drop a subscription, the last one ends the server subscription.
+
+        Args:
+            subscription_id (str): subscription ID.
+        """
+        with thread_lock:
+            subscriptions = dict(self.subscriptions)
+            subscriptions.pop(subscription_id, None)
+            self.subscriptions = subscriptions
+            store = self.store
+            if subscriptions or store is None:
+                return
+            self.store = None
+            if self._sinks is not None and self._sinks.get(self._key) is self:
+                del self._sinks[self._key]
+        store.unsubscribe(self)
 
 
 def _detect_data_type(store, resource_name, folderid=None):
@@ -569,11 +1447,11 @@ def _subscription_object(store, resource, subscription_id):
         utils.HTTPBadRequest: when Subscription object is invalid.
     """
     # Specific mail/contacts folder.
-    route_data = _API._router_search("{}/{}".format(config.PREFIX, resource))
+    route_data = SUBSCRIPTION_RESOURCES.match(resource)
     if route_data:
         try:
             return _detect_data_type(
-                store, route_data[0].name, route_data[-2].get("folderid")
+                store, route_data[0], route_data[1].get("folderid")
             )
         except ValueError:
             logging.error(
@@ -585,6 +1463,34 @@ def _subscription_object(store, resource, subscription_id):
         raise utils.HTTPBadRequest("Subscription resource not found.")
 
 
+def _query_count(args, key, default):
+    """Return a non-negative integer query option.
+
+    Args:
+        args (Dict): parsed query options.
+        key (str): query option name.
+        default (int): value when the option is not given.
+
+    Returns:
+        int: value of the query option.
+
+    Raises:
+        utils.HTTPBadRequest: when the value is not a non-negative integer.
+    """
+    if key not in args:
+        return default
+    value = args[key][0]
+    try:
+        count = int(value)
+    except ValueError:
+        count = -1
+    if count < 0:
+        raise utils.HTTPBadRequest(
+            "Invalid value '%s' for %s query option found. The %s query option requires a non-negative integer value." % (value, key, key)
+        )
+    return count
+
+
 def _export_subscription(subscription):
     """Export subscription.
 
@@ -597,10 +1503,115 @@ def _export_subscription(subscription):
     return {a: b for a, b in subscription.items() if not a.startswith('_')}
 
 
+class SubscriptionRestorer(Thread):
+    """Subscription restorer.
+
+    Opens the subscription registry and restores the persisted subscriptions
+    of this worker after a restart. Every subscriber is sent a "missed"
+    lifecycle notification, since notifications of changes while grapi was
+    not running are lost.
+
+    Subscriptions of users which authenticated with a bearer token can only
+    be restored once the user makes the next request, as tokens are not
+    persisted. All other users are reconnected in the background, at most
+    SUBSCRIPTION_RESTORE_RATE per second, and retried every
+    SUBSCRIPTION_RESTORE_RETRY_INTERVAL seconds while their restore fails.
+    """
+
+    def __init__(self, options):
+        """Built-in Python method.
+
+        Args:
+            options (Namespace): deployment options.
+        """
+        self.options = options
+
+        Thread.__init__(self, name='kopano_subscription_restorer')
+        utils.set_thread_name(self.name)
+        self.daemon = True
+
+    def run(self):
+        """Built-in Thread method."""
+        global REGISTRY
+
+        try:
+            registry = SubscriptionRegistry(
+                os.path.join(utils.PERSISTENCY_PATH, 'subscriptions.db'),
+                getattr(self.options, 'notify_worker', 0),
+                getattr(self.options, 'workers', 1),
+                affinity=config.SUBSCRIPTION_AFFINITY
+            )
+            entries = registry.load(time.time())
+        except Exception:
+            logging.exception('failed to open subscription registry, subscriptions are not persisted')
+            return
+        REGISTRY = registry
+        if entries:
+            logging.info('restoring %d persisted subscriptions', len(entries))
+
+        users = collections.OrderedDict()
+        for entry in entries:
+            _notify_missed(entry.subscription)
+            users.setdefault((entry.auth_userid, entry.oidc), []).append(entry.subscription)
+
+        eager = []
+        for (auth_userid, oidc), subscriptions in users.items():
+            with thread_lock:
+                record = RECORDS.get(auth_userid)
+                if record is None:
+                    PENDING_RESTORE.setdefault(auth_userid, []).extend(subscriptions)
+            if record is not None:
+                _restore_subscriptions(record, subscriptions, self.options)
+            elif not oidc:
+                eager.append(auth_userid)
+
+        while eager:
+            eager = self.restore(eager)
+            if eager:
+                time.sleep(config.SUBSCRIPTION_RESTORE_RETRY_INTERVAL)
+
+    def restore(self, users):
+        """Restore the pending subscriptions of users.
+
+        Args:
+            users (List[str]): user IDs.
+
+        Returns:
+            List[str]: user IDs whose subscriptions are still pending.
+        """
+        interval = 1.0 / config.SUBSCRIPTION_RESTORE_RATE if config.SUBSCRIPTION_RESTORE_RATE > 0 else 0
+        for auth_userid in users:
+            with thread_lock:
+                if auth_userid not in PENDING_RESTORE:
+                    continue  # Restored by a request in the meantime.
+            try:
+                record = _user_record(auth_userid, '', False, self.options)
+                with thread_lock:
+                    pending = PENDING_RESTORE.pop(auth_userid, None)
+                if pending:
+                    # The record was created by a request in the meantime.
+                    _restore_subscriptions(record, pending, self.options)
+            except kopano.errors.NotFoundError:
+                logging.warning('user of persisted subscriptions not found, auth_user:%s', auth_userid)
+                with thread_lock:
+                    pending = PENDING_RESTORE.pop(auth_userid, None)
+                for subscription in pending or ():
+                    _unpersist(subscription['id'])
+            except Exception:
+                logging.exception('failed to restore subscriptions of user, auth_user:%s', auth_userid)
+            time.sleep(interval)
+
+        with thread_lock:
+            return [auth_userid for auth_userid in users if auth_userid in PENDING_RESTORE]
+
+
 class SubscriptionResource(Resource):
     """Subscription resource."""
 
     _queue = None
+    _delivery = None
+    _validator = None
+    _validations = None
 
     # Input schema validators.
     on_post_subscriptions_schema = subscription_schema.create_schema_validator
@@ -614,9 +1625,19 @@ class SubscriptionResource(Resource):
         """
         super().__init__(options)
         if self.__class__._queue is None:
-            self.__class__._queue = Queue(config.SUBSCRIPTION_QUEUE_MAXSIZE)
-            SubscriptionProcessor(self.options, self.__class__._queue).start()
-            SubscriptionPurger(self.options, self.__class__._queue).start()
+            self.__class__._queue = NotificationBuffer(config.SUBSCRIPTION_QUEUE_MAXSIZE)
+            self.__class__._delivery = WebhookDelivery(self.options, exists=_subscription_exists)
+            self.__class__._validator = ThreadPoolExecutor(
+                max_workers=config.SUBSCRIPTION_VALIDATION_MAX_WORKERS,
+                thread_name_prefix='kopano_subscription_validation'
+            )
+            self.__class__._validations = BoundedSemaphore(
+                config.SUBSCRIPTION_VALIDATION_QUEUE_MAXSIZE
+            )
+            SubscriptionProcessor(self.options, self._queue, self._delivery).start()
+            SubscriptionPurger(self.options, self._queue, self._delivery).start()
+            if config.SUBSCRIPTION_REGISTRY and utils.PERSISTENCY_PATH:
+                SubscriptionRestorer(self.options).start()
 
     @staticmethod
     def _clean_notification_url(notification_url, verify, subscription_id, auth_user):
@@ -700,14 +1721,82 @@ class SubscriptionResource(Resource):
             )
             raise utils.HTTPBadRequest("Subscription webhook validation failed.")
 
-    def _add_subscription(self, req, subscription_id, options, verify, json_data):
+    def _start_validation(self, notification_url, verify, subscription_id, auth_user):
+        """Start the webhook validation on the validation pool.
+
+        Args:
+            notification_url (ParseResult): parsed notification URL.
+            verify (bool): is secure or not.
+            subscription_id (str): generated ID for the subscription.
+            auth_user (str): authenticated username.
+
+        Returns:
+            Future: validation, raises utils.HTTPBadRequest when it failed.
+
+        Raises:
+            utils.HTTPBadRequest: when the circuit of the webhook host is open.
+            falcon.HTTPServiceUnavailable: when too many validations are pending.
+        """
+        if self._delivery.circuit(host_key(notification_url.geturl())) == OPEN:
+            logging.debug(
+                "subscription validation skipped, webhook circuit is open, id:%s, url:%s",
+                subscription_id, notification_url
+            )
+            raise utils.HTTPBadRequest("Subscription webhook validation failed.")
+
+        if not self._validations.acquire(blocking=False):
+            logging.warning(
+                "too many pending subscription validations, auth_user:%s, id:%s",
+                auth_user, subscription_id
+            )
+            raise falcon.HTTPServiceUnavailable(
+                description="too many pending subscription validations, please retry",
+                retry_after=config.SUBSCRIPTION_VALIDATION_TIMEOUT
+            )
+        try:
+            validation = self._validator.submit(
+                self._validate_webhook, notification_url, verify, subscription_id, auth_user
+            )
+        except Exception:
+            self._validations.release()
+            raise
+        validation.add_done_callback(lambda _: self._validations.release())
+        return validation
+
+    def _validation_done(self, record, subscription_id, json_data, validation):
+        """Activate or remove a subscription after its asynchronous validation.
+
+        Args:
+            record (Record): record of the subscription.
+            subscription_id (str): subscription ID.
+            json_data (Dict): subscription data.
+            validation (Future): finished validation.
+        """
+        if validation.exception() is None:
+            json_data.pop('_pending', None)
+            logging.debug('subscription validated, id:%s', subscription_id)
+            if subscription_id in record.subscriptions:
+                _persist(record, json_data, _expiration_timestamp(json_data['expirationDateTime']))
+            return
+
+        entry = record.subscriptions.pop(subscription_id, None)
+        if entry is None:
+            return
+        EXPIRY.discard(subscription_id)
+        INDEX.discard(subscription_id)
+        entry[1].unsubscribe(subscription_id)
+        _unpersist(subscription_id)
+        logging.info('subscription removed after failed validation, id:%s', subscription_id)
+        if self.options and self.options.with_metrics:
+            SUBSCR_ACTIVE.dec(1)
+
+    def _add_subscription(self, req, subscription_id, options, json_data):
         """Add a new subscription.
 
         Args:
             req (Request): Falcon request object.
             subscription_id (str): generated subscription ID.
             options (Option): deployment option.
-            verify (bool): secure mode is enabled or not.
             json_data (Dict): parsed request data in JSON format.
 
         Returns:
@@ -715,41 +1804,16 @@ class SubscriptionResource(Resource):
         """
         record = _record(req, options)
 
-        notification_url = self._clean_notification_url(
-            json_data['notificationUrl'], verify, subscription_id, record.server.auth_user
-        )
-
-        # Validate webhook.
-        self._validate_webhook(
-            notification_url, verify, subscription_id, record.server.auth_user
-        )
-
         # Validate subscription data.
-        folder, folder_types, data_type, object_types = _subscription_object(
-            record.store, json_data['resource'], subscription_id
-        )
+        try:
+            expiration = _expiration_timestamp(json_data['expirationDateTime'])
+        except ValueError:
+            raise utils.HTTPBadRequest('expirationDateTime is not a valid datetime string')
 
         # Create subscription.
         json_data['id'] = subscription_id
-        json_data['_datatype'] = data_type
-
-        sink = SubscriptionSink(record.store, self.options, json_data, self._queue)
-        event_types = json_data['changeType'].split(',')
-
-        folder.subscribe(
-            sink,
-            object_types=object_types,
-            event_types=event_types,
-            folder_types=folder_types
-        )
-
-        record.subscriptions[subscription_id] = (json_data, sink, record.user.userid)
-        logging.debug(
-            "subscription created, auth_user:%s, id:%s, target:%s,"
-            " object_types:%s, event_types:%s, folder_types:%s",
-            record.server.auth_user, subscription_id, folder,
-            object_types, event_types, folder_types
-        )
+        sink = _subscribe(record, json_data, options, self._queue, expiration)
+        _persist(record, json_data, expiration)
 
         return record, sink
 
@@ -764,13 +1828,34 @@ class SubscriptionResource(Resource):
         verify = not self.options or not self.options.insecure
         json_data = req.context.json_data
 
+        # Resource data is sent unencrypted, refuse it to subscribers which
+        # expect it to be encrypted.
+        if json_data.get('includeResourceData') and json_data.get('encryptionCertificate'):
+            raise utils.HTTPBadRequest('Encrypted resource data is not supported.')
+
+        auth_user = _record(req, self.options).server.auth_user
+        notification_url = self._clean_notification_url(
+            json_data['notificationUrl'], verify, subscription_id, auth_user
+        )
+
+        # Validate webhook once, on the bounded validation pool. Unless
+        # asynchronous validation is enabled, the subscription is only added
+        # after a successful validation.
+        validation = self._start_validation(
+            notification_url, verify, subscription_id, auth_user
+        )
+        if config.SUBSCRIPTION_VALIDATION_ASYNC:
+            json_data['_pending'] = True
+        else:
+            validation.result()
+
         max_retry = config.SUBSCRIPTION_INTERNAL_RETRY
         retry = 0
         while retry != max_retry:
             retry += 1
             try:
-                self._add_subscription(
-                    req, subscription_id, self.options, verify, json_data
+                record, _ = self._add_subscription(
+                    req, subscription_id, self.options, json_data
                 )
                 break
             except MAPIErrorNoSupport:
@@ -785,6 +1870,11 @@ class SubscriptionResource(Resource):
                 description="subscription is not possible, please retry"
             )
 
+        if config.SUBSCRIPTION_VALIDATION_ASYNC:
+            validation.add_done_callback(functools.partial(
+                self._validation_done, record, subscription_id, json_data
+            ))
+
         # Prepare response.
         resp.status = falcon.HTTP_201
         resp.content_type = "application/json"
@@ -801,20 +1891,37 @@ class SubscriptionResource(Resource):
             req (Request): Falcon request object.
             resp (Response): Falcon response object.
         """
+        args = self.parse_qs(req)
+        top = _query_count(args, '$top', config.SUBSCRIPTION_LIST_PAGE_SIZE)
+        skip = _query_count(args, '$skip', 0)
         record = _record(req, self.options)
-        userid = record.user.userid
+
+        subscriptions, more = INDEX.page(record.user.userid, skip, top)
         data = {
             '@odata.context': req.path,
-            'value': [
-                _export_subscription(subscription)
-                for subscription, _, uid in record.subscriptions.values()
-                if uid == userid
-            ],  # TODO doesn't scale
         }
+        if more and top:
+            args['$skip'] = skip + top
+            data['@odata.nextLink'] = req.path + '?' + _encode_qs(list(args.items()))
+        data['value'] = [_export_subscription(subscription) for subscription in subscriptions]
 
         resp.body = _dumpb_json(data)
         resp.status = falcon.HTTP_200
 
+    def _subscription_record(self, req, subscription_id):
+        """Return the record holding a subscription of the requesting user.
+
+        Args:
+            req (Request): Falcon request object.
+            subscription_id (str): subscription ID.
+
+        Returns:
+            Union[Record,None]: record holding the subscription, None if
+                the user has no such subscription.
+        """
+        record = _record(req, self.options)
+        return INDEX.get(subscription_id, record.user.userid)
+
     def on_get_subscriptions_by_id(self, req, resp, subscriptionid):
         """Handle GET request - return by subscription ID.
 
@@ -823,10 +1930,10 @@ class SubscriptionResource(Resource):
             resp (Response): Falcon response object.
             subscriptionid (str): subscription ID.
         """
-        record = _record(req, self.options)
+        record = self._subscription_record(req, subscriptionid)
         try:
             subscription = record.subscriptions[subscriptionid][0]
-        except KeyError:
+        except (AttributeError, KeyError):
             raise utils.HTTPNotFound()
         data = _export_subscription(subscription)
         resp.body = _dumpb_json(data)
@@ -840,11 +1947,11 @@ class SubscriptionResource(Resource):
             resp (Response): Falcon response object.
             subscriptionid (str): subscription ID.
         """
-        record = _record(req, self.options)
+        record = self._subscription_record(req, subscriptionid)
 
         try:
-            subscription, sink, _ = record.subscriptions[subscriptionid]
-        except KeyError:
+            subscription = record.subscriptions[subscriptionid][0]
+        except (AttributeError, KeyError):
             resp.status = falcon.HTTP_404
             return
 
@@ -854,14 +1961,12 @@ class SubscriptionResource(Resource):
             if v and k == 'expirationDateTime':
                 # NOTE(longsleep): Setting a dict key which is already there is threadsafe in current CPython implementations.
                 try:
-                    dateutil.parser.parse(v)
-                    subscription['expirationDateTime'] = v
+                    expiration = _expiration_timestamp(v)
                 except ValueError:
                     raise utils.HTTPBadRequest('expirationDateTime is not a valid datetime string')
-
-        if sink.expired:
-            sink.expired = False
-            logging.debug('subscription updated before it expired, id:%s', subscriptionid)
+                subscription['expirationDateTime'] = v
+                EXPIRY.set(subscriptionid, record, expiration)
+                _persist(record, subscription, expiration)
 
         data = _export_subscription(subscription)
         resp.body = _dumpb_json(data)
@@ -875,16 +1980,18 @@ class SubscriptionResource(Resource):
             resp (Response): Falcon response object.
             subscriptionid (str): subscription ID.
         """
-        record = _record(req, self.options)
-        store = record.store
+        record = self._subscription_record(req, subscriptionid)
 
         try:
             sink = record.subscriptions.pop(subscriptionid)[1]
-        except KeyError:
+        except (AttributeError, KeyError):
             resp.status = falcon.HTTP_404
             return
+        EXPIRY.discard(subscriptionid)
+        INDEX.discard(subscriptionid)
 
-        store.unsubscribe(sink)
+        sink.unsubscribe(subscriptionid)
+        _unpersist(subscriptionid)
 
         logging.debug('subscription deleted, id:%s', subscriptionid)
 
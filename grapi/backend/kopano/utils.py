@@ -12,8 +12,11 @@ from threading import Event, Lock, Thread
 import bsddb3 as bsddb
 import falcon
 import kopano
+from MAPI import RELOP_EQ
 from MAPI.Struct import (MAPIErrorInvalidParameter, MAPIErrorNoAccess,
-                         MAPIErrorNotFound, MAPIErrorUnconfigured)
+                         MAPIErrorNotFound, MAPIErrorUnconfigured,
+                         SOrRestriction, SPropertyRestriction, SPropValue)
+from MAPI.Tags import PR_ENTRYID
 
 from grapi.api.v1.decorators import experimental as experimentalDecorator
 from grapi.api.v1.resource import HTTPBadRequest
@@ -134,11 +137,17 @@ def _server(req, options, forceReconnect=False):
 
     now = time.monotonic()
 
+    # Threads which execute $batch sub-requests concurrently must not share
+    # a session, every one of them has its own cached session slot.
+    session_slot = req.context.get('session_slot')
+
     if auth['method'] == 'bearer':
         token = auth['token']
         userid = req.context.userid = auth['userid']
         cacheid = token  # NOTE(longsleep): We cache per user even if that means that from time to time, the connection
         # breaks because the token has expired.
+        if session_slot:
+            cacheid = (token, session_slot)
         with threadLock:
             sessiondata = TOKEN_SESSION.get(cacheid)
         if sessiondata:
@@ -196,6 +205,8 @@ def _server(req, options, forceReconnect=False):
     elif auth['method'] == 'passthrough':
         userid = req.context.userid = auth['userid']
         cacheid = userid  # NOTE(longsleep): We cache per user id.
+        if session_slot:
+            cacheid = (userid, session_slot)
         with threadLock:
             sessiondata = PASSTHROUGH_SESSION.get(cacheid)
         if sessiondata:
@@ -362,6 +373,32 @@ def _item(parent, entryid):
         raise HTTPBadRequest('Id is malformed')
 
 
+def _items_by_entryid(folder, entryids):
+    """Return the items of a folder with the given entryids.
+
+    The items are looked up with a single contents table query restricted to
+    the entryids, instead of opening every item on its own.
+
+    Args:
+        folder (Folder): folder of the items.
+        entryids (List[str]): hex encoded entryids, invalid ones are ignored.
+
+    Returns:
+        Dict[str,Item]: found items by upper case entryid.
+    """
+    restrictions = []
+    for entryid in entryids:
+        try:
+            value = codecs.decode(entryid, 'hex')
+        except ValueError:
+            continue
+        restrictions.append(SPropertyRestriction(RELOP_EQ, PR_ENTRYID, SPropValue(PR_ENTRYID, value)))
+    if not restrictions:
+        return {}
+    restriction = kopano.Restriction(SOrRestriction(restrictions))
+    return {item.entryid.upper(): item for item in folder.items(restriction=restriction)}
+
+
 def _get_group_by_id(server, groupid, default=_marker):
     for group in server.groups():  # TODO server.group(groupid/entryid=..)
         if group.groupid == groupid:
@@ -0,0 +1,915 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+"""Webhook delivery for subscription notifications."""
+import collections
+import heapq
+import http.cookiejar
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock, Thread
+from urllib.parse import urlparse
+
+import requests
+
+from grapi.api.v1 import config
+
+from . import utils
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram
+    PROMETHEUS = True
+except ImportError:  # pragma: no cover
+    PROMETHEUS = False
+
+if PROMETHEUS:
+    POST_COUNT = Counter('kopano_mfr_kopano_total_webhook_posts', 'Total number of webhook posts')
+    POST_ERRORS = Counter('kopano_mfr_kopano_total_webhook_post_errors', 'Total number of webhook post errors')
+    POST_RETRIES = Counter('kopano_mfr_kopano_total_webhook_retries', 'Total number of webhook post retries')
+    POST_DROPS = Counter('kopano_mfr_kopano_total_webhook_drops', 'Total number of webhook notifications dropped')
+    POST_HIST = Histogram('kopano_mfr_kopano_webhook_post_duration_seconds', 'Duration of webhook post requests in seconds')
+    PROCESSOR_POOL_GAUGE = Gauge('kopano_mfr_kopano_webhook_pools', 'Current number of webhook pools')
+    SPOOL_COUNT = Counter('kopano_mfr_kopano_total_webhook_spooled', 'Total number of webhook notifications written to the spool')
+    SPOOL_DEPTH_GAUGE = Gauge('kopano_mfr_kopano_webhook_spool_depth', 'Current number of spooled webhook notifications', multiprocess_mode='liveall')
+    BREAKER_GAUGE = Gauge('kopano_mfr_kopano_webhook_circuits', 'Current number of webhook hosts per circuit breaker state', ['state'], multiprocess_mode='liveall')
+    BREAKER_TRIPS = Counter('kopano_mfr_kopano_total_webhook_circuit_trips', 'Total number of webhook circuit breaker trips')
+    BREAKER_SHORT_CIRCUITS = Counter('kopano_mfr_kopano_total_webhook_short_circuits', 'Total number of webhook notifications spooled because of an open circuit')
+    # Latencies include debouncing and retries, so buckets go up to minutes.
+    LATENCY_BUCKETS = (.05, .1, .25, .5, 1, 1.5, 2, 3, 5, 10, 30, 60, 120, 300, 600)
+    DELIVERY_HIST = Histogram('kopano_mfr_kopano_webhook_delivery_seconds', 'Time from submitting a webhook notification until it was delivered in seconds', ['host'], buckets=LATENCY_BUCKETS)
+    LATENCY_HIST = Histogram('kopano_mfr_kopano_notification_latency_seconds', 'Time from a change on the server until its notification was delivered in seconds', ['host'], buckets=LATENCY_BUCKETS)
+
+# Response status codes which are worth another attempt, all others below 500
+# are permanent failures.
+RETRY_STATUS_CODES = frozenset((408, 429))
+
+# Circuit breaker states.
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Outcomes of a webhook post.
+DELIVERED = 'delivered'
+REJECTED = 'rejected'
+RETRY = 'retry'
+
+SPOOL_FILE_PATTERN = re.compile(r'^spool-(\d+)-\d+\.(jsonl|replay-(\d+))$')
+
+
+def host_key(url):
+    """Return the key which groups notification urls by host.
+
+    Args:
+        url (str): notification url.
+
+    Returns:
+        str: scheme and network location of the url.
+    """
+    parsed = urlparse(url)
+    return '{}://{}'.format(parsed.scheme, parsed.netloc.lower())
+
+
+def _new_session():
+    """Return a new request session for a single host.
+
+    Returns:
+        requests.Session: session with a connection pool sized for the host
+            concurrency.
+    """
+    session = requests.Session()
+    session.cookies = requests.cookies.RequestsCookieJar(
+        http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+    )
+    session.max_redirects = config.SUBSCRIPTION_REQUEST_MAX_REDIRECT
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=config.SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _pid_alive(pid):
+    """Return whether a process exists.
+
+    Args:
+        pid (int): process ID.
+
+    Returns:
+        bool: True when the process exists.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def backoff_delay(attempt):
+    """Return the jittered delay before the next attempt.
+
+    Args:
+        attempt (int): number of failed attempts so far.
+
+    Returns:
+        float: delay in seconds, between half and all of the exponential delay.
+    """
+    delay = min(
+        config.SUBSCRIPTION_NOTIFY_RETRY_MAX_DELAY,
+        config.SUBSCRIPTION_NOTIFY_RETRY_DELAY * 2 ** (attempt - 1)
+    )
+    return random.uniform(delay / 2, delay)
+
+
+class MetricLabels:
+    """Bounded set of metric label values.
+
+    The first maxsize values are used as they are, all further ones share a
+    single label, so the cardinality of a metric stays bounded.
+    """
+
+    def __init__(self, maxsize, other='other'):
+        """Built-in Python method.
+
+        Args:
+            maxsize (int): maximum number of distinct values.
+            other (str): label of all further values.
+        """
+        self.maxsize = maxsize
+        self.other = other
+        self._values = set()
+        self._lock = Lock()
+
+    def get(self, value):
+        """Return the label of a value.
+
+        Args:
+            value (str): label value.
+
+        Returns:
+            str: the value, or the shared label when there are too many.
+        """
+        if value in self._values:
+            return value
+        with self._lock:
+            if len(self._values) < self.maxsize:
+                self._values.add(value)
+                return value
+        return self.other
+
+
+class Notification:
+    """A notification which is to be posted to a notification url."""
+
+    __slots__ = ('url', 'data', 'subscription_ids', 'created', 'changed', 'attempt')
+
+    def __init__(self, url, data, subscription_ids, attempt=0, changed=None, created=None):
+        """Built-in Python method.
+
+        Args:
+            url (str): notification url.
+            data (Dict): notification data.
+            subscription_ids (Tuple[str]): IDs of the subscriptions whose
+                notifications are in data.
+            attempt (int): number of failed attempts so far.
+            changed (Union[float,None]): monotonic time of the change, when
+                known.
+            created (Union[float,None]): monotonic time of the first
+                submission, defaults to now.
+        """
+        self.url = url
+        self.data = data
+        self.subscription_ids = subscription_ids
+        self.created = time.monotonic() if created is None else created
+        self.changed = self.created if changed is None else changed
+        self.attempt = attempt
+
+    @property
+    def subscription_id(self):
+        """str: subscription IDs for logging."""
+        return ','.join(self.subscription_ids)
+
+    def retain(self, exists):
+        """Remove the notifications of subscriptions which no longer exist.
+
+        Args:
+            exists (Callable[[str],bool]): returns whether a subscription ID
+                still exists.
+        """
+        subscription_ids = tuple(s for s in self.subscription_ids if exists(s))
+        if subscription_ids == self.subscription_ids:
+            return
+        self.subscription_ids = subscription_ids
+        if 'value' in self.data:
+            self.data = dict(self.data, value=[
+                value for value in self.data['value'] if value.get('subscriptionId') in subscription_ids
+            ])
+
+
+class WebhookSpool:
+    """Append-only dead-letter spool for notifications.
+
+    Every worker process appends to its own file in the spool directory.
+    Replaying claims a file by renaming it first, so a file is replayed only
+    once, either by the worker which wrote it or, when that worker is gone,
+    by any other one.
+
+    Entries keep the number of attempts and the (wall clock) times of the
+    first submission and of the change, so replayed notifications keep
+    their age.
+    """
+
+    def __init__(self, path, maxsize):
+        """Built-in Python method.
+
+        Args:
+            path (str): spool directory.
+            maxsize (int): maximum number of spooled notifications.
+        """
+        self.path = path
+        self.maxsize = maxsize
+        # Number of notifications in the files of this process.
+        self.depth = 0
+
+        self._lock = Lock()
+        self._file = None
+
+    def append(self, notification):
+        """Append a notification to the spool.
+
+        Args:
+            notification (Notification): notification.
+
+        Returns:
+            bool: False when the spool is full.
+        """
+        now = time.time()
+        monotonic = time.monotonic()
+        line = json.dumps({
+            'url': notification.url,
+            'subscriptionIds': notification.subscription_ids,
+            'attempt': notification.attempt,
+            'created': now - (monotonic - notification.created),
+            'changed': now - (monotonic - notification.changed),
+            'spooled': now,
+            'data': notification.data,
+        }, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._lock:
+            if self.depth >= self.maxsize:
+                return False
+            if self._file is None:
+                os.makedirs(self.path, exist_ok=True)
+                name = 'spool-{}-{}.jsonl'.format(os.getpid(), time.time_ns())
+                self._file = open(os.path.join(self.path, name), 'ab')
+            self._file.write(line)
+            self._file.flush()
+            self.depth += 1
+        return True
+
+    def _claim(self):
+        """Claim the spool files which can be replayed by this process.
+
+        Returns:
+            List[str]: paths of the claimed files.
+        """
+        pid = os.getpid()
+        with self._lock:
+            # Start a new file, the current one gets replayed.
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.depth = 0
+
+        try:
+            names = sorted(os.listdir(self.path))
+        except FileNotFoundError:
+            return []
+
+        claimed = []
+        for name in names:
+            match = SPOOL_FILE_PATTERN.match(name)
+            if not match:
+                continue
+            if match.group(3):
+                # Being replayed, take it over only when the replaying
+                # process is gone.
+                owner = int(match.group(3))
+                if owner == pid or _pid_alive(owner):
+                    continue
+            else:
+                owner = int(match.group(1))
+                if owner != pid and _pid_alive(owner):
+                    continue
+            path = os.path.join(self.path, name)
+            claim = os.path.join(
+                self.path, 'spool-{}-{}.replay-{}'.format(match.group(1), time.time_ns(), pid)
+            )
+            try:
+                os.rename(path, claim)
+            except FileNotFoundError:
+                # Claimed by another process.
+                continue
+            claimed.append(claim)
+        return claimed
+
+    def replay(self):
+        """Take all replayable notifications out of the spool.
+
+        Yields:
+            Notification: spooled notification.
+        """
+        for path in self._claim():
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                        # Wall clock times become monotonic ones again.
+                        offset = time.monotonic() - time.time()
+                        created = entry.get('created', entry.get('spooled'))
+                        changed = entry.get('changed', created)
+                        notification = Notification(
+                            entry['url'], entry['data'], tuple(entry['subscriptionIds']),
+                            attempt=entry.get('attempt', 0),
+                            changed=None if changed is None else changed + offset,
+                            created=None if created is None else created + offset
+                        )
+                    except (ValueError, KeyError, TypeError):
+                        # Partial line of a crashed worker.
+                        logging.warning('ignored invalid webhook spool entry, file:%s', path)
+                        continue
+                    yield notification
+            os.unlink(path)
+
+
+class CircuitBreaker:
+    """Circuit breaker of a notification url host.
+
+    The circuit is closed while posts succeed. It opens after a number of
+    consecutive failures and becomes half-open after the cool-down, which
+    lets a single probe through. The outcome of the probe either closes the
+    circuit again or opens it for another cool-down.
+
+    The breaker is not thread safe, callers must synchronize.
+    """
+
+    __slots__ = ('threshold', 'cooldown', 'state', 'failures', 'opened')
+
+    def __init__(self, threshold, cooldown):
+        """Built-in Python method.
+
+        Args:
+            threshold (int): consecutive failures which open the circuit,
+                0 never opens it.
+            cooldown (float): seconds until an open circuit is probed.
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+
+    def current(self, now):
+        """Return the current state.
+
+        Args:
+            now (float): monotonic time.
+
+        Returns:
+            str: state, an open circuit turns half-open after the cool-down.
+        """
+        if self.state == OPEN and now - self.opened >= self.cooldown:
+            self.state = HALF_OPEN
+        return self.state
+
+    def success(self):
+        """Record a successful post.
+
+        Returns:
+            bool: True when this closed the circuit.
+        """
+        self.failures = 0
+        if self.state == CLOSED:
+            return False
+        self.state = CLOSED
+        return True
+
+    def failure(self, now):
+        """Record a failed post.
+
+        Args:
+            now (float): monotonic time.
+
+        Returns:
+            bool: True when this opened the circuit.
+        """
+        self.failures += 1
+        if self.state == OPEN:
+            return False
+        if self.state == HALF_OPEN or (self.threshold and self.failures >= self.threshold):
+            self.state = OPEN
+            self.opened = now
+            return True
+        return False
+
+
+class _Host:
+    """Delivery state of a single notification url host."""
+
+    __slots__ = ('name', 'session', 'breaker', 'active', 'pending', 'last_used')
+
+    def __init__(self, name):
+        self.name = name
+        self.session = _new_session()
+        self.breaker = CircuitBreaker(
+            config.SUBSCRIPTION_NOTIFY_BREAKER_THRESHOLD,
+            config.SUBSCRIPTION_NOTIFY_BREAKER_COOLDOWN
+        )
+        # Number of posts which are submitted to the executor.
+        self.active = 0
+        # Notifications waiting for a free slot of this host.
+        self.pending = collections.deque()
+        self.last_used = time.monotonic()
+
+
+class WebhookDelivery:
+    """Concurrent webhook delivery.
+
+    Notifications are posted by a shared pool of worker threads. Every host
+    has its own connection pool and at most SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY
+    posts in flight, so a slow or unreachable host only delays its own
+    notifications and never occupies all workers.
+
+    Failed posts are retried with backoff by a retry thread. Notifications
+    which run out of attempts go to the spool, which is replayed on startup
+    and periodically by housekeeping. When the circuit of a host closes
+    again, the notifications of that host are replayed. While the circuit
+    of a host is open, its notifications are spooled without trying to post
+    them.
+    """
+
+    def __init__(self, options, spool=None, exists=None):
+        """Built-in Python method.
+
+        Args:
+            options (Namespace): deployment options.
+            spool (Union[WebhookSpool,None]): dead-letter spool. Defaults to
+                a spool in the persistency path when enabled.
+            exists (Union[Callable[[str],bool],None]): returns whether a
+                subscription ID still exists, spooled notifications of other
+                subscriptions are not replayed. Defaults to None, which
+                replays all.
+        """
+        self.verify = not options or not options.insecure
+        self.with_metrics = bool(options and options.with_metrics)
+        self.timeout = (
+            config.SUBSCRIPTION_NOTIFY_CONNECT_TIMEOUT,
+            config.SUBSCRIPTION_NOTIFY_TIMEOUT
+        )
+
+        self._hosts = {}
+        self._host_labels = MetricLabels(config.SUBSCRIPTION_METRICS_MAX_HOSTS)
+        self._lock = Lock()
+        # Notified whenever a pending notification leaves a host queue.
+        self._room = Condition(self._lock)
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.SUBSCRIPTION_NOTIFY_MAX_WORKERS,
+            thread_name_prefix='kopano_webhook'
+        )
+
+        # Number of notifications which were dropped.
+        self.dropped = 0
+        self._drops_lock = Lock()
+
+        self._retries = []
+        self._retry_seq = itertools.count()
+        self._retry_cond = Condition()
+        self._retry_thread = None
+
+        if spool is None and config.SUBSCRIPTION_NOTIFY_SPOOL_MAXSIZE > 0:
+            spool = WebhookSpool(
+                os.path.join(utils.PERSISTENCY_PATH, 'webhook-spool'),
+                config.SUBSCRIPTION_NOTIFY_SPOOL_MAXSIZE
+            )
+        self.spool = spool
+        self.exists = exists
+        self._replayed = time.monotonic()
+        self._replay_lock = Lock()
+        if self.spool is not None:
+            self._executor.submit(self.replay_spool)
+
+    def submit(self, url, data, subscription_ids, changed=None):
+        """Queue a notification for delivery.
+
+        This never blocks on the network.
+
+        Args:
+            url (str): notification url.
+            data (Dict): notification data.
+            subscription_ids (Tuple[str]): IDs of the subscriptions whose
+                notifications are in data.
+            changed (Union[float,None]): monotonic time of the change, for
+                latency metrics.
+        """
+        self._enqueue(Notification(url, data, subscription_ids, changed=changed))
+
+    def _enqueue(self, notification):
+        name = host_key(notification.url)
+        overflow = None
+        with self._lock:
+            host = self._hosts.get(name)
+            if host is None:
+                host = self._hosts[name] = _Host(name)
+            host.last_used = now = time.monotonic()
+            state = host.breaker.current(now)
+            if state == OPEN:
+                host = None
+            else:
+                # While half-open, only the probe is posted and others wait
+                # for its outcome.
+                limit = 1 if state == HALF_OPEN else config.SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY
+                if host.active >= limit:
+                    if len(host.pending) >= config.SUBSCRIPTION_NOTIFY_HOST_QUEUE_MAXSIZE:
+                        overflow = host.pending.popleft()
+                    host.pending.append(notification)
+                    notification = None
+                else:
+                    host.active += 1
+        if overflow is not None:
+            # The oldest pending notification makes room, it is delivered
+            # when the spool is replayed.
+            self._spool(overflow)
+        if notification is None:
+            return
+        if host is None:
+            self._spool(notification, short_circuit=True)
+            return
+        self._executor.submit(self._run, host, notification)
+
+    def _run(self, host, notification):
+        """Post a notification and hand the slot to the next pending one.
+
+        The next notification of the host is submitted to the executor again
+        rather than posted in place, so hosts take turns on the workers.
+
+        Args:
+            host (_Host): host of the url.
+            notification (Notification): notification.
+        """
+        short_circuited = []
+        try:
+            outcome = self._post(host, notification)
+            with self._lock:
+                # A rejected post says nothing about the health of the host.
+                closed = opened = False
+                if outcome == DELIVERED:
+                    closed = host.breaker.success()
+                elif outcome == RETRY:
+                    opened = host.breaker.failure(time.monotonic())
+                state = host.breaker.state
+
+            if outcome == DELIVERED and self.with_metrics:
+                now = time.monotonic()
+                label = self._host_labels.get(host.name)
+                DELIVERY_HIST.labels(label).observe(now - notification.created)
+                LATENCY_HIST.labels(label).observe(now - notification.changed)
+
+            if opened:
+                logging.warning(
+                    'webhook circuit opened, host:%s, failures:%d', host.name, host.breaker.failures
+                )
+                if self.with_metrics:
+                    BREAKER_TRIPS.inc()
+            elif closed:
+                logging.info('webhook circuit closed, host:%s', host.name)
+                if self.spool is not None:
+                    self._executor.submit(self.replay_spool, host.name)
+
+            if outcome == RETRY:
+                if state == OPEN:
+                    self._spool(notification, short_circuit=True)
+                else:
+                    self._retry(notification)
+        finally:
+            with self._lock:
+                host.last_used = now = time.monotonic()
+                state = host.breaker.current(now)
+                if state == OPEN:
+                    short_circuited.extend(host.pending)
+                    host.pending.clear()
+                    self._room.notify_all()
+                if host.pending and (state == CLOSED or host.active == 1):
+                    notification = host.pending.popleft()
+                    self._room.notify_all()
+                else:
+                    host.active -= 1
+                    notification = None
+            for pending in short_circuited:
+                self._spool(pending, short_circuit=True)
+            if notification is not None:
+                self._executor.submit(self._run, host, notification)
+
+    def _post(self, host, notification):
+        """Post a notification.
+
+        Args:
+            host (_Host): host of the url.
+            notification (Notification): notification.
+
+        Returns:
+            str: DELIVERED, REJECTED when the notification url refused the
+                notification, or RETRY when the post failed and should be
+                retried.
+        """
+        url = notification.url
+        try:
+            if self.with_metrics:
+                POST_COUNT.inc()
+            logging.debug(
+                'subscription notification, id:%s, url:%s, attempt:%d',
+                notification.subscription_id, url, notification.attempt + 1
+            )
+            if self.with_metrics:
+                with POST_HIST.time():
+                    response = host.session.post(
+                        url, json=notification.data, timeout=self.timeout, verify=self.verify
+                    )
+            else:
+                response = host.session.post(
+                    url, json=notification.data, timeout=self.timeout, verify=self.verify
+                )
+        except Exception:
+            if self.with_metrics:
+                POST_ERRORS.inc()
+            logging.warning(
+                'subscription notification failed, id:%s, url:%s',
+                notification.subscription_id, url, exc_info=True
+            )
+            return RETRY
+
+        status_code = response.status_code
+        if status_code < 300:
+            return DELIVERED
+        if self.with_metrics:
+            POST_ERRORS.inc()
+        if status_code >= 500 or status_code in RETRY_STATUS_CODES:
+            logging.warning(
+                'subscription notification failed, id:%s, url:%s, status:%d',
+                notification.subscription_id, url, status_code
+            )
+            return RETRY
+        logging.warning(
+            'subscription notification rejected, id:%s, url:%s, status:%d',
+            notification.subscription_id, url, status_code
+        )
+        self._count_drops(1)
+        return REJECTED
+
+    def _retry(self, notification):
+        """Schedule another attempt or spool the notification.
+
+        Args:
+            notification (Notification): notification which failed.
+        """
+        notification.attempt += 1
+        delay = backoff_delay(notification.attempt)
+        age = time.monotonic() - notification.created + delay
+        if notification.attempt >= config.SUBSCRIPTION_NOTIFY_MAX_ATTEMPTS:
+            self._spool(notification)
+            return
+        if age > config.SUBSCRIPTION_NOTIFY_MAX_AGE:
+            self._spool(notification)
+            return
+
+        with self._retry_cond:
+            if len(self._retries) < config.SUBSCRIPTION_NOTIFY_RETRY_QUEUE_MAXSIZE:
+                heapq.heappush(
+                    self._retries,
+                    (time.monotonic() + delay, next(self._retry_seq), notification)
+                )
+                if self._retry_thread is None:
+                    self._retry_thread = Thread(
+                        target=self._retry_loop, name='kopano_webhook_retry', daemon=True
+                    )
+                    self._retry_thread.start()
+                self._retry_cond.notify()
+                notification = None
+        if notification is not None:
+            self._spool(notification)
+        elif self.with_metrics:
+            POST_RETRIES.inc()
+
+    def _retry_loop(self):
+        """Submit notifications again when their retry delay is over."""
+        while True:
+            with self._retry_cond:
+                while True:
+                    if not self._retries:
+                        self._retry_cond.wait()
+                        continue
+                    wait = self._retries[0][0] - time.monotonic()
+                    if wait > 0:
+                        self._retry_cond.wait(wait)
+                        continue
+                    notification = heapq.heappop(self._retries)[2]
+                    break
+            self._enqueue(notification)
+
+    def _spool(self, notification, short_circuit=False):
+        """Write a notification to the spool, or drop it.
+
+        Args:
+            notification (Notification): notification which is not retried.
+            short_circuit (bool): the circuit of the host is open.
+        """
+        if self.with_metrics and short_circuit:
+            BREAKER_SHORT_CIRCUITS.inc()
+        if self.spool is not None and self.spool.append(notification):
+            logging.log(
+                logging.DEBUG if short_circuit else logging.WARNING,
+                'subscription notification spooled, id:%s, url:%s, attempts:%d',
+                notification.subscription_id, notification.url, notification.attempt
+            )
+            if self.with_metrics:
+                SPOOL_COUNT.inc()
+                SPOOL_DEPTH_GAUGE.set(self.spool.depth)
+            return
+
+        logging.error(
+            'subscription notification dropped, id:%s, url:%s, attempts:%d',
+            notification.subscription_id, notification.url, notification.attempt
+        )
+        self._count_drops(1)
+
+    def replay_spool(self, host=None):
+        """Submit spooled notifications again.
+
+        Notifications are fed into the queue of their host as it has room,
+        waiting at most SUBSCRIPTION_NOTIFY_TIMEOUT seconds for a host. The
+        ones which do not fit go back to the spool, as do those of other
+        hosts when replaying a single host. Notifications which are older
+        than SUBSCRIPTION_NOTIFY_SPOOL_MAX_AGE seconds, or whose subscription
+        no longer exists, are dropped.
+
+        Args:
+            host (Union[str,None]): host key (see host_key) of the host to
+                replay, None replays all hosts.
+        """
+        # Replays are serialized, so a replay sees what a running one puts
+        # back into the spool.
+        with self._replay_lock:
+            self._replayed = time.monotonic()
+            count = respooled = dropped = 0
+            stalled = set()
+            try:
+                for notification in self.spool.replay():
+                    name = host_key(notification.url)
+                    if self.exists is not None:
+                        notification.retain(self.exists)
+                    if time.monotonic() - notification.created > config.SUBSCRIPTION_NOTIFY_SPOOL_MAX_AGE:
+                        logging.warning(
+                            'spooled subscription notification expired, id:%s, url:%s, attempts:%d',
+                            notification.subscription_id, notification.url, notification.attempt
+                        )
+                        dropped += 1
+                    elif not notification.subscription_ids:
+                        logging.debug(
+                            'spooled subscription notification dropped, subscriptions are gone, url:%s',
+                            notification.url
+                        )
+                        dropped += 1
+                    elif (host is not None and name != host) or name in stalled:
+                        self._respool(notification)
+                        respooled += 1
+                    elif not self._wait_for_room(name):
+                        stalled.add(name)
+                        self._respool(notification)
+                        respooled += 1
+                    else:
+                        self._enqueue(notification)
+                        count += 1
+            except Exception:
+                logging.exception('failed to replay webhook spool')
+            if count or respooled or dropped:
+                logging.info(
+                    'replayed spooled subscription notifications, count:%d, respooled:%d, dropped:%d',
+                    count, respooled, dropped
+                )
+            if dropped:
+                self._count_drops(dropped)
+            if self.with_metrics:
+                SPOOL_DEPTH_GAUGE.set(self.spool.depth)
+
+    def _wait_for_room(self, name):
+        """Wait until the queue of a host has room for another notification.
+
+        Args:
+            name (str): host key of the notification url.
+
+        Returns:
+            bool: False when the queue stayed full for
+                SUBSCRIPTION_NOTIFY_TIMEOUT seconds.
+        """
+        deadline = time.monotonic() + config.SUBSCRIPTION_NOTIFY_TIMEOUT
+        with self._room:
+            while True:
+                host = self._hosts.get(name)
+                if host is None or len(host.pending) < config.SUBSCRIPTION_NOTIFY_HOST_QUEUE_MAXSIZE:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._room.wait(remaining)
+
+    def _respool(self, notification):
+        """Put a notification which was not replayed back into the spool.
+
+        Args:
+            notification (Notification): spooled notification.
+        """
+        if self.spool.append(notification):
+            return
+        logging.error(
+            'subscription notification dropped, spool is full, id:%s, url:%s, attempts:%d',
+            notification.subscription_id, notification.url, notification.attempt
+        )
+        self._count_drops(1)
+
+    def _count_drops(self, count):
+        """Count notifications which are dropped for good.
+
+        Args:
+            count (int): number of dropped notifications.
+        """
+        with self._drops_lock:
+            self.dropped += count
+        if self.with_metrics:
+            POST_DROPS.inc(count)
+
+    def close_idle(self, idle_timeout):
+        """Close the connections of hosts which have been idle for a while.
+
+        Args:
+            idle_timeout (float): idle time in seconds.
+        """
+        deadline = time.monotonic() - idle_timeout
+        idle = []
+        with self._lock:
+            for name, host in list(self._hosts.items()):
+                # Hosts with an open circuit are kept to remember it.
+                if not host.active and host.last_used < deadline and host.breaker.state == CLOSED:
+                    del self._hosts[name]
+                    idle.append(host)
+        for host in idle:
+            logging.debug('closing idle webhook connections, host:%s', host.name)
+            host.session.close()
+
+        if self.with_metrics:
+            PROCESSOR_POOL_GAUGE.set(len(self._hosts))
+
+    def circuit(self, name):
+        """Return the circuit breaker state of a host.
+
+        Args:
+            name (str): host key of the notification url.
+
+        Returns:
+            str: state of the circuit, closed for unknown hosts.
+        """
+        with self._lock:
+            host = self._hosts.get(name)
+            if host is None:
+                return CLOSED
+            return host.breaker.current(time.monotonic())
+
+    def circuits(self):
+        """Return the number of hosts per circuit breaker state.
+
+        Returns:
+            Dict[str,int]: number of hosts by state.
+        """
+        now = time.monotonic()
+        counts = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        with self._lock:
+            for host in self._hosts.values():
+                counts[host.breaker.current(now)] += 1
+        return counts
+
+    def housekeeping(self):
+        """Close idle connections, update metrics and replay the spool when it is due."""
+        self.close_idle(config.SUBSCRIPTION_NOTIFY_HOST_IDLE_TIMEOUT)
+        if self.with_metrics:
+            for state, count in self.circuits().items():
+                BREAKER_GAUGE.labels(state).set(count)
+
+        interval = config.SUBSCRIPTION_NOTIFY_SPOOL_REPLAY_INTERVAL
+        if self.spool is None or interval <= 0:
+            return
+        if time.monotonic() - self._replayed >= interval:
+            self._executor.submit(self.replay_spool)
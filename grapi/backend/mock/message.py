@@ -1,3 +1,5 @@
+import falcon
+
 from grapi.backend.mock import Resource
 
 from .data import MESSAGES
@@ -15,3 +17,10 @@ class MessageResource(Resource):
         }
 
         self.respond_json(resp, data)
+
+    def on_get_item(self, req, resp, itemid):
+        for message in MESSAGES:
+            if message['id'] == itemid:
+                self.respond_json(resp, {'@odata.context': req.path, **message})
+                return
+        raise falcon.HTTPNotFound(description='Item not found')
@@ -18,6 +18,8 @@ import bjoern
 import falcon
 
 import grapi.api.v1 as grapi
+from grapi.api.v1 import config
+from grapi.mfr.affinity import AffinityRouter
 from grapi.mfr.msgfmt import Msgfmt, PoSyntaxError
 from grapi.mfr.utils import parse_accept_language
 
@@ -280,6 +282,9 @@ class Server:
         bjoern.server_run(self.create_socket_and_listen(unix_socket_path), app)
 
     def run_notify(self, socket_path, n, options):
+        # Backends keep per worker state (e.g. persisted subscriptions).
+        options.notify_worker = n
+
         middleware = [FalconLabel(self.translations)]
         if options.with_metrics:
             middleware.append(FalconMetrics())
@@ -300,6 +305,11 @@ class Server:
         app.add_error_handler(Exception, handler)
         app.initialize_backends_error_handlers()
 
+        # Requests of a user are always handled by the same notify worker.
+        if config.SUBSCRIPTION_AFFINITY and options.workers > 1:
+            app = AffinityRouter(app, socket_path, n, options.workers, config.SUBSCRIPTION_AFFINITY_TIMEOUT)
+            app.start()
+
         unix_socket_path = os.path.join(socket_path, 'notify%d.sock' % n)
 
         # Run server, this blocks.
@@ -383,6 +393,8 @@ class Server:
             os.unlink(f)
         for f in glob.glob(os.path.join(args.socket_path, 'notify*.sock')):
             os.unlink(f)
+        for f in glob.glob(os.path.join(args.socket_path, 'affinity*.sock')):
+            os.unlink(f)
 
         # Initialize translations
         self.translations = self.get_translations(args.translations_path)
@@ -493,6 +505,7 @@ class Server:
             sockets.append('rest%d.sock' % n)
         for n in range(args.workers):
             sockets.append('notify%d.sock' % n)
+            sockets.append('affinity%d.sock' % n)
         for socket in sockets:  # noqa: F402
             try:
                 unix_socket = os.path.join(args.socket_path, socket)
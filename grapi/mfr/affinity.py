@@ -0,0 +1,149 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+"""Notify worker affinity.
+
+Subscriptions live in the memory of the notify worker which created them,
+together with the user's server session. Requests of a user are therefore
+always handled by the same notify worker, chosen by the user ID which the
+proxy passes in the X-Kopano-UserEntryID header. A worker which receives a
+request of another worker's user forwards it to that worker.
+
+Forwarded requests are not sent to the public notify socket of the other
+worker, as bjoern handles one request at a time and two workers forwarding
+to each other would block each other. Every worker serves forwarded
+requests on a separate affinity socket with a thread per request instead,
+so the subscription backend serializes the creation of a user's record and
+subscriptions.
+"""
+import http.client
+import logging
+import os
+import socket
+import socketserver
+import threading
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from grapi.api.v1.utils import affinity_worker
+
+# Hop-by-hop headers, which are not forwarded.
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'transfer-encoding', 'upgrade',
+}
+
+
+def affinity_socket_path(socket_path, n):
+    return os.path.join(socket_path, 'affinity%d.sock' % n)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class AffinityServer(socketserver.ThreadingMixIn, WSGIServer):
+    address_family = socket.AF_UNIX
+    daemon_threads = True
+
+    def get_request(self):
+        # Unix socket peers have no address, which wsgiref expects.
+        request, _ = self.socket.accept()
+        return request, ('affinity', 0)
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+        self.setup_environ()
+
+
+class AffinityRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug('affinity: ' + format, *args)
+
+
+class AffinityRouter:
+    """WSGI application which forwards requests to the owning notify worker."""
+
+    def __init__(self, app, socket_path, worker, workers, timeout):
+        self.app = app
+        self.socket_path = socket_path
+        self.worker = worker
+        self.workers = workers
+        self.timeout = timeout
+
+    def start(self):
+        """Serve forwarded requests of other workers in a thread."""
+        server = AffinityServer(
+            affinity_socket_path(self.socket_path, self.worker), AffinityRequestHandler
+        )
+        server.set_app(self.app)
+        thread = threading.Thread(target=server.serve_forever, name='affinity')
+        thread.daemon = True
+        thread.start()
+
+    def __call__(self, environ, start_response):
+        userid = environ.get('HTTP_X_KOPANO_USERENTRYID')
+        if userid:
+            worker = affinity_worker(userid, self.workers)
+            if worker != self.worker:
+                return self.forward(worker, environ, start_response)
+        return self.app(environ, start_response)
+
+    def forward(self, worker, environ, start_response):
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+
+        headers = {}
+        for key, value in environ.items():
+            if key.startswith('HTTP_'):
+                name = key[5:].replace('_', '-').title()
+                if name.lower() not in HOP_BY_HOP_HEADERS:
+                    headers[name] = value
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else None
+
+        connection = UnixHTTPConnection(affinity_socket_path(self.socket_path, worker), self.timeout)
+        try:
+            try:
+                connection.request(environ['REQUEST_METHOD'], path, body=body, headers=headers)
+            except (OSError, http.client.HTTPException) as e:
+                logging.warning('failed to forward request to notify worker %d: %s', worker, e)
+                start_response('503 Service Unavailable', [('Content-Length', '0'), ('Retry-After', '1')])
+                return [b'']
+            # The request was sent and may have been processed, so the client
+            # is not asked to retry it.
+            try:
+                response = connection.getresponse()
+                data = response.read()
+            except socket.timeout:
+                logging.warning('forwarded request to notify worker %d timed out', worker)
+                start_response('504 Gateway Timeout', [('Content-Length', '0')])
+                return [b'']
+            except (OSError, http.client.HTTPException) as e:
+                logging.warning('failed to read response of notify worker %d: %s', worker, e)
+                start_response('502 Bad Gateway', [('Content-Length', '0')])
+                return [b'']
+        finally:
+            connection.close()
+
+        response_headers = [
+            (name, value) for name, value in response.getheaders()
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != 'content-length'
+        ]
+        response_headers.append(('Content-Length', str(len(data))))
+        start_response('%d %s' % (response.status, response.reason), response_headers)
+        return [data]
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# $batch dependency graph benchmark, builds graphs like process_request does
+# for a batch body with dependsOn chains and sorts them, usage:
+# python3 scripts/benchmark-batch-graph.py --vertices 1000 --shape diamond
+
+import argparse
+import time
+import timeit
+
+from grapi.api.v1.graph import AdjacencyList
+
+VERTICES = 1000
+REPEAT = 5
+SHAPES = ('independent', 'chain', 'fanout', 'diamond')
+
+
+def edges(count, shape):
+    if shape == 'chain':
+        for n in range(1, count):
+            yield n - 1, n
+    elif shape == 'fanout':
+        for n in range(1, count):
+            yield 0, n
+    elif shape == 'diamond':
+        # Layers of 10 requests, each depending on all of the previous layer.
+        width = 10
+        for n in range(width, count):
+            layer = n // width
+            for p in range((layer - 1) * width, layer * width):
+                yield p, n
+
+
+def main(count, repeat, shape):
+    graph_edges = list(edges(count, shape))
+
+    def run():
+        graph = AdjacencyList(count)
+        for v1_id, v2_id in graph_edges:
+            graph.add_edge(v1_id, v2_id)
+        graph.get_sorted_levels()
+        graph.get_vertices_chain(0)
+
+    result = min(timeit.repeat(run, number=1, repeat=repeat, timer=time.perf_counter))
+
+    print('vertices: {}, edges: {}, shape: {}'.format(count, len(graph_edges), shape))
+    print('build, sort and chain: {:8.2f} ms'.format(result * 1e3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the $batch dependency graph')
+    parser.add_argument('--vertices', type=int, default=VERTICES, help='number of requests (default: {})'.format(VERTICES))
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='number of runs (default: {})'.format(REPEAT))
+    parser.add_argument('--shape', choices=SHAPES, default='diamond', help='dependency shape (default: diamond)')
+
+    args = parser.parse_args()
+    main(args.vertices, args.repeat, args.shape)
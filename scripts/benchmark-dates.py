@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# Date formatting benchmark, simulates the date fields serialized per event
+# of a large calendar view, usage:
+# python3 scripts/benchmark-dates.py --items 10000 --timezone "W. Europe Standard Time"
+
+import argparse
+import datetime
+import time
+import timeit
+from unittest.mock import Mock
+
+from grapi.api.v1.context import Context
+from grapi.api.v1.timezone import to_timezone
+from grapi.backend.kopano import resource
+
+ITEMS = 5000
+REPEAT = 5
+
+
+def legacy_tzdate(d, tzinfo, req):
+    """Per field implementation as used before the cached formatter."""
+    if d is None:
+        return None
+    fmt = '%Y-%m-%dT%H:%M:%S'
+    if d.tzinfo is None:
+        d = resource.LOCAL.localize(d)
+    prefer_tz = req.context.prefer.get('outlook.timezone')
+    if prefer_tz and prefer_tz[0]:
+        d = d.astimezone(prefer_tz[0]).replace(tzinfo=None)
+        prefer_timeZone = prefer_tz[1]
+    else:
+        prefer_timeZone = 'UTC'
+        d = d.astimezone(resource.UTC).replace(tzinfo=None)
+    return {'dateTime': d.strftime(fmt), 'timeZone': prefer_timeZone}
+
+
+def events(count):
+    start = datetime.datetime(2020, 1, 1, 8, 30)
+    for n in range(count):
+        created = start + datetime.timedelta(minutes=n * 53)
+        yield created, created + datetime.timedelta(seconds=n), created + datetime.timedelta(hours=2), created + datetime.timedelta(hours=3)
+
+
+def serialize(items, date, tzdate, req):
+    for created, modified, begin, end in items:
+        date(created)
+        date(modified)
+        date(modified)  # responseStatus time
+        tzdate(begin, None, req)
+        tzdate(end, None, req)
+
+
+def request(timezone):
+    req = Mock()
+    req.context = Context()
+    req.context.prefer = Mock()
+    req.context.prefer.get.return_value = (to_timezone(timezone), timezone) if timezone else None
+    return req
+
+
+def main(count, repeat, timezone):
+    items = list(events(count))
+
+    def run_legacy():
+        serialize(items, resource._date_strftime, legacy_tzdate, request(timezone))
+
+    def run_cached():
+        serialize(items, resource._date, resource._tzdate, request(timezone))
+
+    legacy = min(timeit.repeat(run_legacy, number=1, repeat=repeat, timer=time.perf_counter))
+    cached = min(timeit.repeat(run_cached, number=1, repeat=repeat, timer=time.perf_counter))
+
+    print('items: {}, timezone: {}'.format(count, timezone or 'UTC'))
+    print('legacy: {:8.2f} us/item'.format(legacy / count * 1e6))
+    print('cached: {:8.2f} us/item'.format(cached / count * 1e6))
+    print('speedup: {:.1f}x'.format(legacy / cached))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark date formatting of calendar view items')
+    parser.add_argument('--items', type=int, default=ITEMS, help='number of events (default: {})'.format(ITEMS))
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='number of runs (default: {})'.format(REPEAT))
+    parser.add_argument('--timezone', type=str, default=None, help='Prefer outlook.timezone value (default: UTC)')
+
+    args = parser.parse_args()
+    main(args.items, args.repeat, args.timezone)
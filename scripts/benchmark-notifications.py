@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# Subscription notification pipeline load test, runs offline without a
+# kopano server. A fake notification source feeds subscription sinks, the
+# processor and webhook delivery post to local webhook receivers with
+# configurable latency and failure rate, usage:
+# python3 scripts/benchmark-notifications.py --events 500 --rate 50 --subscriptions 10 --hosts 2 --latency 0.05
+#
+# Exits with status 1 when a given --min-throughput or --max-p99 is not met,
+# or notifications were dropped or went missing, so it can be used in CI.
+# With --rate 0 changes are emitted as fast as possible, which overflows the
+# subscription queue and host queues and reports the drops.
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from grapi.api.v1 import config
+
+EVENTS = 100
+SUBSCRIPTIONS = 10
+HOSTS = 2
+RATE = 20
+TIMEOUT = 60
+
+
+class WebhookReceiver:
+    """Local webhook receiver with configurable latency and failure rate."""
+
+    def __init__(self, latency, jitter, failure_rate, received):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.received = received
+        self.posts = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                delay = receiver.latency + random.uniform(0, receiver.jitter)
+                if delay:
+                    time.sleep(delay)
+                with receiver.lock:
+                    receiver.posts += 1
+                    failed = random.random() < receiver.failure_rate
+                    if failed:
+                        receiver.failures += 1
+                if failed:
+                    self.send_response(503)
+                else:
+                    receiver.receive(json.loads(body.decode('utf-8')))
+                    self.send_response(202)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d/hook' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def receive(self, data):
+        now = time.monotonic()
+        for notification in data.get('value', [data]):
+            key = (notification['subscriptionId'], notification['resourceData']['id'])
+            self.received.setdefault(key, now)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeObject:
+    __slots__ = ('entryid',)
+
+    def __init__(self, entryid):
+        self.entryid = entryid
+
+
+class FakeNotification:
+    """Notification as passed to sinks by the kopano server connection."""
+
+    __slots__ = ('event_type', 'object')
+
+    def __init__(self, event_type, entryid):
+        self.event_type = event_type
+        self.object = FakeObject(entryid)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main(args):
+    # Configure before the pipeline reads its settings.
+    config.SUBSCRIPTION_NOTIFY_SPOOL_MAXSIZE = 0
+    config.SUBSCRIPTION_NOTIFY_BATCH_SIZE = args.batch_size
+    config.SUBSCRIPTION_NOTIFY_MAX_WORKERS = args.max_workers
+    config.SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY = args.host_concurrency
+    config.SUBSCRIPTION_NOTIFY_RETRY_DELAY = args.retry_delay
+    config.SUBSCRIPTION_NOTIFY_BREAKER_THRESHOLD = args.breaker_threshold
+
+    from grapi.backend.kopano import subscription
+    from grapi.backend.kopano.webhook import WebhookDelivery
+
+    received = {}
+    receivers = [
+        WebhookReceiver(args.latency, args.jitter, args.failure_rate, received)
+        for _ in range(args.hosts)
+    ]
+
+    options = Namespace(insecure=True, with_metrics=False)
+    queue = subscription.NotificationBuffer(config.SUBSCRIPTION_QUEUE_MAXSIZE)
+    delivery = WebhookDelivery(options)
+    subscription.SubscriptionProcessor(options, queue, delivery).start()
+
+    # All subscriptions are on the same folder, so they share one sink like
+    # the subscriptions of a user on the same folder do.
+    subscriptions = [{
+        'id': 'subscription%d' % n,
+        'clientState': None,
+        'changeType': 'created,updated,deleted',
+        'resource': 'me/mailFolders/inbox/messages',
+        'notificationUrl': receivers[n % args.hosts].url,
+        '_datatype': 'message',
+    } for n in range(args.subscriptions)]
+    sinks = {}
+    key = ('inbox', ('created', 'deleted', 'updated'), ('item',), ('mail',))
+    sink = subscription.SubscriptionSink(object(), options, subscriptions[0], queue, sinks, key)
+    sink.register()
+    for sub in subscriptions[1:]:
+        subscription.SubscriptionSink.attach(sinks, key, sub)
+
+    print('events: {}, subscriptions: {}, hosts: {}, latency: {}s (+{}s), failure rate: {}'.format(
+        args.events, args.subscriptions, args.hosts, args.latency, args.jitter, args.failure_rate))
+    print('batch size: {}, workers: {}, host concurrency: {}'.format(
+        args.batch_size, args.max_workers, args.host_concurrency))
+
+    changed = {}
+    interval = 1.0 / args.rate if args.rate else 0
+    start = time.monotonic()
+    for n in range(args.events):
+        entryid = '%08d' % n
+        changed[entryid] = time.monotonic()
+        sink.update(FakeNotification('created', entryid))
+        if interval:
+            time.sleep(max(0, start + (n + 1) * interval - time.monotonic()))
+    emitted = time.monotonic()
+
+    expected = args.events * args.subscriptions
+
+    def dropped():
+        return queue.dropped + delivery.dropped
+
+    deadline = emitted + args.timeout
+    # Dropped notifications never arrive, do not wait for them.
+    while len(received) + dropped() < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    finished = max(received.values()) if received else time.monotonic()
+
+    latencies = sorted(
+        received_at - changed[entryid] for (_, entryid), received_at in received.items()
+    )
+    duration = finished - start
+    posts = sum(receiver.posts for receiver in receivers)
+    failures = sum(receiver.failures for receiver in receivers)
+    # Notifications which were neither delivered nor dropped.
+    missing = expected - len(received) - dropped()
+    throughput = len(received) / duration if duration > 0 else 0.0
+
+    print('emitted in: {:8.2f} s'.format(emitted - start))
+    print('delivered: {} of {} notifications in {:.2f} s, {} posts, {} failed posts'.format(
+        len(received), expected, duration, posts, failures))
+    print('dropped: {} by the queue, {} by the delivery'.format(queue.dropped, delivery.dropped))
+    print('throughput: {:8.1f} notifications/s'.format(throughput))
+    print('latency: p50 {:.3f} s, p90 {:.3f} s, p99 {:.3f} s, max {:.3f} s'.format(
+        percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99),
+        latencies[-1] if latencies else 0.0))
+
+    for receiver in receivers:
+        receiver.close()
+
+    ok = missing <= args.max_missing and dropped() <= args.max_dropped
+    if args.min_throughput and throughput < args.min_throughput:
+        print('FAIL: throughput below {}'.format(args.min_throughput))
+        ok = False
+    if args.max_p99 and percentile(latencies, 99) > args.max_p99:
+        print('FAIL: p99 latency above {} s'.format(args.max_p99))
+        ok = False
+    if dropped() > args.max_dropped:
+        print('FAIL: {} notifications dropped'.format(dropped()))
+    if missing > args.max_missing:
+        print('FAIL: {} notifications missing'.format(missing))
+    return ok
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the subscription notification pipeline')
+    parser.add_argument('--events', type=int, default=EVENTS, help='number of changes (default: {})'.format(EVENTS))
+    parser.add_argument('--subscriptions', type=int, default=SUBSCRIPTIONS, help='number of subscriptions on the folder (default: {})'.format(SUBSCRIPTIONS))
+    parser.add_argument('--hosts', type=int, default=HOSTS, help='number of webhook receivers (default: {})'.format(HOSTS))
+    parser.add_argument('--rate', type=float, default=RATE, help='changes per second, 0 is unlimited (default: {})'.format(RATE))
+    parser.add_argument('--latency', type=float, default=0, help='webhook response latency in seconds (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0, help='random additional webhook latency in seconds (default: 0)')
+    parser.add_argument('--failure-rate', type=float, default=0, help='fraction of failing webhook posts (default: 0)')
+    parser.add_argument('--batch-size', type=int, default=config.SUBSCRIPTION_NOTIFY_BATCH_SIZE, help='notifications per post (default: {})'.format(config.SUBSCRIPTION_NOTIFY_BATCH_SIZE))
+    parser.add_argument('--max-workers', type=int, default=config.SUBSCRIPTION_NOTIFY_MAX_WORKERS, help='webhook delivery threads (default: {})'.format(config.SUBSCRIPTION_NOTIFY_MAX_WORKERS))
+    parser.add_argument('--host-concurrency', type=int, default=config.SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY, help='concurrent posts per host (default: {})'.format(config.SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY))
+    parser.add_argument('--retry-delay', type=float, default=0.1, help='initial retry delay in seconds (default: 0.1)')
+    parser.add_argument('--breaker-threshold', type=int, default=0, help='circuit breaker threshold, 0 disables it (default: 0)')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT, help='seconds to wait for deliveries (default: {})'.format(TIMEOUT))
+    parser.add_argument('--min-throughput', type=float, default=0, help='fail below this many notifications per second')
+    parser.add_argument('--max-p99', type=float, default=0, help='fail above this p99 latency in seconds')
+    parser.add_argument('--max-missing', type=int, default=0, help='fail when more notifications are neither delivered nor dropped (default: 0)')
+    parser.add_argument('--max-dropped', type=int, default=0, help='fail when more notifications are dropped (default: 0)')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(parse_args()) else 1)
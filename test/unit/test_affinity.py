@@ -0,0 +1,95 @@
+"""Test mfr/affinity notify worker routing."""
+import io
+import json
+import time
+
+from grapi.api.v1.utils import affinity_worker
+from grapi.mfr.affinity import AffinityRouter
+
+
+def _app(worker):
+    def app(environ, start_response):
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        data = json.dumps({
+            'worker': worker,
+            'method': environ['REQUEST_METHOD'],
+            'path': environ['PATH_INFO'],
+            'query': environ.get('QUERY_STRING'),
+            'user': environ.get('HTTP_X_KOPANO_USERENTRYID'),
+            'body': environ['wsgi.input'].read(length).decode('utf-8'),
+        }).encode('utf-8')
+        start_response('201 Created', [('Content-Type', 'application/json'), ('X-Test', 'yes')])
+        return [data]
+    return app
+
+
+def _call(router, userid, body=b''):
+    response = {}
+
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/api/gc/v1/subscriptions',
+        'QUERY_STRING': '$top=1',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'HTTP_X_KOPANO_USERENTRYID': userid,
+        'wsgi.input': io.BytesIO(body),
+    }
+    data = b''.join(router(environ, start_response))
+    return response['status'], response['headers'], json.loads(data.decode('utf-8')) if data else None
+
+
+def test_affinity_worker():
+    assert affinity_worker('user', 1) == 0
+    assert affinity_worker('user', 4) == affinity_worker('user', 4)
+    assert {affinity_worker('user%d' % n, 4) for n in range(100)} == {0, 1, 2, 3}
+
+
+def test_affinity_router(tmp_path):
+    socket_path = str(tmp_path)
+    routers = [AffinityRouter(_app(n), socket_path, n, 2, 5) for n in range(2)]
+    routers[1].start()
+
+    users = ['user%d' % n for n in range(10)]
+    for userid in users:
+        status, headers, data = _call(routers[0], userid, b'{"a": 1}')
+        assert status == '201 Created'
+        assert data == {
+            'worker': affinity_worker(userid, 2),
+            'method': 'POST',
+            'path': '/api/gc/v1/subscriptions',
+            'query': '$top=1',
+            'user': userid,
+            'body': '{"a": 1}',
+        }
+        assert headers['Content-Type'] == 'application/json'
+        assert headers['X-Test'] == 'yes'
+
+
+def test_affinity_router_unavailable(tmp_path):
+    router = AffinityRouter(_app(0), str(tmp_path), 0, 2, 5)
+    userid = next('user%d' % n for n in range(10) if affinity_worker('user%d' % n, 2) == 1)
+    status, headers, data = _call(router, userid)
+    assert status == '503 Service Unavailable'
+    assert data is None
+
+
+def test_affinity_router_timeout(tmp_path):
+    def slow(environ, start_response):
+        time.sleep(1)
+        start_response('201 Created', [])
+        return [b'']
+
+    socket_path = str(tmp_path)
+    router = AffinityRouter(_app(0), socket_path, 0, 2, 0.2)
+    AffinityRouter(slow, socket_path, 1, 2, 0.2).start()
+    userid = next('user%d' % n for n in range(10) if affinity_worker('user%d' % n, 2) == 1)
+
+    # The request may have been processed, the client must not retry.
+    status, headers, data = _call(router, userid)
+    assert status == '504 Gateway Timeout'
+    assert 'Retry-After' not in headers
@@ -0,0 +1,32 @@
+"""Test scripts/benchmark-notifications.py with a small load."""
+import importlib.util
+import os
+
+from grapi.api.v1 import config
+
+SCRIPT = os.path.join(os.path.dirname(__file__), '..', '..', 'scripts', 'benchmark-notifications.py')
+
+
+def _benchmark():
+    spec = importlib.util.spec_from_file_location('benchmark_notifications', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_benchmark_notifications(monkeypatch, capsys):
+    # The benchmark configures the pipeline, restore the settings afterwards.
+    for name in (
+        'SUBSCRIPTION_NOTIFY_SPOOL_MAXSIZE', 'SUBSCRIPTION_NOTIFY_BATCH_SIZE',
+        'SUBSCRIPTION_NOTIFY_MAX_WORKERS', 'SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY',
+        'SUBSCRIPTION_NOTIFY_RETRY_DELAY', 'SUBSCRIPTION_NOTIFY_BREAKER_THRESHOLD',
+    ):
+        monkeypatch.setattr(config, name, getattr(config, name))
+
+    benchmark = _benchmark()
+    args = benchmark.parse_args([
+        '--events', '20', '--subscriptions', '3', '--rate', '0',
+        '--failure-rate', '0.1', '--retry-delay', '0.01', '--timeout', '20',
+    ])
+    assert benchmark.main(args)
+    assert 'delivered: 60 of 60 notifications' in capsys.readouterr().out
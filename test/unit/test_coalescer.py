@@ -0,0 +1,38 @@
+"""Test streamed response coalescing middleware."""
+import falcon
+
+from grapi.api.v1.middleware.response_coalescer import ResponseCoalescer
+
+
+def test_coalesce_stream():
+    chunks = [b'{\n', b'  "value": [\n'] + [b',\n    {"id": %d}' % i for i in range(1000)] + [b'\n  ]\n}']
+    resp = falcon.Response()
+    resp.stream = iter(chunks)
+    ResponseCoalescer(size=4096).process_response(None, resp, None, True)
+    writes = list(resp.stream)
+    assert b''.join(writes) == b''.join(chunks)
+    assert all(len(write) >= 4096 for write in writes[:-1])
+    assert len(writes) < len(chunks)
+
+
+def test_coalesce_ignores_body():
+    resp = falcon.Response()
+    resp.body = b'{}'
+    ResponseCoalescer(size=4096).process_response(None, resp, None, True)
+    assert resp.stream is None
+
+
+def test_coalesce_disabled():
+    chunks = [b'a', b'b']
+    resp = falcon.Response()
+    resp.stream = chunks
+    ResponseCoalescer(size=0).process_response(None, resp, None, True)
+    assert resp.stream is chunks
+
+
+def test_coalesce_flush_points():
+    chunks = [b'[\n', b'{"id": "1"}', b'', b',\n', b'{"id": "2"}', b'', b'', b'\n]']
+    resp = falcon.Response()
+    resp.stream = iter(chunks)
+    ResponseCoalescer(size=4096).process_response(None, resp, None, True)
+    assert list(resp.stream) == [b'[\n{"id": "1"}', b',\n{"id": "2"}', b'\n]']
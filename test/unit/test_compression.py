@@ -0,0 +1,82 @@
+"""Test response compression middleware."""
+import gzip
+import zlib
+from unittest.mock import Mock
+
+import falcon
+
+from grapi.api.v1.middleware.response_compression import (
+    ResponseCompression, parse_accept_encoding, select_encoding)
+
+
+def _request(accept_encoding):
+    req = Mock()
+    req.method = 'GET'
+    req.get_header.return_value = accept_encoding
+    return req
+
+
+def _response():
+    resp = falcon.Response()
+    resp.content_type = 'application/json'
+    return resp
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding('gzip, deflate;q=0.5, br;q=0') == {'gzip': 1.0, 'deflate': 0.5, 'br': 0.0}
+    assert parse_accept_encoding('') == {}
+
+
+def test_select_encoding():
+    assert select_encoding('gzip, br', ['br', 'gzip']) == 'br'
+    assert select_encoding('gzip;q=1.0, br;q=0.5', ['br', 'gzip']) == 'gzip'
+    assert select_encoding('*', ['gzip']) == 'gzip'
+    assert select_encoding('gzip;q=0', ['gzip']) is None
+    assert select_encoding('identity', ['gzip']) is None
+
+
+def test_compress_body():
+    middleware = ResponseCompression(encodings=['gzip'], min_size=10)
+    resp = _response()
+    resp.body = b'{"value": "%s"}' % (b'x' * 100)
+    middleware.process_response(_request('gzip'), resp, None, True)
+    assert resp.get_header('Content-Encoding') == 'gzip'
+    assert gzip.decompress(resp.data) == b'{"value": "%s"}' % (b'x' * 100)
+
+
+def test_compress_stream():
+    middleware = ResponseCompression(encodings=['gzip'], min_size=10)
+    chunks = [b'{\n', b'  "value": [\n'] + [b'    {"id": %d},\n' % i for i in range(100)] + [b']}']
+    resp = _response()
+    resp.stream = iter(chunks)
+    middleware.process_response(_request('gzip'), resp, None, True)
+    assert resp.get_header('Content-Encoding') == 'gzip'
+    assert gzip.decompress(b''.join(resp.stream)) == b''.join(chunks)
+
+
+def test_skip_small_and_unaccepted():
+    middleware = ResponseCompression(encodings=['gzip'], min_size=1024)
+    resp = _response()
+    resp.stream = iter([b'{', b'}'])
+    middleware.process_response(_request('gzip'), resp, None, True)
+    assert resp.get_header('Content-Encoding') is None
+    assert resp.data == b'{}'
+
+    resp = _response()
+    resp.body = b'x' * 2048
+    middleware.process_response(_request(None), resp, None, True)
+    assert resp.get_header('Content-Encoding') is None
+    assert resp.get_header('Vary') == 'Accept-Encoding'
+
+
+def test_compress_stream_flush_points():
+    middleware = ResponseCompression(encodings=['gzip'], min_size=10)
+    chunks = [b'[\n', b'{"id": "1"}', b''] + [b',\n{"id": "%d"}' % i for i in range(2, 5)] + [b'', b'\n]']
+    resp = _response()
+    resp.stream = iter(chunks)
+    middleware.process_response(_request('gzip'), resp, None, True)
+    writes = list(resp.stream)
+    # Everything up to a flush point can be decompressed right away.
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress(b''.join(writes[:writes.index(b'')])) == b'[\n{"id": "1"}'
+    assert gzip.decompress(b''.join(writes)) == b''.join(chunks)
@@ -0,0 +1,136 @@
+"""Test conditional requests on backend/kopano resources."""
+import json
+from unittest.mock import Mock
+
+import falcon
+import pytest
+
+from grapi.api.v1.context import Context
+from grapi.api.v1.resource import _match_etag
+from grapi.backend.kopano.resource import Resource
+
+
+class ItemResource(Resource):
+    fields = {
+        '@odata.etag': lambda item: 'W/"' + item.changekey + '"',
+        'id': lambda item: item.entryid,
+    }
+
+
+class FolderResource(Resource):
+    etag_from_body = True
+    fields = {
+        'id': lambda folder: folder.entryid,
+        'totalItemCount': lambda folder: folder.count,
+    }
+
+
+def _request(method='GET', path='/me/x', query_string='', **headers):
+    req = Mock()
+    req.method = method
+    req.path = path
+    req.query_string = query_string
+    req.get_header = lambda name: headers.get(name.replace('-', '_'))
+    req.context = Context()
+    req.context.prefer = Mock()
+    req.context.prefer.get.return_value = None
+    return req
+
+
+def _item(changekey='AAA', count=1):
+    return Mock(changekey=changekey, entryid='ID', count=count)
+
+
+def test_match_etag():
+    assert _match_etag('W/"abc"', 'W/"abc"')
+    assert _match_etag('"abc"', 'W/"abc"')
+    assert _match_etag('"x", W/"abc"', 'W/"abc"')
+    assert _match_etag('*', None)
+    assert not _match_etag('W/"abd"', 'W/"abc"')
+    assert not _match_etag(None, 'W/"abc"')
+    assert not _match_etag('"abc"', None)
+
+
+def test_item_not_modified():
+    resource = ItemResource(None)
+    resp = falcon.Response()
+    resource.respond(_request(If_None_Match='W/"AAA"'), resp, _item())
+    assert resp.status == falcon.HTTP_304
+    assert resp.body is None
+    assert resp.etag == 'W/"AAA"'
+
+    resp = falcon.Response()
+    resource.respond(_request(If_None_Match='W/"AAA"'), resp, _item('BBB'))
+    assert resp.status == falcon.HTTP_200
+    assert resp.etag == 'W/"BBB"'
+    assert b'"ID"' in resp.body
+
+
+def test_folder_not_modified():
+    resource = FolderResource(None)
+    resp = falcon.Response()
+    resource.respond(_request(), resp, _item())
+    etag = resp.etag
+    assert etag.startswith('W/"')
+
+    resp = falcon.Response()
+    resource.respond(_request(If_None_Match=etag), resp, _item())
+    assert resp.status == falcon.HTTP_304
+    assert resp.body is None
+
+    resp = falcon.Response()
+    resource.respond(_request(If_None_Match=etag), resp, _item(count=2))
+    assert resp.status == falcon.HTTP_200
+    assert resp.etag != etag
+
+
+def test_if_match():
+    resource = ItemResource(None)
+    resource.check_if_match(_request('PATCH'), _item())
+    resource.check_if_match(_request('PATCH', If_Match='W/"AAA"'), _item())
+    resource.check_if_match(_request('DELETE', If_Match='*'), _item())
+    with pytest.raises(falcon.HTTPPreconditionFailed):
+        resource.check_if_match(_request('DELETE', If_Match='W/"AAA"'), _item('BBB'))
+
+    resource = FolderResource(None)
+    req = _request()
+    resp = falcon.Response()
+    resource.respond(req, resp, _item())
+    resource.check_if_match(_request('PATCH', If_Match=resp.etag), _item())
+    with pytest.raises(falcon.HTTPPreconditionFailed):
+        resource.check_if_match(_request('PATCH', If_Match=resp.etag), _item(count=2))
+
+
+def test_folder_etag_is_canonical():
+    resource = FolderResource(None)
+    resp = falcon.Response()
+    resource.respond(_request(), resp, _item())
+    etag = resp.etag
+
+    # $select and the request path do not change the tag of a folder.
+    resp = falcon.Response()
+    resource.respond(_request(path='/users/u/x', query_string='$select=totalItemCount'), resp, _item())
+    assert resp.etag == etag
+    assert resp.body is not None
+
+    resp = falcon.Response()
+    resource.respond(_request(query_string='$select=id', If_None_Match=etag), resp, _item())
+    assert resp.status == falcon.HTTP_304
+    resource.check_if_match(_request('PATCH', path='/users/u/x', If_Match=etag), _item())
+
+
+def test_folder_serialized_once(monkeypatch):
+    calls = []
+    monkeypatch.setitem(FolderResource.fields, 'totalItemCount', lambda folder: calls.append(1) or folder.count)
+    resource = FolderResource(None)
+
+    # The representation hashed for the tag is the response body.
+    resp = falcon.Response()
+    resource.respond(_request(), resp, _item(count=5))
+    assert len(calls) == 1
+    assert json.loads(resp.body.decode('utf-8')) == {'@odata.context': '/me/x', 'id': 'ID', 'totalItemCount': 5}
+
+    resp = falcon.Response()
+    resource.respond(_request(query_string='$select=totalItemCount'), resp, _item(count=5))
+    assert len(calls) == 2
+    assert json.loads(resp.body.decode('utf-8')) == {'@odata.context': '/me/x', 'id': 'ID', 'totalItemCount': 5}
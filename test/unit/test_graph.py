@@ -1,12 +1,14 @@
 """Test graph module."""
 from collections import defaultdict
 
-from grapi.api.v1.graph import AdjacencyMatrix
+import pytest
+
+from grapi.api.v1.graph import AdjacencyList, CycleError
 
 
 def test_graph():
     """Correct tests."""
-    graph = AdjacencyMatrix(4)
+    graph = AdjacencyList(4)
     graph.add_edge(0, 1)
     graph.add_edge(1, 3)
 
@@ -30,11 +32,11 @@ def test_graph():
 def test_incorrect_data_graph():
     """Test graph with incorrect data."""
     try:
-        AdjacencyMatrix(0)
+        AdjacencyList(0)
     except ValueError:
         assert True
 
-    graph = AdjacencyMatrix(4)
+    graph = AdjacencyList(4)
 
     try:
         graph.add_edge(1, 4)
@@ -62,3 +64,47 @@ def test_incorrect_data_graph():
     assert graph.get_vertices_chain(3) == defaultdict(set)
 
     assert graph.get_sorted_vertices() == [0, 1, 2, 3]
+
+
+def test_graph_levels():
+    """Test grouping into dependency levels."""
+    graph = AdjacencyList(5)
+    graph.add_edge(0, 1)
+    graph.add_edge(1, 3)
+    graph.add_edge(2, 3)
+
+    assert graph.get_sorted_levels() == [[0, 2, 4], [1], [3]]
+    assert AdjacencyList(3).get_sorted_levels() == [[0, 1, 2]]
+
+
+def test_graph_diamond():
+    """Test chain of diamond shaped dependencies."""
+    graph = AdjacencyList(5)
+    graph.add_edge(0, 1)
+    graph.add_edge(0, 2)
+    graph.add_edge(1, 3)
+    graph.add_edge(2, 3)
+    graph.add_edge(3, 4)
+
+    assert graph.get_vertices_chain(0) == defaultdict(set, {0: {1, 2}, 1: {3}, 3: {4}})
+    assert graph.get_sorted_levels() == [[0], [1, 2], [3], [4]]
+
+
+def test_graph_cycle():
+    """Test cycle detection."""
+    graph = AdjacencyList(4)
+    graph.add_edge(0, 1)
+    graph.add_edge(1, 2)
+    graph.add_edge(2, 3)
+    graph.add_edge(3, 1)
+
+    with pytest.raises(CycleError) as excinfo:
+        graph.get_sorted_vertices()
+    assert excinfo.value.cycle == [2, 3, 1, 2]
+    assert str(excinfo.value) == "graph has cycle: 2 -> 3 -> 1 -> 2"
+
+    graph = AdjacencyList(2)
+    graph.add_edge(1, 1)
+    with pytest.raises(CycleError) as excinfo:
+        graph.get_sorted_vertices()
+    assert excinfo.value.cycle == [1, 1]
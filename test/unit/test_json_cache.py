@@ -0,0 +1,80 @@
+"""Test backend/kopano/resource serialized JSON cache."""
+from unittest.mock import Mock
+
+from grapi.api.v1.context import Context
+from grapi.backend.kopano import resource
+
+
+class ItemResource(resource.Resource):
+    fields = {
+        '@odata.etag': lambda item: 'W/"' + item.changekey + '"',
+        'id': lambda item: item.entryid,
+        'subject': lambda item: item.subject(),
+    }
+
+
+class UserScopedResource(ItemResource):
+    json_cache_per_user = True
+
+
+def _request(userid='user1', body_type=None):
+    req = Mock()
+    req.path = '/me/messages/ID'
+    req.context = Context()
+    req.context.userid = userid
+    req.context.prefer = Mock()
+    req.context.prefer.get.side_effect = lambda name: body_type if name == 'outlook.body-content-type' else None
+    return req
+
+
+def _item(changekey='AAA'):
+    item = Mock(entryid='ID', changekey=changekey)
+    item.subject.return_value = 'hello'
+    return item
+
+
+def test_json_cache_hit():
+    resource.JSON_CACHE.clear()
+    res = ItemResource(None)
+    item = _item()
+    data = res.json(_request(), item, None, res.fields)
+    assert res.json(_request(), item, None, res.fields) == data
+    assert item.subject.call_count == 1
+
+    # A different field set, body type or @odata.context is another entry.
+    res.json(_request(), item, {'id', '@odata.etag'}, res.fields, multi=True)
+    res.json(_request(body_type='text'), item, None, res.fields)
+    assert item.subject.call_count == 2
+
+
+def test_json_cache_changekey():
+    resource.JSON_CACHE.clear()
+    res = ItemResource(None)
+    item = _item()
+    res.json(_request(), item, None, res.fields)
+    item.changekey = 'BBB'
+    assert b'BBB' in res.json(_request(), item, None, res.fields)
+    assert item.subject.call_count == 2
+
+
+def test_json_cache_per_user():
+    resource.JSON_CACHE.clear()
+    res = UserScopedResource(None)
+    item = _item()
+    res.json(_request('user1'), item, None, res.fields)
+    res.json(_request('user2'), item, None, res.fields)
+    res.json(_request('user2'), item, None, res.fields)
+    assert item.subject.call_count == 2
+
+
+def test_json_cache_size():
+    cache = resource.JSONCache(3 * (resource.JSON_CACHE_ENTRY_OVERHEAD + 10))
+    for i in range(5):
+        cache.put(i, b'x' * 10)
+    assert cache.get(0) is None
+    assert cache.get(1) is None
+    assert cache.get(4) == b'x' * 10
+    assert cache.size <= cache.max_size
+
+    cache.put('big', b'x' * cache.max_size)
+    assert cache.get('big') is None
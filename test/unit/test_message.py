@@ -1,6 +1,7 @@
 """Test backend/kopano/message module."""
 from unittest.mock import Mock
 
+from grapi.api.v1.context import Context
 from grapi.backend.kopano import message
 
 
@@ -56,3 +57,26 @@ def test_set_subject():
     item = Mock()
     message.update_attr_value(item, "subject", "hello!")
     assert item.subject == "hello!"
+
+
+def test_prefetch_items():
+    """Test fetching the items of sibling batch GETs with one table query."""
+    items = [Mock(entryid='AA01'), Mock(entryid='AA02')]
+    folder = Mock()
+    folder.items.return_value = items
+    store = Mock()
+    store.item.return_value = Mock(folder=folder)
+    req = Mock()
+    req.context = Context()
+    req.context.server_store = (None, store, None)
+
+    resource = message.MessageResource(None)
+    resource.prefetch_items(req, {}, ['aa01', 'AA02', 'AA03'])
+    assert folder.items.call_count == 1
+    assert resource.get_item(req, store, 'aa01') is items[0]
+    assert resource.get_item(req, store, 'AA02') is items[1]
+
+    # Items outside the folder are opened on their own.
+    store.item.reset_mock()
+    resource.get_item(req, store, 'AA03')
+    store.item.assert_called_once_with('AA03')
@@ -1,4 +1,7 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
+import threading
+
+from grapi.api.v1.batch import BatchResource, Dispatcher, process_request
 
 
 def test_get_message(client):
@@ -21,3 +24,104 @@ def test_batch(client):
     assert result.json[0]['id'] == data['requests'][0]['id']
     assert result.json[0]['status'] == 200
     assert result.json[0]['body']['@odata.context'] == data['requests'][0]['url']
+
+
+def test_batch_levels(client):
+    data = {'requests': [
+        {'id': '1', 'method': 'GET', 'url': '/api/gc/v1/me/messages'},
+        {'id': '2', 'method': 'GET', 'url': '/api/gc/v1/me/nothing', 'dependsOn': ['1']},
+        {'id': '3', 'method': 'GET', 'url': '/api/gc/v1/me/messages', 'dependsOn': ['2']},
+        {'id': '4', 'method': 'GET', 'url': '/api/gc/v1/me/messages'},
+    ]}
+
+    result = client.simulate_post('/api/gc/v1/$batch', json=data)
+    assert result.status_code == 200
+    assert [(r['id'], r['status']) for r in result.json] == [('1', 200), ('4', 200), ('2', 404), ('3', 424)]
+
+
+def test_batch_cycle(client):
+    data = {'requests': [
+        {'id': '1', 'method': 'GET', 'url': '/api/gc/v1/me/messages', 'dependsOn': ['2']},
+        {'id': '2', 'method': 'GET', 'url': '/api/gc/v1/me/messages', 'dependsOn': ['1']},
+    ]}
+
+    result = client.simulate_post('/api/gc/v1/$batch', json=data)
+    assert result.status_code == 400
+    assert 'request has cycle: 2, 1, 2' in result.text
+
+
+def test_batch_id_gap(client):
+    data = {'requests': [
+        {'id': '1', 'method': 'GET', 'url': '/api/gc/v1/me/messages'},
+        {'id': '3', 'method': 'GET', 'url': '/api/gc/v1/me/messages', 'dependsOn': ['1']},
+    ]}
+
+    result = client.simulate_post('/api/gc/v1/$batch', json=data)
+    assert result.status_code == 400
+    assert 'request ID is outbound' in result.text
+
+    data['requests'][1]['id'] = '2'
+    data['requests'][1]['dependsOn'] = ['3']
+    result = client.simulate_post('/api/gc/v1/$batch', json=data)
+    assert result.status_code == 400
+
+
+def test_batch_not_modified():
+    graph, requests = process_request({'requests': [
+        {'id': '1', 'method': 'GET', 'url': '/api/gc/v1/me/messages/1'},
+        {'id': '2', 'method': 'GET', 'url': '/api/gc/v1/me/messages', 'dependsOn': ['1']},
+    ]})
+    responses = BatchResource._handle_result(graph, requests, 0, ('304 Not Modified', 'application/json', None))
+    assert len(responses) == 1
+    assert b'"status": 304' in b''.join(responses[0])
+    assert b'"error"' not in b''.join(responses[0])
+    assert not requests[1]['processed']
+
+
+def test_get_message_by_id(client):
+    result = client.simulate_get('/api/gc/v1/me/messages/1234')
+    assert result.status_code == 200
+    assert result.json['subject'] == 'test message'
+
+
+def test_batch_coalesce(client):
+    ids = ['1234', '1234', 'unknown'] * 4
+    data = {'requests': [
+        {'id': str(n), 'method': 'GET', 'url': '/api/gc/v1/me/messages/%s' % itemid} for n, itemid in enumerate(ids, 1)
+    ] + [{'id': '13', 'method': 'GET', 'url': '/api/gc/v1/me/messages'}]}
+
+    result = client.simulate_post('/api/gc/v1/$batch', json=data)
+    assert result.status_code == 200
+    assert sorted(int(r['id']) for r in result.json) == list(range(1, 14))
+    for r in result.json:
+        if r['id'] == '13':
+            assert r['status'] == 200
+        elif ids[int(r['id']) - 1] == 'unknown':
+            assert r['status'] == 404
+        else:
+            assert r['status'] == 200
+            assert r['body']['id'] == '1234'
+            assert r['body']['@odata.context'] == '/api/gc/v1/me/messages/1234'
+
+
+def test_batch_worker_sessions(client, monkeypatch):
+    seen = set()
+    dispatch = Dispatcher.dispatch
+
+    def record(self, req, request, store_cache, materialize=True, session_slot=0):
+        seen.add((threading.get_ident(), session_slot, id(store_cache)))
+        return dispatch(self, req, request, store_cache, materialize, session_slot)
+
+    monkeypatch.setattr(Dispatcher, 'dispatch', record)
+    data = {'requests': [
+        {'id': str(n), 'method': 'GET', 'url': '/api/gc/v1/me/messages'} for n in range(1, 9)
+    ]}
+    result = client.simulate_post('/api/gc/v1/$batch', json=data)
+    assert result.status_code == 200
+    assert len(result.json) == 8
+
+    # Every worker thread has a session slot and store cache of its own.
+    threads = {thread for thread, _, _ in seen}
+    assert len({slot for _, slot, _ in seen}) == len(threads)
+    assert len({cache for _, _, cache in seen}) == len(threads)
+    assert all(slot > 0 for _, slot, _ in seen)
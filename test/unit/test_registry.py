@@ -0,0 +1,53 @@
+"""Test backend/kopano/registry."""
+from grapi.api.v1.utils import affinity_worker
+from grapi.backend.kopano.registry import SubscriptionRegistry
+
+
+def _subscription(subscription_id):
+    return {
+        'id': subscription_id,
+        'resource': 'me/mailFolders/inbox/messages',
+        'notificationUrl': 'https://a.example.com/hook',
+        'expirationDateTime': '2030-01-01T00:00:00Z',
+    }
+
+
+def test_registry(tmp_path):
+    path = str(tmp_path / 'subscriptions.db')
+    registry = SubscriptionRegistry(path)
+    registry.put(_subscription('s1'), 'user1', True, 100)
+    registry.put(_subscription('s2'), 'user2', False, 200)
+    registry.put(_subscription('s3'), 'user2', False, 300)
+    registry.remove('s3')
+
+    # Expired subscriptions are not loaded and purged.
+    entries = SubscriptionRegistry(path).load(150)
+    assert [(e.subscription['id'], e.auth_userid, e.oidc, e.expiration) for e in entries] == [
+        ('s2', 'user2', False, 200),
+    ]
+    assert entries[0].subscription == _subscription('s2')
+    assert len(registry.load(0)) == 1
+
+
+def test_registry_workers(tmp_path):
+    path = str(tmp_path / 'subscriptions.db')
+    for worker in range(4):
+        SubscriptionRegistry(path, worker, 4).put(_subscription('s%d' % worker), 'user', False, 100)
+
+    # Subscriptions of workers which no longer exist are taken over.
+    assert [e.subscription['id'] for e in SubscriptionRegistry(path, 0, 2).load(0)] == ['s0', 's2']
+    assert [e.subscription['id'] for e in SubscriptionRegistry(path, 1, 2).load(0)] == ['s1', 's3']
+
+
+def test_registry_affinity(tmp_path):
+    path = str(tmp_path / 'subscriptions.db')
+    users = ['user%d' % n for n in range(8)]
+    for n, userid in enumerate(users):
+        SubscriptionRegistry(path, n % 3, 3).put(_subscription('s%d' % n), userid, False, 100)
+
+    # Subscriptions are taken over by the worker of their owner.
+    for worker in range(2):
+        entries = SubscriptionRegistry(path, worker, 2, affinity=True).load(0)
+        assert sorted(e.auth_userid for e in entries) == [
+            userid for userid in users if affinity_worker(userid, 2) == worker
+        ]
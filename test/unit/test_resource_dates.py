@@ -0,0 +1,49 @@
+"""Test backend/kopano/resource date formatting."""
+import datetime
+from unittest.mock import Mock
+
+from grapi.api.v1.context import Context
+from grapi.api.v1.timezone import to_timezone
+from grapi.backend.kopano import resource
+
+
+def _request(timezone=None):
+    req = Mock()
+    req.context = Context()
+    req.context.prefer = Mock()
+    req.context.prefer.get.return_value = (to_timezone(timezone), timezone) if timezone else None
+    return req
+
+
+def _dates():
+    d = datetime.datetime(2020, 1, 1, 0, 17, 42)
+    while d.year == 2020:
+        yield d
+        d += datetime.timedelta(minutes=97)
+
+
+def test_date_matches_strftime():
+    for d in _dates():
+        for local in (False, True):
+            for show_time in (False, True):
+                assert resource._date(d, local, show_time) == resource._date_strftime(d, local, show_time)
+
+
+def test_date_microseconds_and_none():
+    d = datetime.datetime(2020, 6, 1, 12, 0, 0, 5)
+    assert resource._date(d) == resource._date_strftime(d)
+    assert resource._date(None) == '0001-01-01T00:00:00Z'
+
+
+def test_tzdate_matches_astimezone():
+    for timezone in (None, 'W. Europe Standard Time', 'America/St_Johns', 'Asia/Kolkata'):
+        req = _request(timezone)
+        tzinfo = to_timezone(timezone) if timezone else resource.UTC
+        for d in _dates():
+            expected = resource.LOCAL.localize(d).astimezone(tzinfo).replace(tzinfo=None)
+            assert resource._tzdate(d, None, req) == {
+                'dateTime': expected.strftime('%Y-%m-%dT%H:%M:%S'),
+                'timeZone': timezone or 'UTC',
+            }
+        # Preference is resolved only once per request.
+        assert req.context.prefer.get.call_count == 1
@@ -0,0 +1,435 @@
+"""Test backend/kopano/subscription processing."""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Empty
+from threading import BoundedSemaphore
+from unittest.mock import Mock
+from urllib.parse import urlparse
+
+import falcon
+import pytest
+
+from grapi.api.v1 import config
+from grapi.backend.kopano import subscription
+
+
+class FakeDelivery:
+    def __init__(self, count):
+        self.count = count
+        self.posts = []
+        self.done = threading.Event()
+
+    def submit(self, url, data, subscription_ids, changed=None):
+        self.posts.append((url, data, subscription_ids))
+        if len(self.posts) == self.count:
+            self.done.set()
+
+
+def _subscription(subscription_id, url):
+    return {
+        'id': subscription_id,
+        'clientState': None,
+        'resource': 'me/mailFolders/inbox/messages',
+        'notificationUrl': url,
+        '_datatype': 'message',
+    }
+
+
+def _notification(entryid, event_type='created'):
+    notification = Mock(event_type=event_type)
+    notification.object.entryid = entryid
+    return notification
+
+
+def _process(entries, count):
+    queue = subscription.NotificationBuffer(100)
+    delivery = FakeDelivery(count)
+    subscription.SubscriptionProcessor(None, queue, delivery).start()
+    for sub, notification in entries:
+        subscription.SubscriptionSink(Mock(), None, sub, queue).update(notification)
+    assert delivery.done.wait(5)
+    return delivery.posts
+
+
+def test_processor_single(monkeypatch):
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_BATCH_SIZE', 1)
+    sub = _subscription('s1', 'https://a.example.com/hook')
+    posts = _process([(sub, _notification('1')), (sub, _notification('1'))], 1)
+
+    # Duplicates are filtered out by debouncing.
+    assert len(posts) == 1
+    url, data, subscription_id = posts[0]
+    assert url == 'https://a.example.com/hook'
+    assert subscription_id == ('s1',)
+    assert data['resourceData'] == {'@data.type': '#Microsoft.Graph.message', 'id': '1'}
+
+
+def test_processor_batches(monkeypatch):
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_BATCH_SIZE', 2)
+    sub1 = _subscription('s1', 'https://a.example.com/hook')
+    sub2 = _subscription('s2', 'https://a.example.com/hook')
+    sub3 = _subscription('s3', 'https://b.example.com/hook')
+    posts = _process([
+        (sub1, _notification('1')),
+        (sub3, _notification('2')),
+        (sub2, _notification('3')),
+        (sub1, _notification('4')),
+    ], 3)
+
+    assert [(url, subscription_id) for url, _, subscription_id in posts] == [
+        ('https://a.example.com/hook', ('s1', 's2')),
+        ('https://a.example.com/hook', ('s1',)),
+        ('https://b.example.com/hook', ('s3',)),
+    ]
+    assert [n['resourceData']['id'] for n in posts[0][1]['value']] == ['1', '3']
+    assert [n['resourceData']['id'] for n in posts[1][1]['value']] == ['4']
+
+
+def test_notification_buffer():
+    sub = _subscription('s1', 'https://a.example.com/hook')
+    buffer = subscription.NotificationBuffer(2)
+    records = [
+        subscription.new_record(sub, _notification('1')),
+        subscription.new_record(sub, _notification('2')),
+        subscription.new_record(sub, _notification('1', 'deleted')),
+    ]
+    assert buffer.put(records[0], 1.0)
+    assert buffer.put(records[1])
+    # Duplicates are merged even when full, new records are dropped.
+    assert buffer.put(subscription.new_record(sub, _notification('1')), 2.0)
+    assert not buffer.put(records[2])
+    assert (buffer.qsize(), buffer.coalesced, buffer.dropped) == (2, 1, 1)
+
+    # Merged records keep the time of the first change.
+    assert buffer.get() == (records[0], 1.0)
+    assert buffer.get(timeout=0)[0] == records[1]
+    with pytest.raises(Empty):
+        buffer.get(timeout=0.01)
+
+
+def _resource(monkeypatch, validations=1):
+    monkeypatch.setattr(subscription.SubscriptionResource, '_delivery', Mock(**{'circuit.return_value': 'closed'}))
+    monkeypatch.setattr(subscription.SubscriptionResource, '_validator', ThreadPoolExecutor(1))
+    monkeypatch.setattr(subscription.SubscriptionResource, '_validations', BoundedSemaphore(validations))
+    res = subscription.SubscriptionResource.__new__(subscription.SubscriptionResource)
+    res.options = None
+    return res
+
+
+def test_encrypted_resource_data(monkeypatch):
+    res = _resource(monkeypatch)
+    req = Mock()
+    req.context.json_data = {
+        'changeType': 'created',
+        'notificationUrl': 'https://a.example.com/hook',
+        'resource': 'me/messages',
+        'includeResourceData': True,
+        'encryptionCertificate': 'MIIB',
+    }
+    with pytest.raises(falcon.HTTPBadRequest):
+        res.on_post(req, Mock())
+
+
+def test_start_validation(monkeypatch):
+    hang = threading.Event()
+    monkeypatch.setattr(subscription.SubscriptionResource, '_validate_webhook', lambda *args: hang.wait(5))
+    res = _resource(monkeypatch)
+    url = urlparse('https://example.com/hook')
+
+    validation = res._start_validation(url, True, 's1', 'user')
+    with pytest.raises(falcon.HTTPServiceUnavailable):
+        res._start_validation(url, True, 's2', 'user')
+    hang.set()
+    validation.result(timeout=5)
+
+    res._delivery.circuit.return_value = 'open'
+    with pytest.raises(falcon.HTTPBadRequest):
+        res._start_validation(url, True, 's3', 'user')
+
+
+def test_validation_done(monkeypatch):
+    res = _resource(monkeypatch)
+    registry = Mock()
+    monkeypatch.setattr(subscription, 'REGISTRY', registry)
+    ok, failed = Future(), Future()
+    ok.set_result(None)
+    failed.set_exception(falcon.HTTPBadRequest())
+    sink = Mock()
+    expiration = '2030-01-01T00:00:00Z'
+    record = Mock(auth_userid='user', subscriptions={
+        's1': ({'_pending': True, 'id': 's1', 'expirationDateTime': expiration}, Mock(), 'user'),
+        's2': ({'_pending': True, 'id': 's2', 'expirationDateTime': expiration}, sink, 'user'),
+    })
+
+    # Pending subscriptions are persisted once validated.
+    subscription._persist(record, record.subscriptions['s1'][0], 0)
+    registry.put.assert_not_called()
+    res._validation_done(record, 's1', record.subscriptions['s1'][0], ok)
+    assert record.subscriptions['s1'][0] == {'id': 's1', 'expirationDateTime': expiration}
+    assert registry.put.call_count == 1
+    assert registry.put.call_args[0][0]['id'] == 's1'
+
+    res._validation_done(record, 's2', record.subscriptions['s2'][0], failed)
+    assert 's2' not in record.subscriptions
+    sink.unsubscribe.assert_called_once_with('s2')
+
+
+def test_restore_subscriptions(monkeypatch):
+    registry = Mock()
+    monkeypatch.setattr(subscription, 'REGISTRY', registry)
+    monkeypatch.setattr(subscription, 'PENDING_RESTORE', {})
+    errors = {
+        's2': falcon.HTTPNotFound(),
+        's3': subscription.kopano.errors.NotFoundError(),
+        's4': ConnectionError('server gone'),
+    }
+
+    def subscribe(record, json_data, *args):
+        if json_data['id'] in errors:
+            raise errors[json_data['id']]
+    monkeypatch.setattr(subscription, '_subscribe', subscribe)
+
+    subscriptions = [
+        dict(_subscription(subscription_id, 'https://a.example.com/hook'), expirationDateTime='2030-01-01T00:00:00Z')
+        for subscription_id in ('s1', 's2', 's3', 's4')
+    ]
+    subscriptions.append(dict(_subscription('s5', 'https://a.example.com/hook'), expirationDateTime='2000-01-01'))
+    subscription._restore_subscriptions(Mock(auth_userid='user'), subscriptions, None)
+
+    # Only definitive failures are removed, the others are retried.
+    assert [c[0][0] for c in registry.remove.call_args_list] == ['s2', 's3', 's5']
+    assert [s['id'] for s in subscription.PENDING_RESTORE['user']] == ['s4']
+
+
+@pytest.mark.parametrize('query', ['$top=abc', '$top=-1', '$skip=1.5', '$skip=\u00b2'])
+def test_subscription_list_invalid_paging(monkeypatch, query):
+    res = _resource(monkeypatch)
+    req = Mock(query_string=query)
+    with pytest.raises(falcon.HTTPBadRequest):
+        res.on_get(req, Mock())
+
+
+def test_user_record_concurrent(monkeypatch):
+    monkeypatch.setattr(subscription, 'RECORDS', {})
+    servers = []
+
+    def server(*args, **kwargs):
+        time.sleep(0.05)
+        servers.append(Mock())
+        return servers[-1]
+    monkeypatch.setattr(subscription, '_server', server)
+
+    # Requests of a user in several threads share one record and session.
+    with ThreadPoolExecutor(4) as executor:
+        records = list(executor.map(
+            lambda _: subscription._user_record('user', '', False, None), range(4)
+        ))
+    assert len(servers) == 1
+    assert all(record is records[0] for record in records)
+
+
+def test_subscription_exists(monkeypatch):
+    registry = Mock(**{'exists.return_value': False})
+    monkeypatch.setattr(subscription, 'REGISTRY', None)
+    # Spooled notifications are kept while the registry is not open yet.
+    assert subscription._subscription_exists('gone')
+    monkeypatch.setattr(subscription, 'REGISTRY', registry)
+    assert not subscription._subscription_exists('gone')
+
+
+def test_reconnect_skips_pending(monkeypatch):
+    monkeypatch.setattr(subscription, 'REGISTRY', Mock())
+    monkeypatch.setattr(subscription, 'PENDING_RESTORE', {})
+    missed, restored = [], []
+    monkeypatch.setattr(subscription, '_notify_missed', lambda sub: missed.append(sub['id']))
+    monkeypatch.setattr(
+        subscription, '_restore_subscriptions',
+        lambda record, subs, options: restored.extend(sub['id'] for sub in subs)
+    )
+    monkeypatch.setattr(subscription, '_server', lambda *args, **kwargs: Mock())
+    old = Mock(subscriptions={
+        's1': (_subscription('s1', 'https://a.example.com/hook'), Mock(), 'user'),
+        's2': (dict(_subscription('s2', 'https://a.example.com/hook'), _pending=True), Mock(), 'user'),
+    })
+    old.server.user.side_effect = ConnectionError('server restart')
+    monkeypatch.setattr(subscription, 'RECORDS', {'user': old})
+
+    record = subscription._user_record('user', '', False, None)
+    assert record is not old
+    # Subscriptions pending validation are not restored on the new record.
+    assert missed == ['s1']
+    assert restored == ['s1']
+
+
+def test_purge_records(monkeypatch):
+    monkeypatch.setattr(subscription, 'RECORDS', {'user1': Mock(subscriptions={}), 'user2': Mock(subscriptions={'s1': None})})
+    monkeypatch.setattr(subscription, 'USER_LOCKS', {})
+    subscription._user_lock('user1')
+    subscription._user_lock('user2')
+
+    subscription.SubscriptionPurger._purge_records()
+    assert list(subscription.RECORDS) == ['user2']
+    assert list(subscription.USER_LOCKS) == ['user2']
+
+
+def test_expiry_heap():
+    expiry = subscription.ExpiryHeap()
+    now = time.time()
+    expiry.set('s1', 'r1', now - 1)
+    expiry.set('s2', 'r2', now + 0.2)
+    expiry.set('s3', 'r3', now - 2)
+    expiry.discard('s3')
+    assert expiry.wait(0) == [('s1', 'r1')]
+    assert expiry.wait(0) == []
+
+    # Waits exactly until the next expiration.
+    start = time.monotonic()
+    assert expiry.wait(5) == [('s2', 'r2')]
+    assert time.monotonic() - start < 1
+
+    # Rescheduling replaces the previous expiration.
+    expiry.set('s4', 'r4', now - 1)
+    expiry.set('s4', 'r4', now + 60)
+    assert expiry.wait(0) == []
+    assert len(expiry) == 1
+
+
+def test_expiration_timestamp():
+    assert subscription._expiration_timestamp('2020-01-01T00:00:00Z') == 1577836800
+    assert subscription._expiration_timestamp('2020-01-01T00:00:00') == 1577836800
+    assert subscription._expiration_timestamp('2020-01-01T01:00:00+01:00') == 1577836800
+    with pytest.raises(ValueError):
+        subscription._expiration_timestamp('soon')
+
+
+def test_shared_sink():
+    queue = subscription.NotificationBuffer(100)
+    store = Mock()
+    sinks = {}
+    sub1 = _subscription('s1', 'https://a.example.com/hook')
+    sub2 = _subscription('s2', 'https://b.example.com/hook')
+    sub3 = dict(_subscription('s3', 'https://c.example.com/hook'), _pending=True)
+
+    assert subscription.SubscriptionSink.attach(sinks, 'key', sub1) is None
+    sink = subscription.SubscriptionSink(store, None, sub1, queue, sinks, 'key')
+    sink.register()
+    assert subscription.SubscriptionSink.attach(sinks, 'key', sub2) is sink
+    assert subscription.SubscriptionSink.attach(sinks, 'key', sub3) is sink
+
+    # Fanned out to all subscriptions which are not pending.
+    notification = _notification('1')
+    sink.update(notification)
+    assert [queue.get(timeout=0)[0].subscriptionId for _ in range(queue.qsize())] == ['s1', 's2']
+
+    sink.unsubscribe('s1')
+    sink.unsubscribe('s3')
+    store.unsubscribe.assert_not_called()
+    sink.unsubscribe('s2')
+    store.unsubscribe.assert_called_once_with(sink)
+    assert sinks == {}
+    assert subscription.SubscriptionSink.attach(sinks, 'key', sub1) is None
+
+
+def test_lifecycle_notification(monkeypatch):
+    delivery = FakeDelivery(2)
+    monkeypatch.setattr(subscription.SubscriptionResource, '_delivery', delivery)
+    sub = _subscription('s1', 'https://a.example.com/hook')
+    sub['expirationDateTime'] = '2030-01-01T00:00:00Z'
+    subscription._notify_missed(sub)
+    sub['lifecycleNotificationUrl'] = 'https://b.example.com/lifecycle'
+    subscription._notify_missed(sub)
+
+    assert [(url, subscription_id) for url, _, subscription_id in delivery.posts] == [
+        ('https://a.example.com/hook', ('s1',)),
+        ('https://b.example.com/lifecycle', ('s1',)),
+    ]
+    assert delivery.posts[0][1] == {'value': [{
+        'subscriptionId': 's1',
+        'subscriptionExpirationDateTime': '2030-01-01T00:00:00Z',
+        'clientState': None,
+        'lifecycleEvent': 'missed',
+    }]}
+
+
+def test_subscription_index():
+    index = subscription.SubscriptionIndex()
+    record1, record2 = Mock(), Mock()
+    for n in range(5):
+        index.add('a%d' % n, record1, 'user1', {'id': 'a%d' % n})
+    index.add('b0', record2, 'user2', {'id': 'b0'})
+    index.discard('a1')
+    index.discard('unknown')
+
+    assert len(index) == 5
+    assert index.count('user1') == 4
+    assert index.get('a0', 'user1') is record1
+    assert index.get('b0', 'user2') is record2
+    # Subscriptions of other users are not found.
+    assert index.get('b0', 'user1') is None
+    assert index.get('a1', 'user1') is None
+
+    page, more = index.page('user1', 0, 2)
+    assert [s['id'] for s in page] == ['a0', 'a2'] and more
+    page, more = index.page('user1', 2, 2)
+    assert [s['id'] for s in page] == ['a3', 'a4'] and not more
+    assert index.page('user3', 0, 2) == ([], False)
+
+    index.discard('b0')
+    assert index.count('user2') == 0
+
+
+def test_rich_notifications(monkeypatch):
+    from grapi.backend.kopano.resource import Resource
+
+    serialized = []
+
+    class FakeResource(Resource):
+        fields = {'subject': lambda item: serialized.append(item) or item.subject}
+        complementary_fields = {'size': lambda req, item: len(req.context.user_store)}
+
+    monkeypatch.setitem(subscription.RESOURCE_DATA_RESOURCES, 'message', FakeResource(None))
+    sub1 = _subscription('s1', 'https://a.example.com/hook')
+    sub2 = _subscription('s2', 'https://a.example.com/hook')
+    sub3 = _subscription('s3', 'https://a.example.com/hook')
+    sub4 = _subscription('s4', 'https://a.example.com/hook')
+    for sub in (sub1, sub2, sub4):
+        sub['includeResourceData'] = True
+    sub4['_select'] = ('size',)
+
+    queue = subscription.NotificationBuffer(100)
+    sink = subscription.SubscriptionSink('store', None, sub1, queue)
+    sink.subscriptions.update({'s2': sub2, 's3': sub3, 's4': sub4})
+    notification = _notification('1', 'updated')
+    notification.object.subject = 'hello'
+    sink.update(notification)
+    # Repeated changes are merged, regardless of the resource data.
+    sink.update(notification)
+    assert queue.qsize() == 4 and queue.coalesced == 4
+    # Serialized by the processor, not on the notification thread.
+    assert serialized == []
+
+    records = [queue.get(0)[0] for _ in range(4)]
+    data = [dict(subscription.gen_notification(record)['resourceData']) for record in records]
+    # Serialized once for all subscriptions which select the same fields.
+    assert records[0].resourceData is records[1].resourceData
+    assert len(serialized) == 1
+    assert data[0] == {'@data.type': '#Microsoft.Graph.message', 'id': '1', 'subject': 'hello'}
+    assert data[2] == {'@data.type': '#Microsoft.Graph.message', 'id': '1'}
+    assert data[3] == {'@data.type': '#Microsoft.Graph.message', 'id': '1', 'size': 5}
+
+
+@pytest.mark.parametrize('resource,expected', [
+    ('me/messages', ('MessageResource', {})),
+    ('/me/mailFolders/inbox/messages', ('MessageResource', {'folderid': 'inbox'})),
+    ("me/mailFolders('AAAA')/messages", ('MessageResource', {'folderid': 'AAAA'})),
+    ('users/u1/calendar/events', ('EventResource', {'userid': 'u1'})),
+    ('me/calendars/AAAA/events', ('EventResource', {'folderid': 'AAAA'})),
+    ('me/contacts/', ('ContactResource', {})),
+    ('me/contactFolders/AAAA/contacts', ('ContactResource', {'folderid': 'AAAA'})),
+    ('me/mailFolders/inbox', None),
+    ('me/messages/AAAA/attachments', None),
+    ('groups/g1/events', None),
+])
+def test_subscription_resources(resource, expected):
+    assert subscription.SUBSCRIPTION_RESOURCES.match(resource) == expected
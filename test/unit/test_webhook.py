@@ -0,0 +1,303 @@
+"""Test backend/kopano/webhook delivery."""
+import os
+import threading
+import time
+from unittest.mock import Mock
+
+from grapi.api.v1 import config
+from grapi.backend.kopano import webhook
+
+
+class FakeSession:
+    def __init__(self, hang=None, status_codes=()):
+        self.hang = hang
+        self.status_codes = list(status_codes)
+        self.posts = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.done = threading.Semaphore(0)
+
+    def post(self, url, json=None, timeout=None, verify=True):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        if self.hang is not None:
+            self.hang.wait(5)
+        with self.lock:
+            self.active -= 1
+            self.posts.append((url, json))
+            status_code = self.status_codes.pop(0) if self.status_codes else 202
+        self.done.release()
+        if status_code is None:
+            raise ConnectionError('connection refused')
+        return Mock(status_code=status_code)
+
+    def close(self):
+        pass
+
+
+def _delivery(monkeypatch, sessions, spool=None):
+    monkeypatch.setattr(webhook, '_new_session', lambda: sessions.pop(0))
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_SPOOL_MAXSIZE', 0)
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_RETRY_DELAY', 0.01)
+    return webhook.WebhookDelivery(Mock(insecure=False, with_metrics=False), spool=spool)
+
+
+def test_host_key():
+    assert webhook.host_key('https://Example.com:8443/hook?x=1') == 'https://example.com:8443'
+    assert webhook.host_key('http://example.com/hook') == 'http://example.com'
+
+
+def test_slow_host_does_not_block_others(monkeypatch):
+    hang = threading.Event()
+    slow, fast = FakeSession(hang), FakeSession()
+    delivery = _delivery(monkeypatch, [slow, fast])
+
+    count = config.SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY * 3
+    for i in range(count):
+        delivery.submit('https://slow.example.com/hook', {'n': i}, ('slow',))
+    for i in range(count):
+        delivery.submit('https://fast.example.com/hook', {'n': i}, ('fast',))
+
+    for _ in range(count):
+        assert fast.done.acquire(timeout=5)
+    assert not slow.posts
+    assert fast.max_active <= config.SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY
+
+    hang.set()
+    for _ in range(count):
+        assert slow.done.acquire(timeout=5)
+    assert slow.max_active == config.SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY
+    assert sorted(data['n'] for _, data in slow.posts) == list(range(count))
+
+
+def test_host_queue_drops_oldest(monkeypatch):
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY', 1)
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_HOST_QUEUE_MAXSIZE', 2)
+    hang = threading.Event()
+    session = FakeSession(hang)
+    delivery = _delivery(monkeypatch, [session])
+
+    for i in range(5):
+        delivery.submit('https://example.com/hook', {'n': i}, ('id',))
+    hang.set()
+    for _ in range(3):
+        assert session.done.acquire(timeout=5)
+    assert [data['n'] for _, data in session.posts] == [0, 3, 4]
+
+
+def test_host_queue_overflow_is_spooled(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY', 1)
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_HOST_QUEUE_MAXSIZE', 2)
+    hang = threading.Event()
+    session = FakeSession(hang)
+    spool = webhook.WebhookSpool(str(tmp_path), 10)
+    delivery = _delivery(monkeypatch, [session], spool=spool)
+
+    for i in range(5):
+        delivery.submit('https://example.com/hook', {'n': i}, ('id',))
+    assert [n.data['n'] for n in spool.replay()] == [1, 2]
+    hang.set()
+
+
+def test_close_idle(monkeypatch):
+    session = FakeSession()
+    delivery = _delivery(monkeypatch, [session])
+    delivery.submit('https://example.com/hook', {}, ('id',))
+    assert session.done.acquire(timeout=5)
+
+    delivery.close_idle(60)
+    assert len(delivery._hosts) == 1
+    delivery.close_idle(-1)
+    assert not delivery._hosts
+
+
+def test_backoff_delay(monkeypatch):
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_RETRY_DELAY', 1)
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_RETRY_MAX_DELAY', 10)
+    assert 0.5 <= webhook.backoff_delay(1) <= 1
+    assert 2 <= webhook.backoff_delay(3) <= 4
+    assert 5 <= webhook.backoff_delay(10) <= 10
+
+
+def test_retry(monkeypatch):
+    session = FakeSession(status_codes=[None, 503, 202])
+    delivery = _delivery(monkeypatch, [session])
+    delivery.submit('https://example.com/hook', {'n': 1}, ('id',))
+    for _ in range(3):
+        assert session.done.acquire(timeout=5)
+    assert len(session.posts) == 3
+
+
+def test_rejected_is_not_retried(monkeypatch):
+    session = FakeSession(status_codes=[None, 410])
+    delivery = _delivery(monkeypatch, [session])
+    delivery.submit('https://example.com/hook', {'n': 1}, ('id',))
+    for _ in range(2):
+        assert session.done.acquire(timeout=5)
+    assert not session.done.acquire(timeout=0.2)
+    assert delivery.dropped == 1
+    # A rejection is no successful delivery for the circuit breaker.
+    assert delivery._hosts['https://example.com'].breaker.failures == 1
+
+
+def test_spool_and_replay(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_MAX_ATTEMPTS', 2)
+    spool = webhook.WebhookSpool(str(tmp_path), 10)
+    session = FakeSession(status_codes=[500, 500])
+    delivery = _delivery(monkeypatch, [session], spool=spool)
+    delivery.submit('https://example.com/hook', {'n': 1}, ('id',))
+    for _ in range(2):
+        assert session.done.acquire(timeout=5)
+    for _ in range(50):
+        if spool.depth:
+            break
+        time.sleep(0.01)
+    assert spool.depth == 1
+
+    delivery.replay_spool()
+    assert session.done.acquire(timeout=5)
+    assert session.posts[-1] == ('https://example.com/hook', {'n': 1})
+    assert spool.depth == 0
+    assert not os.listdir(str(tmp_path))
+
+
+def test_replay_keeps_attempts_and_age(tmp_path):
+    spool = webhook.WebhookSpool(str(tmp_path), 10)
+    notification = webhook.Notification('https://example.com/hook', {}, ('id',), attempt=3)
+    notification.created -= 100
+    assert spool.append(notification)
+    replayed, = spool.replay()
+    assert replayed.attempt == 3
+    assert 99 < time.monotonic() - replayed.created < 110
+
+
+def test_replay_feeds_host_queue(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_HOST_CONCURRENCY', 1)
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_HOST_QUEUE_MAXSIZE', 2)
+    spool = webhook.WebhookSpool(str(tmp_path), 100)
+    for i in range(50):
+        spool.append(webhook.Notification('https://example.com/hook', {'n': i}, ('id',)))
+    session = FakeSession()
+    delivery = _delivery(monkeypatch, [session])
+    delivery.spool = spool
+
+    delivery.replay_spool()
+    for _ in range(50):
+        assert session.done.acquire(timeout=5)
+    assert sorted(data['n'] for _, data in session.posts) == list(range(50))
+    assert spool.depth == 0
+
+
+def test_replay_drops_expired_and_deleted(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_SPOOL_MAX_AGE', 60)
+    spool = webhook.WebhookSpool(str(tmp_path), 10)
+    expired = webhook.Notification('https://example.com/hook', {'n': 1}, ('id',))
+    expired.created -= 120
+    spool.append(expired)
+    spool.append(webhook.Notification('https://example.com/hook', {'n': 2}, ('deleted',)))
+    spool.append(webhook.Notification('https://example.com/hook', {'n': 3}, ('id',)))
+    # Batched posts keep the notifications of the remaining subscriptions.
+    spool.append(webhook.Notification('https://example.com/hook', {'n': 4, 'value': [
+        {'subscriptionId': 'deleted'}, {'subscriptionId': 'id'},
+    ]}, ('deleted', 'id')))
+    session = FakeSession()
+    delivery = _delivery(monkeypatch, [session])
+    delivery.spool = spool
+    delivery.exists = lambda subscription_id: subscription_id != 'deleted'
+
+    delivery.replay_spool()
+    for _ in range(2):
+        assert session.done.acquire(timeout=5)
+    assert not session.done.acquire(timeout=0.2)
+    posts = sorted((data for _, data in session.posts), key=lambda data: data['n'])
+    assert posts == [{'n': 3}, {'n': 4, 'value': [{'subscriptionId': 'id'}]}]
+    assert spool.depth == 0
+
+
+def test_replay_single_host(monkeypatch, tmp_path):
+    spool = webhook.WebhookSpool(str(tmp_path), 10)
+    spool.append(webhook.Notification('https://a.example.com/hook', {'n': 1}, ('id',)))
+    spool.append(webhook.Notification('https://b.example.com/hook', {'n': 2}, ('id',)))
+    session = FakeSession()
+    delivery = _delivery(monkeypatch, [session])
+    delivery.spool = spool
+
+    delivery.replay_spool('https://a.example.com')
+    assert session.done.acquire(timeout=5)
+    assert session.posts == [('https://a.example.com/hook', {'n': 1})]
+    assert [n.url for n in spool.replay()] == ['https://b.example.com/hook']
+
+
+def test_spool_claims_files_of_dead_workers(tmp_path):
+    spool = webhook.WebhookSpool(str(tmp_path), 1)
+    assert spool.append(webhook.Notification('https://example.com/hook', {}, ('id',)))
+    assert not spool.append(webhook.Notification('https://example.com/hook', {}, ('id',)))
+    spool._file.close()
+    spool._file = None
+    name = os.listdir(str(tmp_path))[0]
+
+    # A file of a live process is left alone, one of a dead process is taken.
+    live = name.replace('spool-{}-'.format(os.getpid()), 'spool-1-')
+    dead = name.replace('spool-{}-'.format(os.getpid()), 'spool-999999999-')
+    os.rename(str(tmp_path / name), str(tmp_path / live))
+    with open(str(tmp_path / dead), 'wb') as f:
+        f.write(b'{"url": "https://example.com/hook", "subscriptionIds": ["x"], "data": {}}\n{"url"')
+    replayed = list(spool.replay())
+    assert [n.subscription_id for n in replayed] == ['x']
+    assert os.listdir(str(tmp_path)) == [live]
+
+
+def test_circuit_breaker():
+    breaker = webhook.CircuitBreaker(2, 10)
+    assert not breaker.failure(0)
+    assert breaker.current(0) == webhook.CLOSED
+    assert breaker.failure(1)
+    assert breaker.current(5) == webhook.OPEN
+    assert breaker.current(11) == webhook.HALF_OPEN
+
+    # A failed probe opens the circuit again, a successful one closes it.
+    assert breaker.failure(11)
+    assert breaker.current(20) == webhook.OPEN
+    assert breaker.current(21) == webhook.HALF_OPEN
+    assert breaker.success()
+    assert breaker.current(21) == webhook.CLOSED
+    assert not breaker.success()
+
+    assert not webhook.CircuitBreaker(0, 10).failure(0)
+
+
+def test_open_circuit_spools(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'SUBSCRIPTION_NOTIFY_BREAKER_THRESHOLD', 2)
+    spool = webhook.WebhookSpool(str(tmp_path), 10)
+    session = FakeSession(status_codes=[None, None])
+    delivery = _delivery(monkeypatch, [session], spool=spool)
+    delivery.submit('https://example.com/hook', {'n': 1}, ('id',))
+    for _ in range(2):
+        assert session.done.acquire(timeout=5)
+    for _ in range(50):
+        if spool.depth:
+            break
+        time.sleep(0.01)
+    assert spool.depth == 1
+    assert delivery.circuits()[webhook.OPEN] == 1
+
+    # No posts while the circuit is open.
+    delivery.submit('https://example.com/hook', {'n': 2}, ('id',))
+    assert spool.depth == 2
+    assert not session.done.acquire(timeout=0.2)
+
+    # After the cool-down a successful probe closes the circuit and the
+    # spool is replayed.
+    delivery._hosts['https://example.com'].breaker.cooldown = 0
+    delivery.submit('https://example.com/hook', {'n': 3}, ('id',))
+    for _ in range(3):
+        assert session.done.acquire(timeout=5)
+    assert sorted(data['n'] for _, data in session.posts[2:]) == [1, 2, 3]
+    assert delivery.circuits()[webhook.CLOSED] == 1
+
+
+def test_metric_labels():
+    labels = webhook.MetricLabels(2)
+    assert [labels.get(host) for host in ('a', 'b', 'c', 'a', 'd', 'b')] == ['a', 'b', 'other', 'a', 'other', 'b']